@@ -1,21 +1,45 @@
 
 from fastapi import APIRouter, HTTPException, status
-from fastapi.responses import JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from pydantic import BaseModel, HttpUrl
 from typing import List, Optional
-import requests
 import json
+import logging
+import asyncio
 from fastapi import Query
-from openai import OpenAI
 from dotenv import load_dotenv
 import os
 from pydantic import BaseModel
-from app.vector_db import collection
-from app.embedding import get_embedding
-from app.vector_db import add_chunk_to_db, query_chunks, get_chunks_by_doc_id
+from fastapi.concurrency import run_in_threadpool
+from app.embedding import aget_embedding, aget_embeddings, embedding_cache, provider
+from app.compact_vectors import storage_stats
+from app.vector_db import add_chunk_to_db, query_chunks, query_chunks_batch, get_chunks_by_doc_id
+from app.vector_db import get_chunk_ids_by_doc_id, get_chunks_by_ids, get_chunks_page, count_chunks, backend_stats
+from app.vector_db import ATTRIBUTE_PREFIX, build_where, get_existing_ids
+from app.models import Chunk
+from app.catalog import catalog
+from app.jobs import job_manager
+from app.watcher import watcher
+from app.usage import usage_counter
+from app.compare import compare, compare_stream
+from app.summarize import summarize_document, summarize_document_stream
+from app.metrics import stage
+from app.lexical import lexical_index, reciprocal_rank_fusion
+from app.snapshots import SNAPSHOT_DIR, export_snapshot, list_snapshots, restore_snapshot, snapshot_path
+from app.workers import worker
+from app.rag import ASK_CANDIDATE_MULTIPLIER, ASK_CONTEXT_TOKENS, answer, answer_stream, select_context
 
 load_dotenv()
-client = OpenAI()
+logger = logging.getLogger(__name__)
+
+# Page size used when reading from Chroma for exports, and the largest page a client may ask for
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "500"))
+EXPORT_MAX_LIMIT = int(os.getenv("EXPORT_MAX_LIMIT", "10000"))
+
+# Hybrid search: candidates taken from each ranking per requested result, and the RRF rank constant
+HYBRID_CANDIDATE_MULTIPLIER = int(os.getenv("HYBRID_CANDIDATE_MULTIPLIER", "3"))
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+SEARCH_MODES = ("vector", "lexical", "hybrid")
 
 router = APIRouter()
 
@@ -23,29 +47,17 @@ router = APIRouter()
 def health_check():
     return {"message": "GenAI API is running"}
 
-# Define the chunk schema
-class Chunk(BaseModel):
-    id: str
-    source_doc_id: str
-    chunk_index: int
-    section_heading: str
-    journal: str
-    publish_year: int
-    usage_count: int
-    attributes: List[str]
-    link: Optional[str] = None
-    doi: Optional[str] = None
-    text: str
-
 # Define the upload request schema
 class UploadRequest(BaseModel):
     file_url: Optional[HttpUrl] = None
     chunks: Optional[List[Chunk]] = None
     schema_version: str
+    # Treat each uploaded document as complete: its stored chunks that are not in the upload are deleted
+    replace_documents: bool = True
 
 # Endpoint to upload chunks
 @router.put("/api/upload", status_code=status.HTTP_202_ACCEPTED)
-def upload_chunks(request: UploadRequest):
+async def upload_chunks(request: UploadRequest):
     if not request.file_url and not request.chunks:
         raise HTTPException(status_code=400, detail="Either file_url or chunks must be provided")
     if request.file_url and request.chunks:
@@ -54,149 +66,415 @@ def upload_chunks(request: UploadRequest):
     if not request.schema_version:
         raise HTTPException(status_code=400, detail="schema_version is required")
 
-    chunks = []
-    if request.file_url:
-        try:
-            response = requests.get(request.file_url)
-            response.raise_for_status()
-            chunks_data = response.json()
-            chunks = [Chunk(**chunk) for chunk in chunks_data]
-        except requests.RequestException as e:
-            raise HTTPException(status_code=500, detail=f"Failed to fetch file from URL: {str(e)}")
-        except (json.JSONDecodeError, ValueError) as e:
-            raise HTTPException(status_code=400, detail=f"Invalid JSON format in file: {str(e)}")
-    else:
-        chunks = request.chunks
-
+    # Embedding and writing happen in a background job; the client polls /api/jobs/{job_id}
     try:
-        for chunk in chunks:
-            embedding = get_embedding(chunk.text)
-            metadata_raw = {
-                "source_doc_id": chunk.source_doc_id,
-                "chunk_index": chunk.chunk_index,
-                "section_heading": chunk.section_heading,
-                "journal": chunk.journal,
-                "publish_year": chunk.publish_year,
-                "usage_count": chunk.usage_count,
-                "attributes": ",".join(chunk.attributes),
-                "link": chunk.link,
-                "doi": chunk.doi,
-                "text": chunk.text,
-                "schema_version": request.schema_version
-            }
-            metadata = {k: v for k, v in metadata_raw.items() if v is not None}
-            add_chunk_to_db(id=chunk.id, embedding=embedding, metadata=metadata)
+        if request.file_url:
+            job_id = await run_in_threadpool(
+                job_manager.submit_url, str(request.file_url), request.schema_version, request.replace_documents
+            )
+        else:
+            job_id = await run_in_threadpool(
+                job_manager.submit_chunks, request.chunks, request.schema_version, request.replace_documents
+            )
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to process chunks: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to queue ingestion job: {str(e)}")
 
     return JSONResponse(
-        content={"message": f"{len(chunks)} chunks uploaded successfully."},
+        content={
+            "message": "Ingestion job queued.",
+            "job_id": job_id,
+            "status_url": f"/api/jobs/{job_id}"
+        },
         status_code=status.HTTP_202_ACCEPTED
     )
 
+# Endpoint to check the progress of an ingestion job
+@router.get("/api/jobs/{job_id}")
+def get_job_status(job_id: str):
+    job = job_manager.status(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No ingestion job found with id: {job_id}")
+    return job
+
+# Throughput, backlog and failures of the directory watcher (WATCH_DIR)
+@router.get("/api/watcher")
+def get_watcher_status():
+    if watcher is None:
+        raise HTTPException(status_code=404, detail="Directory watcher is not enabled (set WATCH_DIR)")
+    return watcher.stats()
+
+# Binary snapshots of the vector store: create, list, download (e.g. to seed another node) and restore.
+# A restore replaces the store unless replace=false, which upserts the snapshot into it.
+@router.post("/api/snapshots", status_code=status.HTTP_201_CREATED)
+async def create_snapshot():
+    try:
+        result = await run_in_threadpool(export_snapshot, snapshot_path())
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"name": os.path.basename(result["path"]), **result}
+
+@router.get("/api/snapshots")
+def get_snapshots():
+    return {"snapshots": list_snapshots()}
+
+def find_snapshot(name: str) -> str:
+    path = os.path.join(SNAPSHOT_DIR, name)
+    if name != os.path.basename(name) or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail=f"No snapshot named: {name}")
+    return path
+
+@router.get("/api/snapshots/{name}")
+def download_snapshot(name: str):
+    return FileResponse(find_snapshot(name), media_type="application/octet-stream", filename=name)
+
+@router.post("/api/snapshots/{name}/restore")
+async def restore_from_snapshot(name: str, replace: bool = True):
+    path = find_snapshot(name)
+    if not worker.is_writer:
+        raise HTTPException(status_code=409, detail="Restores run on the writer worker; retry the request")
+    try:
+        return await run_in_threadpool(restore_snapshot, path, replace=replace)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
 # Search request schema
 class SearchRequest(BaseModel):
     query: str
     k: Optional[int] = 10
     min_score: Optional[float] = 0.25
+    # vector (embeddings), lexical (BM25 only, no embedding call) or hybrid (both, fused by rank)
+    mode: Optional[str] = "vector"
+    # Filters, pushed down into the vector query
+    journal: Optional[str] = None
+    year_from: Optional[int] = None
+    year_to: Optional[int] = None
+    attributes: Optional[List[str]] = None
+
+def search_where(request) -> Optional[dict]:
+    if request.year_from is not None and request.year_to is not None and request.year_from > request.year_to:
+        raise HTTPException(status_code=400, detail="year_from must not be greater than year_to")
+    return build_where(request.journal, request.year_from, request.year_to, request.attributes)
+
+# Stored metadata without the internal attr_<name> filter keys
+def public_metadata(metadata: dict) -> dict:
+    return {key: value for key, value in metadata.items() if not key.startswith(ATTRIBUTE_PREFIX)}
+
+# Format one batch of query results into matches above min_score
+def format_matches(ids, docs, metadatas, distances, min_score: float) -> List[dict]:
+    formatted = []
+    for doc_id, doc, metadata, distance in zip(ids, docs, metadatas, distances):
+        if not isinstance(metadata, dict):
+            logger.warning("Invalid metadata format for id %s", doc_id)
+            continue
+
+        chunk_data = public_metadata(metadata)
+        chunk_data["id"] = doc_id
+        chunk_data["text"] = doc
+        chunk_data["usage_count"] = chunk_data.get("usage_count", 0) + usage_counter.pending_count(doc_id)
+        chunk_data["similarity_score"] = round(1 - distance, 3)  # Convert distance to similarity
+
+        # Deserialize attributes from comma-separated string to list
+        if "attributes" in chunk_data and isinstance(chunk_data["attributes"], str):
+            chunk_data["attributes"] = chunk_data["attributes"].split(",")
+        else:
+            chunk_data["attributes"] = []
+
+        if chunk_data["similarity_score"] >= min_score:
+            formatted.append(chunk_data)
+
+    # Sort results by similarity score descending
+    return sorted(formatted, key=lambda x: x["similarity_score"], reverse=True)
+
+# Count chunks returned to a client; the counts reach Chroma with the next usage flush
+def record_usage(matches: List[dict]) -> List[dict]:
+    usage_counter.record(match["id"] for match in matches)
+    return matches
+
+# BM25 hits as matches, in rank order
+def lexical_matches(hits) -> List[dict]:
+    scores = dict(hits)
+    with stage("postprocess"):
+        formatted = fetch_formatted_chunks(list(scores)) if scores else []
+        for chunk_data in formatted:
+            chunk_data["bm25_score"] = round(scores[chunk_data["id"]], 3)
+    return sorted(formatted, key=lambda x: x["bm25_score"], reverse=True)
+
+# BM25 does not know the metadata: the lexical index checks its ranked ids against where page by page
+def where_filter(where: Optional[dict]):
+    if not where:
+        return None
+    return lambda ids: get_existing_ids(ids, where)
+
+# Vector matches (above min_score) and BM25 hits fused with reciprocal rank fusion
+def hybrid_matches(vector_matches: List[dict], hits, k: int) -> List[dict]:
+    bm25_scores = dict(hits)
+    fused = reciprocal_rank_fusion([[match["id"] for match in vector_matches], list(bm25_scores)], HYBRID_RRF_K)
+    top = sorted(fused, key=fused.get, reverse=True)[:k]
+
+    by_id = {match["id"]: match for match in vector_matches}
+    missing = [chunk_id for chunk_id in top if chunk_id not in by_id]
+    if missing:
+        by_id.update((chunk_data["id"], chunk_data) for chunk_data in fetch_formatted_chunks(missing))
+
+    formatted = []
+    for chunk_id in top:
+        if chunk_id not in by_id:
+            continue
+        chunk_data = by_id[chunk_id]
+        chunk_data.setdefault("similarity_score", None)
+        chunk_data["bm25_score"] = round(bm25_scores[chunk_id], 3) if chunk_id in bm25_scores else None
+        chunk_data["rrf_score"] = round(fused[chunk_id], 5)
+        formatted.append(chunk_data)
+    return formatted
 
 # Endpoint for similarity search
 @router.post("/api/similarity_search")
-def search_similar_chunks(request: SearchRequest):
+async def search_similar_chunks(request: SearchRequest):
+    if request.mode not in SEARCH_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of: {', '.join(SEARCH_MODES)}")
+    where = search_where(request)
+
     try:
-        embedding = get_embedding(request.query)
-        results = query_chunks(embedding=embedding, k=request.k)
+        if request.mode == "lexical":
+            hits = await run_in_threadpool(
+                lexical_index.search, request.query, request.k, where_filter(where),
+                request.k * HYBRID_CANDIDATE_MULTIPLIER
+            )
+            return {"matches": record_usage(await run_in_threadpool(lexical_matches, hits))}
+
+        if request.mode == "hybrid":
+            candidates = request.k * HYBRID_CANDIDATE_MULTIPLIER
+            embedding, hits = await asyncio.gather(
+                aget_embedding(request.query),
+                run_in_threadpool(lexical_index.search, request.query, candidates, where_filter(where), candidates)
+            )
+            results = await run_in_threadpool(query_chunks, embedding=embedding, k=candidates, where=where)
+            with stage("postprocess"):
+                vector_matches = format_matches(
+                    results['ids'][0],
+                    results['documents'][0],
+                    results['metadatas'][0],
+                    results['distances'][0],
+                    request.min_score
+                )
+            matches = await run_in_threadpool(hybrid_matches, vector_matches, hits, request.k)
+            return {"matches": record_usage(matches)}
+
+        embedding = await aget_embedding(request.query)
+        results = await run_in_threadpool(query_chunks, embedding=embedding, k=request.k, where=where)
 
         # Unpack the first (and only) batch of results
-        ids = results['ids'][0]
-        docs = results['documents'][0]
-        metadatas = results['metadatas'][0]
-        distances = results['distances'][0]
-
-        formatted = []
-        for doc_id, doc, metadata, distance in zip(ids, docs, metadatas, distances):
-            if not isinstance(metadata, dict):
-                print(f"Debug: Invalid metadata format for id {doc_id}: {metadata}")
-                continue
-
-            chunk_data = metadata.copy()
-            chunk_data["id"] = doc_id
-            chunk_data["text"] = doc
-            chunk_data["similarity_score"] = round(1 - distance, 3)  # Convert distance to similarity
-
-            # Deserialize attributes from comma-separated string to list
-            if "attributes" in chunk_data and isinstance(chunk_data["attributes"], str):
-                chunk_data["attributes"] = chunk_data["attributes"].split(",")
-            else:
-                chunk_data["attributes"] = []
-
-            if chunk_data["similarity_score"] >= request.min_score:
-                formatted.append(chunk_data)
-
-        # Sort results by similarity score descending
-        formatted = sorted(formatted, key=lambda x: x["similarity_score"], reverse=True)
-
-        return {"matches": formatted}
+        with stage("postprocess"):
+            formatted = format_matches(
+                results['ids'][0],
+                results['documents'][0],
+                results['metadatas'][0],
+                results['distances'][0],
+                request.min_score
+            )
+
+        return {"matches": record_usage(formatted)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
 
+# Batch search request schema
+class BatchSearchRequest(BaseModel):
+    queries: List[str]
+    k: Optional[int] = 10
+    min_score: Optional[float] = 0.25
+    # Filters applied to every query
+    journal: Optional[str] = None
+    year_from: Optional[int] = None
+    year_to: Optional[int] = None
+    attributes: Optional[List[str]] = None
+
+# Endpoint for searching many queries at once: one embeddings call and one vector query
+@router.post("/api/similarity_search/batch")
+async def search_similar_chunks_batch(request: BatchSearchRequest):
+    if not request.queries:
+        raise HTTPException(status_code=400, detail="queries must not be empty")
+    where = search_where(request)
+
+    try:
+        embeddings = await aget_embeddings(request.queries)
+        results = await run_in_threadpool(query_chunks_batch, embeddings=embeddings, k=request.k, where=where)
+
+        matches = []
+        with stage("postprocess"):
+            for position, query in enumerate(request.queries):
+                formatted = format_matches(
+                    results['ids'][position],
+                    results['documents'][position],
+                    results['metadatas'][position],
+                    results['distances'][position],
+                    request.min_score
+                )
+                matches.append({"query": query, "matches": record_usage(formatted)})
+
+        return {"results": matches}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Batch search failed: {str(e)}")
+
+# Ask request schema
+class AskRequest(BaseModel):
+    question: str
+    k: Optional[int] = 5
+    min_score: Optional[float] = 0.3
+    max_context_tokens: Optional[int] = ASK_CONTEXT_TOKENS
+
+# Retrieval and generation in one call: budgeted, de-duplicated context and citations in the response
+@router.post("/api/ask")
+async def ask(request: AskRequest, stream: bool = False):
+    try:
+        embedding = await aget_embedding(request.question)
+        results = await run_in_threadpool(
+            query_chunks, embedding=embedding, k=request.k * ASK_CANDIDATE_MULTIPLIER, include_embeddings=True
+        )
+        with stage("postprocess"):
+            matches = format_matches(
+                results['ids'][0],
+                results['documents'][0],
+                results['metadatas'][0],
+                results['distances'][0],
+                request.min_score
+            )
+            vectors = dict(zip(results['ids'][0], results['embeddings'][0]))
+            selected, stats = await run_in_threadpool(
+                select_context, matches, vectors, request.k, request.max_context_tokens
+            )
+        record_usage(selected)
+
+        if not selected:
+            return {"answer": "No relevant information found.", "citations": [], **stats}
+        if stream:
+            return sse_response(answer_stream(request.question, selected, stats))
+        return await answer(request.question, selected, stats)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ask failed: {str(e)}")
+
+# Paginated list of documents from the catalog (registered before /api/{doc_id} so it is not shadowed)
+@router.get("/api/documents")
+def list_documents(
+    offset: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=1000),
+    journal: Optional[str] = None
+):
+    return catalog.list_documents(offset=offset, limit=limit, journal=journal)
+
+# Reattach id and text to stored metadata and deserialize attributes
+def format_chunk(chunk_id: str, doc: str, metadata) -> Optional[dict]:
+    if not isinstance(metadata, dict):
+        logger.warning("Invalid metadata format for id %s", chunk_id)
+        return None
+    chunk_data = public_metadata(metadata)
+    chunk_data["id"] = chunk_id  # Reattach id
+    chunk_data["text"] = doc
+    chunk_data["usage_count"] = chunk_data.get("usage_count", 0) + usage_counter.pending_count(chunk_id)
+    if "attributes" in chunk_data and isinstance(chunk_data["attributes"], str) and chunk_data["attributes"]:
+        chunk_data["attributes"] = chunk_data["attributes"].split(",")
+    else:
+        chunk_data["attributes"] = []
+    return chunk_data
+
+def parse_cursor(cursor: Optional[str]) -> int:
+    # Cursors are opaque to clients; internally they are the offset of the next item
+    if not cursor:
+        return 0
+    if not cursor.isdigit():
+        raise HTTPException(status_code=400, detail=f"Invalid cursor: {cursor}")
+    return int(cursor)
+
+def fetch_formatted_chunks(ids: List[str]) -> List[dict]:
+    results = get_chunks_by_ids(ids)
+    formatted = []
+    for chunk_id, doc, metadata in zip(results['ids'], results['documents'], results['metadatas']):
+        chunk_data = format_chunk(chunk_id, doc, metadata)
+        if chunk_data is not None:
+            formatted.append(chunk_data)
+    return sorted(formatted, key=lambda x: x.get("chunk_index", 0))
+
+def stream_ndjson(pages):
+    # Each page is fetched only when the client is ready for it, so memory stays bounded
+    for page in pages:
+        for item in page:
+            yield json.dumps(item) + "\n"
+
 # Endpoint to get chunks by journal ID
 @router.get("/api/{doc_id}")
-def get_document_chunks(doc_id: str):
+def get_document_chunks(
+    doc_id: str,
+    limit: Optional[int] = Query(None, ge=1, le=EXPORT_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$")
+):
     try:
-        results = get_chunks_by_doc_id(doc_id)
-        print(f"Debug: get_chunks_by_doc_id('{doc_id}') results: {results}")
-
-        if not results.get('ids') or not results['ids']:
+        ids = get_chunk_ids_by_doc_id(doc_id)
+        if not ids:
             raise HTTPException(status_code=404, detail=f"No chunks found for journal_id: {doc_id}")
 
-        formatted = []
-        for doc_id, doc, metadata in zip(results['ids'], results['documents'], results['metadatas']):
-            if not isinstance(metadata, dict):
-                print(f"Debug: Invalid metadata format for id {doc_id}: {metadata}")
-                continue
-            chunk_data = metadata.copy()
-            chunk_data["id"] = doc_id  # Reattach id
-            chunk_data["text"] = doc
-            if "attributes" in chunk_data and isinstance(chunk_data["attributes"], str) and chunk_data["attributes"]:
-                chunk_data["attributes"] = chunk_data["attributes"].split(",")
-            else:
-                chunk_data["attributes"] = []
+        start = parse_cursor(cursor)
+        end = min(len(ids), start + limit) if limit else len(ids)
 
-            formatted.append(chunk_data)
+        if format == "ndjson":
+            pages = (
+                fetch_formatted_chunks(ids[page_start:min(end, page_start + EXPORT_PAGE_SIZE)])
+                for page_start in range(start, end, EXPORT_PAGE_SIZE)
+            )
+            return StreamingResponse(stream_ndjson(pages), media_type="application/x-ndjson")
 
-        if not formatted:
+        formatted = fetch_formatted_chunks(ids[start:end])
+        if not formatted and start == 0:
             raise HTTPException(status_code=404, detail=f"No valid chunks found for journal_id: {doc_id}")
 
-        formatted = sorted(formatted, key=lambda x: x.get("chunk_index", 0))
-
-        return {"chunks": formatted}
+        response = {"chunks": formatted}
+        if limit:
+            response["next_cursor"] = str(end) if end < len(ids) else None
+            response["total"] = len(ids)
+        return response
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to retrieve chunks: {str(e)}")
     
 
+# Server-sent events: "delta" events carry text as it is generated, then "done" (or "error")
+async def sse_events(events):
+    try:
+        async for event, data in events:
+            yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    except Exception as e:
+        yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+
+def sse_response(events) -> StreamingResponse:
+    return StreamingResponse(
+        sse_events(events),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # Summary of documents
 @router.get("/api/summary/{doc_id}")
-def generate_summary(doc_id: str):
+async def generate_summary(doc_id: str, stream: bool = False):
     try:
-        results = get_chunks_by_doc_id(doc_id)
+        results = await run_in_threadpool(get_chunks_by_doc_id, doc_id)
         if not results.get("documents"):
             raise HTTPException(status_code=404, detail="Document not found")
 
-        # Concatenate all chunk texts
-        combined_text = "\n\n".join(results["documents"])
-
-        prompt = f"Summarize the following academic document:\n\n{combined_text}"
-
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.5
+        # Summarize chunks in document order; groups and the final summary are cached by content
+        ordered = sorted(
+            zip(results["ids"], results["documents"], results["metadatas"]),
+            key=lambda item: (item[2] or {}).get("chunk_index", 0)
         )
-
-        summary = response.choices[0].message.content.strip()
-        return {"summary": summary}
-
+        chunk_ids = [chunk_id for chunk_id, _, _ in ordered]
+        texts = [doc for _, doc, _ in ordered]
+        if stream:
+            return sse_response(summarize_document_stream(doc_id, chunk_ids, texts))
+        return await summarize_document(doc_id, chunk_ids, texts)
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -207,58 +485,80 @@ class CompareRequest(BaseModel):
     doc2_id: str
 
 @router.post("/api/compare")
-def compare_documents(request: CompareRequest):
+async def compare_documents(request: CompareRequest, stream: bool = False):
     try:
-        # Retrieve chunks for both documents
-        chunks1 = get_chunks_by_doc_id(request.doc1_id)
-        chunks2 = get_chunks_by_doc_id(request.doc2_id)
+        # Retrieve chunks for both documents concurrently
+        chunks1, chunks2 = await asyncio.gather(
+            run_in_threadpool(get_chunks_by_doc_id, request.doc1_id),
+            run_in_threadpool(get_chunks_by_doc_id, request.doc2_id)
+        )
 
         if not chunks1.get("documents") or not chunks2.get("documents"):
             raise HTTPException(status_code=404, detail="One or both documents not found")
 
-        # Combine all text from both documents
-        text1 = "\n\n".join(chunks1["documents"])
-        text2 = "\n\n".join(chunks2["documents"])
-
-        # Build the comparison prompt
-        prompt = f"""Compare the following two academic documents:
-
-        --- Paper A ({request.doc1_id}) ---
-        {text1}
-
-        --- Paper B ({request.doc2_id}) ---
-        {text2}
-
-        Please generate a structured comparison with the following sections:
-        1. Key Similarities
-        2. Key Differences
-        3. Methods Used
-        4. Topics Covered
-        5. Conclusions
-
-        Be concise and bullet-point the content under each section.
-        """
-
-        # Get response from OpenAI
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.5
-        )
-
-        comparison = response.choices[0].message.content.strip()
-        return {"comparison": comparison}
+        # Only aligned section digests go to the LLM, not the full text of both papers
+        if stream:
+            return sse_response(compare_stream(request.doc1_id, chunks1, request.doc2_id, chunks2))
+        return await compare(request.doc1_id, chunks1, request.doc2_id, chunks2)
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-    
 @router.get("/api/debug/list_all_chunks")
-def list_all_chunks():
-    data = collection.get()
+def list_all_chunks(
+    limit: Optional[int] = Query(None, ge=1, le=EXPORT_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$")
+):
+    start = parse_cursor(cursor)
+
+    # Everything (or up to limit) from the cursor on, read from Chroma one page at a time
+    def pages():
+        offset = start
+        remaining = limit
+        while remaining is None or remaining > 0:
+            size = EXPORT_PAGE_SIZE if remaining is None else min(EXPORT_PAGE_SIZE, remaining)
+            data = get_chunks_page(offset=offset, limit=size)
+            if not data["ids"]:
+                return
+            yield data["ids"], [public_metadata(metadata) for metadata in data["metadatas"]]
+            offset += len(data["ids"])
+            if remaining is not None:
+                remaining -= len(data["ids"])
+
+    if format == "ndjson":
+        return StreamingResponse(stream_ndjson(
+            [{"id": chunk_id, "metadata": metadata} for chunk_id, metadata in zip(ids, metadatas)]
+            for ids, metadatas in pages()
+        ), media_type="application/x-ndjson")
+
+    # Without a limit the JSON export returns every chunk, as it always has; with one it returns a page
+    ids, metadatas = [], []
+    for page_ids, page_metadatas in pages():
+        ids.extend(page_ids)
+        metadatas.extend(page_metadatas)
     return {
-        "ids": data.get("ids", []),
-        "num_chunks": len(data.get("ids", [])),
-        "metadatas": data.get("metadatas", [])
+        "ids": ids,
+        "num_chunks": count_chunks(),
+        "metadatas": metadatas,
+        "next_cursor": str(start + len(ids)) if limit is not None and len(ids) == limit else None
     }
 
+# Vector memory per chunk in the index and in the re-rank store (see VECTOR_INDEX_DIMENSIONS)
+@router.get("/api/debug/vector_storage")
+def vector_storage_stats():
+    stats = storage_stats(provider.dimension)
+    stats["chunks"] = count_chunks()
+    stats["index_bytes"] = stats["chunks"] * stats["index_bytes_per_chunk"]
+    stats["backend"] = backend_stats()
+    return stats
+
+@router.get("/api/debug/lexical_index")
+def lexical_index_stats():
+    return lexical_index.stats()
+
+@router.get("/api/debug/embedding_cache")
+def embedding_cache_stats():
+    return embedding_cache.stats()
@@ -0,0 +1,125 @@
+# Document catalog: doc_id -> chunk ids, chunk count, journal, year, kept up to date by ingestion
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CATALOG_PATH = os.getenv("CATALOG_PATH", "catalog_store/catalog.sqlite3")
+
+class Catalog:
+    def __init__(self, path: str = CATALOG_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            " doc_id TEXT PRIMARY KEY, chunk_count INTEGER NOT NULL, journal TEXT, publish_year INTEGER,"
+            " updated_at REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS doc_chunks ("
+            " doc_id TEXT NOT NULL, chunk_id TEXT NOT NULL, chunk_index INTEGER, PRIMARY KEY (doc_id, chunk_id));"
+            "CREATE INDEX IF NOT EXISTS doc_chunks_chunk_id ON doc_chunks (chunk_id);"
+        )
+        self.db.commit()
+        self.lock = threading.Lock()
+
+    def _refresh(self, doc_ids, details: Dict[str, Dict], now: float):
+        for doc_id in doc_ids:
+            count = self.db.execute("SELECT COUNT(*) FROM doc_chunks WHERE doc_id = ?", (doc_id,)).fetchone()[0]
+            if count == 0:
+                self.db.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+                continue
+            detail = details.get(doc_id, {})
+            self.db.execute(
+                "INSERT INTO documents (doc_id, chunk_count, journal, publish_year, updated_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(doc_id) DO UPDATE SET chunk_count = excluded.chunk_count, "
+                "journal = COALESCE(excluded.journal, journal), "
+                "publish_year = COALESCE(excluded.publish_year, publish_year), updated_at = excluded.updated_at",
+                (doc_id, count, detail.get("journal"), detail.get("publish_year"), now)
+            )
+
+    def record_chunks(self, ids: List[str], metadatas: List[Dict]):
+        now = time.time()
+        details = {}
+        with self.lock:
+            for chunk_id, metadata in zip(ids, metadatas):
+                doc_id = metadata["source_doc_id"]
+                # A chunk id that moved to another document is removed from the old one
+                moved = self.db.execute(
+                    "SELECT doc_id FROM doc_chunks WHERE chunk_id = ? AND doc_id != ?", (chunk_id, doc_id)
+                ).fetchall()
+                for (old_doc_id,) in moved:
+                    details.setdefault(old_doc_id, {})
+                self.db.execute("DELETE FROM doc_chunks WHERE chunk_id = ? AND doc_id != ?", (chunk_id, doc_id))
+                self.db.execute(
+                    "INSERT OR REPLACE INTO doc_chunks (doc_id, chunk_id, chunk_index) VALUES (?, ?, ?)",
+                    (doc_id, chunk_id, metadata.get("chunk_index"))
+                )
+                details[doc_id] = {"journal": metadata.get("journal"), "publish_year": metadata.get("publish_year")}
+            self._refresh(details.keys(), details, now)
+            self.db.commit()
+
+    def remove_chunks(self, ids: List[str]):
+        if not ids:
+            return
+        with self.lock:
+            placeholders = ",".join("?" * len(ids))
+            doc_ids = [row[0] for row in self.db.execute(
+                f"SELECT DISTINCT doc_id FROM doc_chunks WHERE chunk_id IN ({placeholders})", ids
+            )]
+            self.db.execute(f"DELETE FROM doc_chunks WHERE chunk_id IN ({placeholders})", ids)
+            self._refresh(doc_ids, {}, time.time())
+            self.db.commit()
+
+    def clear(self):
+        with self.lock:
+            self.db.execute("DELETE FROM doc_chunks")
+            self.db.execute("DELETE FROM documents")
+            self.db.commit()
+
+    def chunk_ids(self, doc_id: str) -> List[str]:
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT chunk_id FROM doc_chunks WHERE doc_id = ? ORDER BY chunk_index", (doc_id,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def list_documents(self, offset: int = 0, limit: int = 50, journal: Optional[str] = None) -> Dict:
+        where, params = ("WHERE journal = ?", [journal]) if journal else ("", [])
+        with self.lock:
+            total = self.db.execute(f"SELECT COUNT(*) FROM documents {where}", params).fetchone()[0]
+            rows = self.db.execute(
+                f"SELECT doc_id, chunk_count, journal, publish_year, updated_at FROM documents {where} "
+                "ORDER BY doc_id LIMIT ? OFFSET ?", params + [limit, offset]
+            ).fetchall()
+        return {
+            "documents": [
+                {"doc_id": doc_id, "chunk_count": chunk_count, "journal": journal, "publish_year": year,
+                 "updated_at": updated_at}
+                for doc_id, chunk_count, journal, year, updated_at in rows
+            ],
+            "total": total,
+            "offset": offset,
+            "limit": limit
+        }
+
+    def is_empty(self) -> bool:
+        with self.lock:
+            return self.db.execute("SELECT 1 FROM doc_chunks LIMIT 1").fetchone() is None
+
+    def backfill(self, collection, page_size: int = 1000) -> int:
+        # Build the catalog from an existing collection (e.g. one ingested before the catalog existed)
+        offset = 0
+        while True:
+            page = collection.get(limit=page_size, offset=offset, include=["metadatas"])
+            if not page["ids"]:
+                return offset
+            self.record_chunks(page["ids"], page["metadatas"])
+            offset += len(page["ids"])
+
+catalog = Catalog()
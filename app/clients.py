@@ -0,0 +1,64 @@
+# Shared, pooled clients for upstream services with per-upstream concurrency limits and timeouts
+
+import asyncio
+import os
+import threading
+import weakref
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Max concurrent in-flight calls per upstream, so slow LLM calls cannot take every connection
+OPENAI_EMBEDDING_CONCURRENCY = int(os.getenv("OPENAI_EMBEDDING_CONCURRENCY", "16"))
+OPENAI_CHAT_CONCURRENCY = int(os.getenv("OPENAI_CHAT_CONCURRENCY", "8"))
+HTTP_FETCH_CONCURRENCY = int(os.getenv("HTTP_FETCH_CONCURRENCY", "8"))
+
+# Timeouts in seconds per upstream
+OPENAI_EMBEDDING_TIMEOUT = float(os.getenv("OPENAI_EMBEDDING_TIMEOUT", "30"))
+OPENAI_CHAT_TIMEOUT = float(os.getenv("OPENAI_CHAT_TIMEOUT", "120"))
+HTTP_FETCH_TIMEOUT = float(os.getenv("HTTP_FETCH_TIMEOUT", "60"))
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+
+LIMITS = {
+    "embedding": OPENAI_EMBEDDING_CONCURRENCY,
+    "chat": OPENAI_CHAT_CONCURRENCY
+}
+
+# Async clients and semaphores belong to an event loop, so they are created once per running loop
+_loop_state = weakref.WeakKeyDictionary()
+
+def _state() -> dict:
+    loop = asyncio.get_running_loop()
+    state = _loop_state.get(loop)
+    if state is None:
+        pool = httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_CONNECTIONS)
+        state = {
+            "openai": AsyncOpenAI(http_client=DefaultAsyncHttpxClient(limits=pool)),
+            "limits": {name: asyncio.Semaphore(size) for name, size in LIMITS.items()}
+        }
+        _loop_state[loop] = state
+    return state
+
+def async_openai() -> AsyncOpenAI:
+    return _state()["openai"]
+
+def limit(upstream: str) -> asyncio.Semaphore:
+    # Usage: async with limit("chat"): ...
+    return _state()["limits"][upstream]
+
+async def aclose():
+    state = _loop_state.pop(asyncio.get_running_loop(), None)
+    if state is not None:
+        await state["openai"].close()
+
+# Pooled sync client for worker threads (httpx.Client is thread-safe)
+http_client = httpx.Client(
+    limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS),
+    timeout=HTTP_FETCH_TIMEOUT,
+    follow_redirects=True
+)
+# Downloads run on job threads, so their limit is a thread semaphore. Usage: with http_fetch_slots: ...
+http_fetch_slots = threading.BoundedSemaphore(max(1, HTTP_FETCH_CONCURRENCY))
@@ -0,0 +1,121 @@
+# Compact vector storage: truncated vectors in the ANN index, quantized full vectors on disk for re-ranking
+
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Dimensions kept in the Chroma index (0 = full vectors). text-embedding-3 vectors can be truncated and
+# re-normalized with little loss, which is what the API's `dimensions` parameter does server-side.
+VECTOR_INDEX_DIMENSIONS = int(os.getenv("VECTOR_INDEX_DIMENSIONS", "0"))
+# Re-score index candidates with the full vectors; candidates fetched per requested result
+VECTOR_RERANK = os.getenv("VECTOR_RERANK", "true").lower() == "true"
+VECTOR_RERANK_MULTIPLIER = int(os.getenv("VECTOR_RERANK_MULTIPLIER", "4"))
+# float32, float16 or int8 (one scale per vector)
+FULL_VECTOR_DTYPE = os.getenv("FULL_VECTOR_DTYPE", "int8")
+FULL_VECTOR_PATH = os.getenv("FULL_VECTOR_PATH", "vector_store/full_vectors.sqlite3")
+
+DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+
+# Only Matryoshka-trained embedders keep their quality when cut to a prefix; other vectors lose recall
+TRUNCATABLE_MODELS = {"openai": ("text-embedding-3-",)}
+
+def truncation_supported(provider: str, model: str) -> bool:
+    return model.startswith(TRUNCATABLE_MODELS.get(provider, ()))
+
+def truncate(vector, dimensions: int) -> List[float]:
+    head = np.asarray(vector, dtype=np.float32)[:dimensions]
+    norm = np.linalg.norm(head)
+    return (head / norm if norm else head).tolist()
+
+def quantize(vector, dtype: str):
+    values = np.asarray(vector, dtype=np.float32)
+    if dtype == "int8":
+        scale = float(np.abs(values).max()) / 127 or 1.0
+        return np.round(values / scale).astype(np.int8).tobytes(), scale
+    return values.astype(DTYPES[dtype]).tobytes(), 1.0
+
+def dequantize(data: bytes, scale: float, dtype: str) -> np.ndarray:
+    return np.frombuffer(data, dtype=DTYPES[dtype]).astype(np.float32) * scale
+
+class FullVectorStore:
+    def __init__(self, path: str = FULL_VECTOR_PATH, dtype: str = FULL_VECTOR_DTYPE):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unknown FULL_VECTOR_DTYPE '{dtype}', expected one of: {', '.join(DTYPES)}")
+        self.path = path
+        self.dtype = dtype
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS vectors (id TEXT PRIMARY KEY, dtype TEXT NOT NULL, scale REAL NOT NULL,"
+            " data BLOB NOT NULL)"
+        )
+        self.db.commit()
+        self.lock = threading.Lock()
+
+    def put_many(self, ids: List[str], vectors: List[list]):
+        rows = []
+        for chunk_id, vector in zip(ids, vectors):
+            data, scale = quantize(vector, self.dtype)
+            rows.append((chunk_id, self.dtype, scale, data))
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO vectors (id, dtype, scale, data) VALUES (?, ?, ?, ?)", rows)
+            self.db.commit()
+
+    def get_many(self, ids: List[str]) -> Dict[str, np.ndarray]:
+        if not ids:
+            return {}
+        placeholders = ",".join("?" * len(ids))
+        with self.lock:
+            rows = self.db.execute(
+                f"SELECT id, dtype, scale, data FROM vectors WHERE id IN ({placeholders})", list(ids)
+            ).fetchall()
+        # Rows keep the dtype they were written with, so changing FULL_VECTOR_DTYPE needs no migration
+        return {chunk_id: dequantize(data, scale, dtype) for chunk_id, dtype, scale, data in rows}
+
+    def remove(self, ids: List[str]):
+        if not ids:
+            return
+        placeholders = ",".join("?" * len(ids))
+        with self.lock:
+            self.db.execute(f"DELETE FROM vectors WHERE id IN ({placeholders})", list(ids))
+            self.db.commit()
+
+    def clear(self):
+        with self.lock:
+            self.db.execute("DELETE FROM vectors")
+            self.db.commit()
+
+    def stats(self) -> Dict:
+        with self.lock:
+            count, data_bytes = self.db.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM vectors").fetchone()
+        size = sum(
+            os.path.getsize(self.path + suffix) for suffix in ("", "-wal") if os.path.exists(self.path + suffix)
+        )
+        return {
+            "vectors": count,
+            "dtype": self.dtype,
+            "bytes_per_vector": round(data_bytes / count, 1) if count else 0,
+            "size_bytes": size
+        }
+
+full_vectors: Optional[FullVectorStore] = FullVectorStore() if VECTOR_INDEX_DIMENSIONS and VECTOR_RERANK else None
+
+def storage_stats(dimension: int) -> Dict:
+    # Memory per chunk: the ANN index holds float32 vectors in RAM; full vectors for re-ranking stay on disk
+    index_dimension = VECTOR_INDEX_DIMENSIONS or dimension
+    return {
+        "embedding_dimension": dimension,
+        "index_dimension": index_dimension,
+        "index_bytes_per_chunk": index_dimension * 4,
+        "full_precision_bytes_per_chunk": dimension * 4,
+        "rerank": full_vectors is not None,
+        "rerank_multiplier": VECTOR_RERANK_MULTIPLIER if full_vectors is not None else None,
+        "full_vectors": full_vectors.stats() if full_vectors is not None else None
+    }
@@ -0,0 +1,138 @@
+# Document comparison on section digests aligned by embedding similarity
+
+import math
+import os
+from typing import AsyncIterator, Dict, List, Tuple
+from dotenv import load_dotenv
+from app.embedding import aget_embeddings
+from app.ingestion import estimate_tokens
+from app.summarize import cached_complete, cached_stream, gather_limited
+
+load_dotenv()
+
+# Sections shorter than this are used verbatim instead of being digested
+SECTION_DIGEST_MIN_TOKENS = int(os.getenv("SECTION_DIGEST_MIN_TOKENS", "200"))
+# Minimum cosine similarity for two sections to be compared side by side
+COMPARE_ALIGN_THRESHOLD = float(os.getenv("COMPARE_ALIGN_THRESHOLD", "0.5"))
+
+SECTION_PROMPT = (
+    "Write a short digest (3-5 sentences) of the section \"{heading}\" of an academic document. "
+    "Keep the claims, methods and results:\n\n{text}"
+)
+
+COMPARE_PROMPT = """Compare the following two academic documents, given as section digests.
+Sections that cover the same topic are shown side by side.
+
+--- Paper A ({doc1_id}) vs Paper B ({doc2_id}): aligned sections ---
+{aligned}
+
+--- Sections only in Paper A ---
+{only_a}
+
+--- Sections only in Paper B ---
+{only_b}
+
+Please generate a structured comparison with the following sections:
+1. Key Similarities
+2. Key Differences
+3. Methods Used
+4. Topics Covered
+5. Conclusions
+
+Be concise and bullet-point the content under each section.
+"""
+
+def split_sections(results: Dict) -> List[Tuple[str, str]]:
+    # Group chunk texts by section heading, keeping document order
+    ordered = sorted(
+        zip(results["documents"], results["metadatas"]),
+        key=lambda item: (item[1] or {}).get("chunk_index", 0)
+    )
+    sections = []
+    for text, metadata in ordered:
+        heading = (metadata or {}).get("section_heading") or "Untitled"
+        if sections and sections[-1][0] == heading:
+            sections[-1] = (heading, sections[-1][1] + "\n\n" + text)
+        else:
+            sections.append((heading, text))
+    return sections
+
+async def digest_section(heading: str, text: str, stats: Dict) -> str:
+    if estimate_tokens(text) < SECTION_DIGEST_MIN_TOKENS:
+        return text
+    # Cached by content, so repeated comparisons reuse the digests
+    return await cached_complete("section", SECTION_PROMPT.format(heading=heading, text=text), stats)
+
+def cosine(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+def align_sections(vectors_a: List[List[float]], vectors_b: List[List[float]],
+                   threshold: float = COMPARE_ALIGN_THRESHOLD) -> List[Tuple[int, int, float]]:
+    # Greedy one-to-one matching, most similar pairs first
+    candidates = sorted(
+        ((cosine(a, b), i, j) for i, a in enumerate(vectors_a) for j, b in enumerate(vectors_b)),
+        reverse=True
+    )
+    used_a, used_b, pairs = set(), set(), []
+    for score, i, j in candidates:
+        if score < threshold:
+            break
+        if i not in used_a and j not in used_b:
+            used_a.add(i)
+            used_b.add(j)
+            pairs.append((i, j, score))
+    return sorted(pairs)
+
+async def build_comparison(doc1_id: str, results1: Dict, doc2_id: str, results2: Dict, stats: Dict) -> Tuple[str, List[Dict]]:
+    # Digest and align sections; returns the condensed prompt and the aligned section pairs
+    sections_a = split_sections(results1)
+    sections_b = split_sections(results2)
+
+    digests = await gather_limited([
+        digest_section(heading, text, stats) for heading, text in sections_a + sections_b
+    ])
+    digests_a, digests_b = digests[:len(sections_a)], digests[len(sections_a):]
+
+    vectors = await aget_embeddings(digests)
+    pairs = align_sections(vectors[:len(sections_a)], vectors[len(sections_a):])
+    matched_a = {i for i, _, _ in pairs}
+    matched_b = {j for _, j, _ in pairs}
+
+    aligned = "\n\n".join(
+        f"[A: {sections_a[i][0]}] {digests_a[i]}\n[B: {sections_b[j][0]}] {digests_b[j]}"
+        for i, j, _ in pairs
+    ) or "(none)"
+    only_a = "\n\n".join(
+        f"[{sections_a[i][0]}] {digests_a[i]}" for i in range(len(sections_a)) if i not in matched_a
+    ) or "(none)"
+    only_b = "\n\n".join(
+        f"[{sections_b[j][0]}] {digests_b[j]}" for j in range(len(sections_b)) if j not in matched_b
+    ) or "(none)"
+
+    prompt = COMPARE_PROMPT.format(doc1_id=doc1_id, doc2_id=doc2_id, aligned=aligned, only_a=only_a, only_b=only_b)
+    aligned_sections = [
+        {"paper_a": sections_a[i][0], "paper_b": sections_b[j][0], "similarity": round(score, 3)}
+        for i, j, score in pairs
+    ]
+    return prompt, aligned_sections
+
+async def compare(doc1_id: str, results1: Dict, doc2_id: str, results2: Dict) -> Dict:
+    stats = {"llm_calls": 0, "cached_calls": 0}
+    prompt, aligned_sections = await build_comparison(doc1_id, results1, doc2_id, results2, stats)
+    comparison = await cached_complete("compare", prompt, stats)
+    return {
+        "comparison": comparison,
+        "aligned_sections": aligned_sections,
+        "prompt_tokens": estimate_tokens(prompt),
+        **stats
+    }
+
+async def compare_stream(doc1_id: str, results1: Dict, doc2_id: str, results2: Dict) -> AsyncIterator[Tuple[str, Dict]]:
+    # Yields ("delta", {"text": ...}) events for the comparison, then ("done", details)
+    stats = {"llm_calls": 0, "cached_calls": 0}
+    prompt, aligned_sections = await build_comparison(doc1_id, results1, doc2_id, results2, stats)
+    async for delta in cached_stream("compare", prompt, stats):
+        yield "delta", {"text": delta}
+    yield "done", {"aligned_sections": aligned_sections, "prompt_tokens": estimate_tokens(prompt), **stats}
@@ -1,33 +1,202 @@
-# OPEN AI API call for embeddings
 
+# Embedding providers (OpenAI, local SentenceTransformer, hashing), selected with EMBEDDING_PROVIDER
+
+import asyncio
+import hashlib
+import math
 import os
+import re
+import threading
 import openai
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
 from dotenv import load_dotenv
+from app.embedding_cache import EmbeddingCache, cache_key
+from app.clients import OPENAI_EMBEDDING_TIMEOUT, async_openai, limit
+from app.metrics import stage
 
 # Load environment variables from .env file
 load_dotenv()
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
-def get_embedding(text: str) -> list:
-    response = openai.embeddings.create(
-        input=[text], 
-        model="text-embedding-3-small"
-    )
-    embedding = response.data[0].embedding
-    print(f"Generated embedding: {embedding[:5]}") 
-    return embedding
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai")
+EMBEDDING_MODEL = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
+LOCAL_EMBEDDING_MODEL = os.getenv("LOCAL_EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+LOCAL_EMBEDDING_BATCH_SIZE = int(os.getenv("LOCAL_EMBEDDING_BATCH_SIZE", "32"))
+LOCAL_EMBEDDING_THREADS = int(os.getenv("LOCAL_EMBEDDING_THREADS", "4"))
+HASHING_EMBEDDING_DIM = int(os.getenv("HASHING_EMBEDDING_DIM", "384"))
+# Ask text-embedding-3 models for shorter vectors (0 = model default); see also VECTOR_INDEX_DIMENSIONS
+OPENAI_DIMENSIONS = int(os.getenv("OPENAI_DIMENSIONS", "0"))
+
+OPENAI_EMBEDDING_DIMENSIONS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536
+}
+
+class EmbeddingProvider(ABC):
+    name = "base"
+    model = ""
+    dimension = 0
+
+    @property
+    def cache_namespace(self) -> str:
+        return f"{self.name}:{self.model}"
+
+    @abstractmethod
+    def embed(self, texts: List[str]) -> List[list]:
+        ...
+
+    async def aembed(self, texts: List[str]) -> List[list]:
+        # CPU-bound providers run on a worker thread so the event loop stays free
+        return await asyncio.to_thread(self.embed, texts)
+
+# OPEN AI API call for embeddings
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    name = "openai"
+
+    def __init__(self, model: str = EMBEDDING_MODEL, dimensions: int = OPENAI_DIMENSIONS):
+        self.model = model
+        self.dimensions = dimensions
+        self.dimension = dimensions or OPENAI_EMBEDDING_DIMENSIONS.get(model, 0)
+        # Only sent when set: text-embedding-ada-002 rejects the parameter
+        self.options = {"dimensions": dimensions} if dimensions else {}
+
+    @property
+    def cache_namespace(self) -> str:
+        return f"{self.name}:{self.model}:{self.dimensions}" if self.dimensions else f"{self.name}:{self.model}"
+
+    def embed(self, texts: List[str]) -> List[list]:
+        # One request for the whole batch; results come back tagged with their input index
+        response = openai.embeddings.create(
+            input=texts,
+            model=self.model,
+            timeout=OPENAI_EMBEDDING_TIMEOUT,
+            **self.options
+        )
+        ordered = sorted(response.data, key=lambda item: item.index)
+        return [item.embedding for item in ordered]
+
+    async def aembed(self, texts: List[str]) -> List[list]:
+        async with limit("embedding"):
+            response = await async_openai().embeddings.create(
+                input=texts,
+                model=self.model,
+                timeout=OPENAI_EMBEDDING_TIMEOUT,
+                **self.options
+            )
+        ordered = sorted(response.data, key=lambda item: item.index)
+        return [item.embedding for item in ordered]
+
+# Sentence Transformers on CPU, no network access needed
+class LocalEmbeddingProvider(EmbeddingProvider):
+    name = "local"
 
+    def __init__(self, model: str = LOCAL_EMBEDDING_MODEL, batch_size: int = LOCAL_EMBEDDING_BATCH_SIZE,
+                 threads: int = LOCAL_EMBEDDING_THREADS):
+        self.model = model
+        self.batch_size = batch_size
+        self.executor = ThreadPoolExecutor(max_workers=max(1, threads), thread_name_prefix="local-embed")
+        self._encoder = None
+        self._load_lock = threading.Lock()
+
+    @property
+    def encoder(self):
+        # Loaded on first use (or by the warm-up at startup): torch and the model take seconds to load
+        if self._encoder is None:
+            with self._load_lock:
+                if self._encoder is None:
+                    from sentence_transformers import SentenceTransformer
+
+                    self._encoder = SentenceTransformer(self.model, device="cpu")
+        return self._encoder
+
+    @property
+    def dimension(self) -> int:
+        return self.encoder.get_sentence_embedding_dimension()
+
+    def _encode(self, texts: List[str]) -> List[list]:
+        return self.encoder.encode(texts, batch_size=self.batch_size, normalize_embeddings=True).tolist()
+
+    def embed(self, texts: List[str]) -> List[list]:
+        # Split into sub-batches and encode them on the thread pool (torch releases the GIL)
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        embeddings = []
+        for batch_embeddings in self.executor.map(self._encode, batches):
+            embeddings.extend(batch_embeddings)
+        return embeddings
+
+# Deterministic feature-hashing embedder for tests and benchmarks
+class HashingEmbeddingProvider(EmbeddingProvider):
+    name = "hashing"
+
+    def __init__(self, dimension: int = HASHING_EMBEDDING_DIM):
+        self.model = f"hashing-{dimension}"
+        self.dimension = dimension
+
+    def _embed_one(self, text: str) -> list:
+        vector = [0.0] * self.dimension
+        for token in re.findall(r"\w+", text.lower()):
+            digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dimension
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(value * value for value in vector))
+        return [value / norm for value in vector] if norm else vector
+
+    def embed(self, texts: List[str]) -> List[list]:
+        return [self._embed_one(text) for text in texts]
+
+PROVIDERS = {
+    "openai": OpenAIEmbeddingProvider,
+    "local": LocalEmbeddingProvider,
+    "hashing": HashingEmbeddingProvider
+}
+
+def load_provider(name: str = EMBEDDING_PROVIDER) -> EmbeddingProvider:
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown EMBEDDING_PROVIDER '{name}', expected one of: {', '.join(PROVIDERS)}")
+    return PROVIDERS[name]()
+
+provider = load_provider()
+
+# Embeddings are cached by provider + model + normalized text, so repeated chunks and queries skip the encoder
+embedding_cache = EmbeddingCache()
+
+def get_embedding(text: str) -> list:
+    return get_embeddings([text])[0]
 
-# --------------------
+def _lookup(texts: List[str]):
+    model_key = provider.cache_namespace
+    keys = [cache_key(model_key, text) for text in texts]
+    with stage("embedding_cache", items=len(keys)):
+        cached = embedding_cache.get_many(keys)
 
-# # Sentence Transformers for embeddings
+    # Only embed texts that are not cached yet, once per distinct key
+    pending = {}
+    for key, text in zip(keys, texts):
+        if key not in cached and key not in pending:
+            pending[key] = text
+    return keys, cached, pending
 
-# from sentence_transformers import SentenceTransformer
+def get_embeddings(texts: List[str]) -> List[list]:
+    keys, cached, pending = _lookup(texts)
+    if pending:
+        with stage("embedding", items=len(pending)):
+            fresh = dict(zip(pending.keys(), provider.embed(list(pending.values()))))
+        embedding_cache.put_many(fresh)
+        cached.update(fresh)
+    return [cached[key] for key in keys]
 
-# # Load the pre-trained embedding model (small & fast)
-# model = SentenceTransformer("all-MiniLM-L6-v2")
+async def aget_embedding(text: str) -> list:
+    return (await aget_embeddings([text]))[0]
 
-# def get_embedding(text: str) -> list:
-#     embedding = model.encode(text)
-#     print(f"Generated embedding: {embedding[:5]}")
-#     return embedding.tolist()
+async def aget_embeddings(texts: List[str]) -> List[list]:
+    # The cache is SQLite, so its reads and writes run on a worker thread like the other blocking calls
+    keys, cached, pending = await asyncio.to_thread(_lookup, texts)
+    if pending:
+        with stage("embedding", items=len(pending)):
+            fresh = dict(zip(pending.keys(), await provider.aembed(list(pending.values()))))
+        await asyncio.to_thread(embedding_cache.put_many, fresh)
+        cached.update(fresh)
+    return [cached[key] for key in keys]
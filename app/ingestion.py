@@ -0,0 +1,144 @@
+# Batched ingestion: embed chunks in bounded batches and bulk-write them to the vector DB
+
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Set
+from dotenv import load_dotenv
+from app.embedding import get_embeddings
+from app.vector_db import attribute_key, delete_chunks, get_content_hashes, get_usage_counts, upsert_chunks_to_db
+from app.catalog import catalog
+from app.lexical import lexical_index
+from app.usage import usage_counter
+from app.workers import worker
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Batch limits for the embeddings endpoint (max inputs and approximate tokens per request)
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "256"))
+EMBEDDING_BATCH_TOKENS = int(os.getenv("EMBEDDING_BATCH_TOKENS", "100000"))
+# Number of batches embedded and written at the same time
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "4"))
+
+def estimate_tokens(text: str) -> int:
+    # Rough estimate (~4 characters per token), good enough to stay under request limits
+    return max(1, len(text) // 4)
+
+def chunk_hash(chunk, schema_version: str) -> str:
+    # Covers text, every metadata field and the schema version: equal hashes mean nothing to re-ingest.
+    # usage_count is left out: the service counts retrievals itself, the uploaded value is only a starting count
+    payload = json.dumps({**chunk.model_dump(exclude={"usage_count"}), "schema_version": schema_version}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def build_metadata(chunk, schema_version: str) -> Dict:
+    metadata_raw = {
+        "source_doc_id": chunk.source_doc_id,
+        "chunk_index": chunk.chunk_index,
+        "section_heading": chunk.section_heading,
+        "journal": chunk.journal,
+        "publish_year": chunk.publish_year,
+        "usage_count": chunk.usage_count,
+        "attributes": ",".join(chunk.attributes),
+        "link": chunk.link,
+        "doi": chunk.doi,
+        "text": chunk.text,
+        "schema_version": schema_version,
+        "content_hash": chunk_hash(chunk, schema_version),
+        **{attribute_key(attribute): True for attribute in chunk.attributes if attribute.strip()}
+    }
+    return {k: v for k, v in metadata_raw.items() if v is not None}
+
+def batch_chunks(chunks, max_size: int = EMBEDDING_BATCH_SIZE, max_tokens: int = EMBEDDING_BATCH_TOKENS):
+    # Yield lists of chunks bounded by both count and estimated token total
+    batch = []
+    batch_tokens = 0
+    for chunk in chunks:
+        tokens = estimate_tokens(chunk.text)
+        if batch and (len(batch) >= max_size or batch_tokens + tokens > max_tokens):
+            yield batch
+            batch = []
+            batch_tokens = 0
+        batch.append(chunk)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+def ingest_batch(batch: List, schema_version: str) -> Dict:
+    # Delta write: unchanged chunks are skipped without an embedding call, new and changed ones are upserted
+    start = time.perf_counter()
+    unique = list({chunk.id: chunk for chunk in batch}.values())  # the last copy of a repeated id wins
+    metadatas = {chunk.id: build_metadata(chunk, schema_version) for chunk in unique}
+    stored = get_content_hashes(list(metadatas))
+    changed = [chunk for chunk in unique if stored.get(chunk.id, "") != metadatas[chunk.id]["content_hash"]]
+    looked_up = time.perf_counter()
+
+    ids = [chunk.id for chunk in changed]
+    if changed:
+        embeddings = get_embeddings([chunk.text for chunk in changed])
+    embedded = time.perf_counter()
+    if changed:
+        # Changed chunks keep the retrievals counted so far; read under the flush lock so a usage flush
+        # running meanwhile is not overwritten with the older count
+        with usage_counter.flush_lock:
+            for chunk_id, count in get_usage_counts(ids).items():
+                metadatas[chunk_id]["usage_count"] = count
+            upsert_chunks_to_db(ids=ids, embeddings=embeddings, metadatas=[metadatas[chunk_id] for chunk_id in ids])
+        catalog.record_chunks(ids, [metadatas[chunk_id] for chunk_id in ids])
+        lexical_index.add(ids, [chunk.text for chunk in changed])
+        worker.publish()  # read-only workers reload once every store has the batch
+    elapsed = time.perf_counter() - start
+    inserted = sum(1 for chunk_id in ids if chunk_id not in stored)
+    return {
+        "chunks": len(batch),
+        "inserted": inserted,
+        "updated": len(ids) - inserted,
+        "unchanged": len(batch) - len(ids),
+        "embed_seconds": round(embedded - looked_up, 3),
+        "write_seconds": round(elapsed - (embedded - looked_up), 3),
+        "seconds": round(elapsed, 3),
+        "chunks_per_second": round(len(batch) / elapsed, 1) if elapsed > 0 else None
+    }
+
+def prune_documents(uploaded: Dict[str, Set[str]]) -> int:
+    # A re-uploaded document replaces the old one: its stored chunks that were not uploaded again are deleted
+    stale = []
+    for doc_id, ids in uploaded.items():
+        stale.extend(chunk_id for chunk_id in catalog.chunk_ids(doc_id) if chunk_id not in ids)
+    if stale:
+        delete_chunks(stale)
+        catalog.remove_chunks(stale)
+        lexical_index.remove(stale)
+        worker.publish()
+    return len(stale)
+
+def ingest_chunks(chunks, schema_version: str, concurrency: int = INGEST_CONCURRENCY) -> Dict:
+    start = time.perf_counter()
+    chunks = list(chunks)
+    batches = list(batch_chunks(chunks))
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        stats = list(executor.map(lambda batch: ingest_batch(batch, schema_version), batches))
+    uploaded = {}
+    for chunk in chunks:
+        uploaded.setdefault(chunk.source_doc_id, set()).add(chunk.id)
+    deleted = prune_documents(uploaded)
+    for number, batch_stats in enumerate(stats, start=1):
+        batch_stats["batch"] = number
+        logger.info(
+            "Ingested batch %d/%d: %d chunks in %ss (%s chunks/s)",
+            number, len(stats), batch_stats["chunks"], batch_stats["seconds"], batch_stats["chunks_per_second"]
+        )
+
+    elapsed = time.perf_counter() - start
+    total = sum(batch_stats["chunks"] for batch_stats in stats)
+    return {
+        "chunks": total,
+        **{key: sum(batch_stats[key] for batch_stats in stats) for key in ("inserted", "updated", "unchanged")},
+        "deleted": deleted,
+        "seconds": round(elapsed, 3),
+        "chunks_per_second": round(total / elapsed, 1) if elapsed > 0 else None,
+        "batches": stats
+    }
@@ -0,0 +1,285 @@
+# Background ingestion jobs: uploads are queued, processed by a worker pool and tracked on disk
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+from dotenv import load_dotenv
+from app.ingestion import INGEST_CONCURRENCY, batch_chunks, ingest_batch, prune_documents
+from app.models import Chunk
+from app.streaming import stream_records
+from app.workers import worker
+
+load_dotenv()
+
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "jobs_store/jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# How often the writer picks up jobs queued by read-only workers
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))
+
+# Per-job chunk counters reported by the status endpoint
+COUNTERS = ("done", "failed", "inserted", "updated", "unchanged", "deleted")
+
+class JobManager:
+    def __init__(self, path: str = JOBS_DB_PATH, workers: int = JOB_WORKERS):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, status TEXT NOT NULL, schema_version TEXT NOT NULL, file_url TEXT,"
+            " replace_documents INTEGER NOT NULL DEFAULT 1,"
+            " total INTEGER, done INTEGER NOT NULL DEFAULT 0, failed INTEGER NOT NULL DEFAULT 0,"
+            " inserted INTEGER NOT NULL DEFAULT 0, updated INTEGER NOT NULL DEFAULT 0,"
+            " unchanged INTEGER NOT NULL DEFAULT 0, deleted INTEGER NOT NULL DEFAULT 0, error TEXT,"
+            " created_at REAL NOT NULL, started_at REAL, finished_at REAL);"
+            "CREATE TABLE IF NOT EXISTS job_chunks ("
+            " job_id TEXT NOT NULL, position INTEGER NOT NULL, payload TEXT NOT NULL,"
+            " state TEXT NOT NULL DEFAULT 'pending', error TEXT, PRIMARY KEY (job_id, position));"
+        )
+        # Job stores created before delta ingestion lack the per-outcome counters
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(jobs)")}
+        for column in COUNTERS:
+            if column not in columns:
+                self.db.execute(f"ALTER TABLE jobs ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0")
+        if "replace_documents" not in columns:
+            self.db.execute("ALTER TABLE jobs ADD COLUMN replace_documents INTEGER NOT NULL DEFAULT 1")
+        self.db.commit()
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="ingest-job")
+        # Chunks processed by the current run of each job, used for throughput and ETA
+        self.progress = {}
+        self.running: Set[str] = set()
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def _execute(self, sql: str, params=()):
+        with self.lock:
+            self.db.execute(sql, params)
+            self.db.commit()
+
+    def _query(self, sql: str, params=()):
+        with self.lock:
+            return self.db.execute(sql, params).fetchall()
+
+    def _create(self, schema_version: str, file_url: Optional[str] = None, replace_documents: bool = True,
+                chunks: Optional[List[Chunk]] = None) -> str:
+        # The job and its chunks are committed together: the poll thread may dispatch a queued job at any time
+        job_id = uuid.uuid4().hex
+        rows = [(job_id, position, chunk.model_dump_json()) for position, chunk in enumerate(chunks or [])]
+        with self.lock:
+            self.db.execute(
+                "INSERT INTO jobs (id, status, schema_version, file_url, replace_documents, total, created_at) "
+                "VALUES (?, 'queued', ?, ?, ?, ?, ?)",
+                (job_id, schema_version, file_url, int(replace_documents),
+                 len(rows) if chunks is not None else None, time.time())
+            )
+            self.db.executemany("INSERT INTO job_chunks (job_id, position, payload) VALUES (?, ?, ?)", rows)
+            self.db.commit()
+        return job_id
+
+    def submit_chunks(self, chunks: List[Chunk], schema_version: str, replace_documents: bool = True) -> str:
+        job_id = self._create(schema_version, replace_documents=replace_documents, chunks=chunks)
+        self._dispatch(job_id)
+        return job_id
+
+    def submit_url(self, file_url: str, schema_version: str, replace_documents: bool = True) -> str:
+        job_id = self._create(schema_version, file_url=file_url, replace_documents=replace_documents)
+        self._dispatch(job_id)
+        return job_id
+
+    def _dispatch(self, job_id: str) -> bool:
+        # Only the writer process ingests; a read-only worker leaves the job queued for the writer to poll
+        if not worker.is_writer:
+            return False
+        with self.lock:
+            if job_id in self.running:
+                return False
+            self.running.add(job_id)
+        self.executor.submit(self.run, job_id)
+        return True
+
+    def resume(self) -> List[str]:
+        # Re-queue jobs that were interrupted; chunks already marked done (or stored unchanged) are not embedded again
+        job_ids = [row[0] for row in self._query("SELECT id FROM jobs WHERE status IN ('queued', 'running')")]
+        for job_id in job_ids:
+            self._dispatch(job_id)
+        return job_ids
+
+    def _poll(self):
+        while not self.stopping.wait(JOB_POLL_SECONDS):
+            for (job_id,) in self._query("SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at"):
+                self._dispatch(job_id)
+
+    def start(self):
+        # Writer: resume interrupted jobs, then keep picking up jobs submitted to the other workers
+        self.resume()
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._poll, name="job-poll", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread:
+            self.thread.join(JOB_POLL_SECONDS)
+            self.thread = None
+
+    @staticmethod
+    def _track(chunks: Iterable[Chunk], uploaded: Dict[str, Set[str]]) -> Iterator[Chunk]:
+        # Records which chunk ids each uploaded document has, for pruning once the job is done
+        for chunk in chunks:
+            uploaded.setdefault(chunk.source_doc_id, set()).add(chunk.id)
+            yield chunk
+
+    def _stream_chunks(self, job_id: str, file_url: str) -> Iterator[Chunk]:
+        # Records are validated as they arrive; invalid ones are counted as failed and skipped
+        received = 0
+        for record in stream_records(file_url):
+            received += 1
+            try:
+                yield Chunk(**record)
+            except (TypeError, ValueError) as e:
+                self._execute(
+                    "UPDATE jobs SET failed = failed + 1, error = ? WHERE id = ?",
+                    (f"Invalid chunk at position {received - 1}: {e}", job_id)
+                )
+        self._execute("UPDATE jobs SET total = ? WHERE id = ?", (received, job_id))
+
+    def run(self, job_id: str):
+        row = self._query("SELECT schema_version, file_url, replace_documents FROM jobs WHERE id = ?", (job_id,))
+        if not row:
+            return
+        schema_version, file_url, replace_documents = row[0]
+        self.progress[job_id] = {"started": time.perf_counter(), "processed": 0, "batches": deque(maxlen=10)}
+        self._execute("UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?", (time.time(), job_id))
+
+        uploaded: Dict[str, Set[str]] = {}
+        try:
+            if file_url:
+                # Remote dumps are streamed, so batches are embedded while the rest is still downloading.
+                # A resumed job streams the file again; chunks that are already stored unchanged are skipped.
+                self._execute(
+                    f"UPDATE jobs SET total = NULL, {', '.join(f'{c} = 0' for c in COUNTERS)}, error = NULL "
+                    "WHERE id = ?", (job_id,)
+                )
+                chunks = self._track(self._stream_chunks(job_id, file_url), uploaded)
+                positions = None
+            else:
+                rows = self._query(
+                    "SELECT position, payload, state FROM job_chunks WHERE job_id = ? ORDER BY position", (job_id,)
+                )
+                stored = [(position, Chunk(**json.loads(payload)), state) for position, payload, state in rows]
+                for _, chunk, _ in stored:
+                    uploaded.setdefault(chunk.source_doc_id, set()).add(chunk.id)
+                chunks = [chunk for _, chunk, state in stored if state == "pending"]
+                positions = {id(chunk): position for position, chunk, state in stored if state == "pending"}
+
+            # Bound the batches in flight so a fast download cannot outrun embedding and fill memory
+            in_flight = threading.Semaphore(max(1, INGEST_CONCURRENCY) * 2)
+            with ThreadPoolExecutor(max_workers=max(1, INGEST_CONCURRENCY)) as pool:
+                for batch in batch_chunks(chunks):
+                    in_flight.acquire()
+                    future = pool.submit(self._run_batch, job_id, batch, positions, schema_version)
+                    future.add_done_callback(lambda _: in_flight.release())
+
+            failed = self._query("SELECT failed FROM jobs WHERE id = ?", (job_id,))[0][0]
+            # Deleting needs the complete upload; after failures the old chunks are kept
+            if replace_documents and not failed:
+                deleted = prune_documents(uploaded)
+                self._execute("UPDATE jobs SET deleted = ? WHERE id = ?", (deleted, job_id))
+            self._execute(
+                "UPDATE jobs SET status = ?, finished_at = ? WHERE id = ?",
+                ("completed_with_errors" if failed else "completed", time.time(), job_id)
+            )
+        except Exception as e:
+            self._execute(
+                "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+                (str(e), time.time(), job_id)
+            )
+        finally:
+            self.progress.pop(job_id, None)
+            with self.lock:
+                self.running.discard(job_id)
+
+    def _run_batch(self, job_id: str, batch: List[Chunk], positions: Optional[Dict[int, int]], schema_version: str):
+        # Chunks written before a crash but not yet marked done are stored unchanged, so they are not re-embedded
+        batch_stats = None
+        try:
+            batch_stats = ingest_batch(batch, schema_version)
+            state, error = "done", None
+        except Exception as e:
+            state, error = "failed", str(e)
+
+        with self.lock:
+            if positions is not None:
+                self.db.executemany(
+                    "UPDATE job_chunks SET state = ?, error = ? WHERE job_id = ? AND position = ?",
+                    [(state, error, job_id, positions[id(chunk)]) for chunk in batch]
+                )
+            if state == "done":
+                self.db.execute(
+                    "UPDATE jobs SET done = done + ?, inserted = inserted + ?, updated = updated + ?, "
+                    "unchanged = unchanged + ? WHERE id = ?",
+                    (len(batch), batch_stats["inserted"], batch_stats["updated"], batch_stats["unchanged"], job_id)
+                )
+            else:
+                self.db.execute(
+                    "UPDATE jobs SET failed = failed + ?, error = ? WHERE id = ?", (len(batch), error, job_id)
+                )
+            self.db.commit()
+            if job_id in self.progress:
+                self.progress[job_id]["processed"] += len(batch)
+                if batch_stats:
+                    self.progress[job_id]["batches"].append(batch_stats)
+
+    def status(self, job_id: str) -> Optional[Dict]:
+        rows = self._query(
+            "SELECT status, total, done, failed, inserted, updated, unchanged, deleted, error, created_at, started_at, "
+            "finished_at FROM jobs WHERE id = ?", (job_id,)
+        )
+        if not rows:
+            return None
+        (status, total, done, failed, inserted, updated, unchanged, deleted, error,
+         created_at, started_at, finished_at) = rows[0]
+
+        chunks_per_second = None
+        eta_seconds = None
+        with self.lock:
+            progress = self.progress.get(job_id)
+            processed = progress["processed"] if progress else 0
+            recent_batches = list(progress["batches"]) if progress else []
+        if processed:
+            rate = processed / (time.perf_counter() - progress["started"])
+            chunks_per_second = round(rate, 1)
+            # From the unrounded rate: a slow job would round to 0 chunks/s
+            if total is not None and rate > 0:
+                eta_seconds = round((total - done - failed) / rate, 1)
+        elif finished_at and started_at and finished_at > started_at:
+            chunks_per_second = round((done + failed) / (finished_at - started_at), 1)
+
+        return {
+            "job_id": job_id,
+            "status": status,
+            "total": total,
+            "done": done,
+            "failed": failed,
+            "inserted": inserted,
+            "updated": updated,
+            "unchanged": unchanged,
+            "deleted": deleted,
+            "chunks_per_second": chunks_per_second,
+            "eta_seconds": eta_seconds,
+            "recent_batches": recent_batches,
+            "error": error,
+            "created_at": created_at,
+            "started_at": started_at,
+            "finished_at": finished_at
+        }
+
+job_manager = JobManager()
@@ -0,0 +1,185 @@
+# BM25 inverted index over chunk text, kept up to date by ingestion; answers exact-term queries without embeddings
+
+import heapq
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from dotenv import load_dotenv
+from app.metrics import stage
+
+load_dotenv()
+
+LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", "lexical_index/bm25.sqlite3")
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+# Words joined by . / - (DOIs, species names, hyphenated terms) are kept whole and also split into parts
+TOKEN_PATTERN = re.compile(r"\w+(?:[./\-]\w+)*")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has in is it its of on or that the to was were which with".split()
+)
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token not in STOPWORDS:
+            tokens.append(token)
+        parts = re.split(r"[./\-]", token)
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if part and part not in STOPWORDS)
+    return tokens
+
+class LexicalIndex:
+    def __init__(self, path: str = LEXICAL_INDEX_PATH):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(
+            "CREATE TABLE IF NOT EXISTS postings ("
+            " term TEXT NOT NULL, chunk_id TEXT NOT NULL, tf INTEGER NOT NULL, PRIMARY KEY (term, chunk_id)"
+            ") WITHOUT ROWID;"
+            "CREATE INDEX IF NOT EXISTS postings_chunk_id ON postings (chunk_id);"
+            "CREATE TABLE IF NOT EXISTS chunk_lengths (chunk_id TEXT PRIMARY KEY, length INTEGER NOT NULL);"
+        )
+        self.db.commit()
+        self.lock = threading.Lock()
+        self.reload()
+
+    def reload(self):
+        # Corpus totals are kept in memory so a query does not scan chunk_lengths; a read-only worker
+        # re-reads them when another process (the writer) changed the index
+        with self.lock:
+            self.chunk_count, self.total_length = self.db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(length), 0) FROM chunk_lengths"
+            ).fetchone()
+
+    def _remove(self, ids: List[str]):
+        placeholders = ",".join("?" * len(ids))
+        count, length = self.db.execute(
+            f"SELECT COUNT(*), COALESCE(SUM(length), 0) FROM chunk_lengths WHERE chunk_id IN ({placeholders})", ids
+        ).fetchone()
+        self.db.execute(f"DELETE FROM postings WHERE chunk_id IN ({placeholders})", ids)
+        self.db.execute(f"DELETE FROM chunk_lengths WHERE chunk_id IN ({placeholders})", ids)
+        self.chunk_count -= count
+        self.total_length -= length
+
+    def add(self, ids: List[str], texts: List[str]):
+        # Re-adding an id replaces its postings, so re-ingesting a chunk keeps the index consistent
+        if not ids:
+            return
+        rows, lengths = [], []
+        for chunk_id, text in zip(ids, texts):
+            counts = Counter(tokenize(text))
+            rows.extend((term, chunk_id, tf) for term, tf in counts.items())
+            lengths.append((chunk_id, sum(counts.values())))
+        with self.lock:
+            self._remove(list(ids))
+            self.db.executemany("INSERT OR REPLACE INTO postings (term, chunk_id, tf) VALUES (?, ?, ?)", rows)
+            self.db.executemany("INSERT OR REPLACE INTO chunk_lengths (chunk_id, length) VALUES (?, ?)", lengths)
+            self.chunk_count += len(lengths)
+            self.total_length += sum(length for _, length in lengths)
+            self.db.commit()
+
+    def remove(self, ids: List[str]):
+        if not ids:
+            return
+        with self.lock:
+            self._remove(list(ids))
+            self.db.commit()
+
+    def clear(self):
+        with self.lock:
+            self.db.execute("DELETE FROM postings")
+            self.db.execute("DELETE FROM chunk_lengths")
+            self.chunk_count, self.total_length = 0, 0
+            self.db.commit()
+
+    def search(self, query: str, k: int, accept: Optional[Callable[[List[str]], Iterable[str]]] = None,
+               page_size: Optional[int] = None) -> List[Tuple[str, float]]:
+        # accept filters on what the index does not store (metadata): it gets a page of ranked ids and
+        # returns those that qualify. Pages are checked until k hits qualified or every match was checked.
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or k <= 0:
+            return []
+        with stage("lexical_query", items=1):
+            scores = self._scores(terms)
+            if accept is None:
+                return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        page_size = max(k, page_size or k)
+        hits = []
+        for offset in range(0, len(ranked), page_size):
+            page = ranked[offset:offset + page_size]
+            allowed = set(accept([chunk_id for chunk_id, _ in page]))
+            hits.extend(hit for hit in page if hit[0] in allowed)
+            if len(hits) >= k:
+                break
+        return hits[:k]
+
+    def _scores(self, terms: List[str]) -> Dict[str, float]:
+        # BM25 score of every chunk containing at least one of the terms
+        placeholders = ",".join("?" * len(terms))
+        with self.lock:
+            n, total = self.chunk_count, self.total_length
+            if n == 0:
+                return {}
+            rows = self.db.execute(
+                f"SELECT p.term, p.chunk_id, p.tf, l.length FROM postings p "
+                f"JOIN chunk_lengths l ON l.chunk_id = p.chunk_id WHERE p.term IN ({placeholders})", terms
+            ).fetchall()
+
+        avg_length = total / n
+        df = Counter(term for term, _, _, _ in rows)
+        scores: Dict[str, float] = {}
+        for term, chunk_id, tf, length in rows:
+            idf = math.log(1 + (n - df[term] + 0.5) / (df[term] + 0.5))
+            norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (BM25_K1 + 1) / norm
+        return scores
+
+    def is_empty(self) -> bool:
+        with self.lock:
+            return self.chunk_count == 0
+
+    def backfill(self, collection, page_size: int = 1000) -> int:
+        # Index an existing collection (e.g. one ingested before the lexical index existed)
+        offset = 0
+        while True:
+            page = collection.get(limit=page_size, offset=offset, include=["documents"])
+            if not page["ids"]:
+                return offset
+            self.add(page["ids"], page["documents"])
+            offset += len(page["ids"])
+
+    def stats(self) -> Dict:
+        with self.lock:
+            terms = self.db.execute("SELECT COUNT(DISTINCT term) FROM postings").fetchone()[0]
+            postings = self.db.execute("SELECT COUNT(*) FROM postings").fetchone()[0]
+            chunks = self.chunk_count
+            total = self.total_length
+        size = sum(
+            os.path.getsize(self.path + suffix) for suffix in ("", "-wal") if os.path.exists(self.path + suffix)
+        )
+        return {
+            "chunks": chunks,
+            "terms": terms,
+            "postings": postings,
+            "avg_chunk_length": round(total / chunks, 1) if chunks else 0,
+            "size_bytes": size
+        }
+
+def reciprocal_rank_fusion(rankings: Iterable[List[str]], k: int = 60) -> Dict[str, float]:
+    # Fuse several ranked id lists; rank positions matter, raw scores (cosine vs BM25) do not
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, start=1):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return fused
+
+lexical_index = LexicalIndex()
@@ -0,0 +1,65 @@
+# Shared OpenAI chat client (sync for worker threads, async for request handlers)
+
+import os
+import time
+from typing import AsyncIterator
+from openai import OpenAI
+from dotenv import load_dotenv
+from app.clients import OPENAI_CHAT_TIMEOUT, async_openai, limit
+from app.metrics import stage, stage_latency
+
+load_dotenv()
+_client = None
+
+def sync_client() -> OpenAI:
+    # Created on first use, so importing the app does not build an HTTP client
+    global _client
+    if _client is None:
+        _client = OpenAI()
+    return _client
+
+CHAT_MODEL = os.getenv("CHAT_MODEL", "gpt-3.5-turbo")
+
+def complete(prompt: str, temperature: float = 0.5) -> str:
+    with stage("llm"):
+        response = sync_client().chat.completions.create(
+            model=CHAT_MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=temperature,
+            timeout=OPENAI_CHAT_TIMEOUT
+        )
+    return response.choices[0].message.content.strip()
+
+async def acomplete(prompt: str, temperature: float = 0.5) -> str:
+    # Waits for a free chat slot instead of blocking a worker thread
+    async with limit("chat"):
+        with stage("llm"):
+            response = await async_openai().chat.completions.create(
+                model=CHAT_MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=temperature,
+                timeout=OPENAI_CHAT_TIMEOUT
+            )
+    return response.choices[0].message.content.strip()
+
+async def astream(prompt: str, temperature: float = 0.5) -> AsyncIterator[str]:
+    # Yields content deltas as they arrive; the chat slot is held until the stream ends
+    async with limit("chat"):
+        with stage("llm"):
+            start = time.perf_counter()
+            stream = await async_openai().chat.completions.create(
+                model=CHAT_MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=temperature,
+                timeout=OPENAI_CHAT_TIMEOUT,
+                stream=True
+            )
+            first_token = True
+            async for event in stream:
+                if not event.choices or not event.choices[0].delta.content:
+                    continue
+                if first_token:
+                    # Time-to-first-token is the latency users actually perceive
+                    stage_latency.observe("llm_first_token", time.perf_counter() - start)
+                    first_token = False
+                yield event.choices[0].delta.content
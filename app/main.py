@@ -1,7 +1,28 @@
 
-from fastapi import FastAPI
+from app.workers import worker  # imported first: cold-start times are measured from here
+import logging
+import os
+import threading
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from app.api import router
+from app.jobs import job_manager
+from app.embedding import provider
+from app.vector_db import backfill_attribute_keys, check_embedding_provider, get_collection, reopen_collection
+from app.vector_db import reshard_collection, warm_collection
+from app.catalog import catalog
+from app.lexical import lexical_index
+from app.embedding import embedding_cache
+from app.compact_vectors import storage_stats
+from app.metrics import gauges, render_metrics
+from app.clients import aclose
+from app.watcher import watcher
+from app.usage import usage_counter
+from app.snapshots import seed_from_snapshot
+
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+logger = logging.getLogger(__name__)
 
 app = FastAPI(title="GenAI Research Assistant")
 
@@ -9,3 +30,153 @@ app = FastAPI(title="GenAI Research Assistant")
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
 app.include_router(router)
+worker.mark("imported")
+
+# Answers as soon as the process is up, before the vector store and embedder are loaded
+@app.get("/health")
+def health():
+    return {"status": "ok", "role": worker.role, "ready": worker.ready.is_set()}
+
+# 200 once the warm-up finished (load balancers should route here), 503 before or if it failed
+@app.get("/ready")
+def ready():
+    return JSONResponse(worker.stats(), status_code=200 if worker.ready.is_set() else 503)
+
+# Requests fail fast if the warm-up failed (e.g. the collection was built with a different embedder).
+# Requests in flight are counted so a read-only worker reloads while idle and closes a replaced store
+# only after the requests using it finished; the reload itself runs in the worker's own thread.
+@app.middleware("http")
+async def serve_worker(request: Request, call_next):
+    if worker.error is not None and request.url.path not in ("/health", "/ready", "/metrics"):
+        return JSONResponse({"detail": f"Worker failed to start: {worker.error}"}, status_code=503)
+    epoch = worker.request_started()
+    try:
+        response = await call_next(request)
+    except BaseException:
+        worker.request_finished(epoch)
+        raise
+    response.body_iterator = _finish_after(response.body_iterator, epoch)
+    return response
+
+async def _finish_after(body, epoch: int):
+    # Streamed answers still read the store after call_next returned, so a request counts until its body was sent
+    try:
+        async for chunk in body:
+            yield chunk
+    finally:
+        worker.request_finished(epoch)
+
+# Prometheus scrape endpoint: per-stage latency histograms plus embedding cache counters
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    cache = embedding_cache.stats()
+    extra = "\n".join([
+        gauges(
+            "genai_embedding_cache", "Embedding cache counters and sizes",
+            {key: value for key, value in cache.items() if isinstance(value, (int, float))}, "field"
+        ),
+        gauges("genai_lexical_index", "BM25 index sizes", lexical_index.stats(), "field"),
+        gauges("genai_usage_counter", "Write-behind usage count buffer", usage_counter.stats(), "field"),
+        gauges(
+            "genai_vector_storage", "Vector bytes per chunk in the index and the re-rank store",
+            {key: value for key, value in storage_stats(provider.dimension).items()
+             if isinstance(value, (int, float)) and not isinstance(value, bool)}, "field"
+        ),
+        gauges(
+            "genai_worker", "Worker role, readiness and the data generation it serves",
+            {"writer": int(worker.is_writer), "ready": int(worker.ready.is_set()), "generation": worker.generation,
+             "reloads": worker.reloads},
+            "field"
+        ),
+        gauges("genai_cold_start_seconds", "Seconds from import to each startup phase", worker.timings, "phase")
+    ] + ([gauges(
+        "genai_watcher", "Directory watcher throughput and backlog",
+        {key: value for key, value in watcher.stats().items() if isinstance(value, (int, float))}, "field"
+    )] if watcher else []))
+    return PlainTextResponse(render_metrics(extra), media_type="text/plain; version=0.0.4")
+
+# Build the document catalog for a collection that was ingested before the catalog existed
+def backfill_catalog():
+    collection = get_collection()
+    if catalog.is_empty() and collection.count() > 0:
+        catalog.backfill(collection)
+
+# Build the BM25 index for a collection that was ingested before the index existed
+def backfill_lexical_index():
+    collection = get_collection()
+    if lexical_index.is_empty() and collection.count() > 0:
+        lexical_index.backfill(collection)
+        worker.publish()
+
+# A reader promoted while its own warm-up is still running would otherwise start them twice
+_writer_services_lock = threading.Lock()
+_writer_services_started = False
+
+def start_writer_services():
+    # Migrations, ingestion jobs (including those queued by other workers) and the directory watcher
+    # run in the writer process only, and only once
+    global _writer_services_started
+    with _writer_services_lock:
+        if _writer_services_started:
+            return
+        _writer_services_started = True
+    # A new node with an empty store starts from SNAPSHOT_SEED instead of re-embedding the corpus
+    seed_from_snapshot()
+    backfill_catalog()
+    # Add filterable attr_<name> keys to chunks ingested before attributes could be filtered
+    backfill_attribute_keys()
+    # Move chunks into their shards when VECTOR_SHARD_KEY was set (or changed) on an existing collection
+    reshard_collection()
+    backfill_lexical_index()
+    # Pick up ingestion jobs that were interrupted by a restart
+    job_manager.start()
+    # Ingest files dropped into WATCH_DIR (only when it is configured)
+    if watcher:
+        watcher.start()
+
+def warm_up():
+    # Opens the store, loads the embedder and the ANN index before the worker reports ready; runs in the
+    # background so the health check answers meanwhile. Each step is timed for /ready and /metrics.
+    try:
+        with worker.timed("vector_store"):
+            collection = get_collection()
+        # Fail fast if the collection was built with a different embedder
+        with worker.timed("embedding_provider"):
+            check_embedding_provider(provider.name, provider.model, provider.dimension, record=worker.is_writer)
+        with worker.timed("vector_index"):
+            warm_collection(collection)
+        if worker.is_writer:
+            with worker.timed("writer_services"):
+                start_writer_services()
+    except Exception as e:
+        worker.error = str(e)
+        logger.exception("Warm-up failed")
+        return
+    worker.mark("ready")
+    worker.ready.set()
+    logger.info("Worker %d (%s) ready: %s", os.getpid(), worker.role, worker.timings)
+
+@app.on_event("startup")
+def start_worker():
+    worker.elect()
+    worker.on_reload(reopen_collection)
+    worker.on_reload(lexical_index.reload)
+    # A reader that takes over after the writer exited starts what the writer ran
+    worker.on_promote(start_writer_services)
+    # Flush retrieval counts periodically (readers hand theirs to the writer), and once more on shutdown
+    usage_counter.start()
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+    worker.mark("started")
+
+@app.on_event("shutdown")
+def stop_worker():
+    job_manager.stop()
+    usage_counter.stop()
+    if watcher:
+        watcher.stop()
+    worker.stop()
+
+# Close pooled upstream connections
+@app.on_event("shutdown")
+async def close_clients():
+    await aclose()
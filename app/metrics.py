@@ -0,0 +1,115 @@
+# Per-stage latency histograms and counters, exposed in Prometheus text format on /metrics
+
+import bisect
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger("app.payloads")
+
+# Full payload logging is off by default; when enabled only a sample of calls is logged
+LOG_PAYLOADS = os.getenv("LOG_PAYLOADS", "false").lower() == "true"
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0.01"))
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Histogram:
+    def __init__(self, name: str, description: str, label: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label = label
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, label_value: str, value: float):
+        with self.lock:
+            series = self.series.get(label_value)
+            if series is None:
+                series = self.series[label_value] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series["counts"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for label_value, series in sorted(self.series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series["counts"]):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{{{self.label}="{label_value}",le="{bound}"}} {cumulative}')
+                lines.append(f'{self.name}_bucket{{{self.label}="{label_value}",le="+Inf"}} {series["count"]}')
+                lines.append(f'{self.name}_sum{{{self.label}="{label_value}"}} {series["sum"]}')
+                lines.append(f'{self.name}_count{{{self.label}="{label_value}"}} {series["count"]}')
+        return "\n".join(lines)
+
+class Counter:
+    def __init__(self, name: str, description: str, label: str):
+        self.name = name
+        self.description = description
+        self.label = label
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, label_value: str, amount: float = 1):
+        with self.lock:
+            self.values[label_value] = self.values.get(label_value, 0) + amount
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for label_value, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{{{self.label}="{label_value}"}} {value}')
+        return "\n".join(lines)
+
+stage_latency = Histogram(
+    "genai_stage_duration_seconds", "Latency of each pipeline stage in seconds", "stage"
+)
+stage_errors = Counter(
+    "genai_stage_errors_total", "Number of failed calls per pipeline stage", "stage"
+)
+stage_items = Counter(
+    "genai_stage_items_total", "Number of items (texts, vectors, chunks) processed per pipeline stage", "stage"
+)
+
+@contextmanager
+def stage(name: str, items: int = 0):
+    # Usage: with stage("embedding", items=len(texts)): ...
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        stage_errors.inc(name)
+        raise
+    finally:
+        stage_latency.observe(name, time.perf_counter() - start)
+        if items:
+            stage_items.inc(name, items)
+
+def log_payload(message: str, payload):
+    # Sampled and opt-in, so hot paths do not pay for formatting large payloads
+    if LOG_PAYLOADS and random.random() < LOG_PAYLOAD_SAMPLE_RATE:
+        logger.info("%s: %s", message, payload)
+
+def gauges(name: str, description: str, values: Dict[str, float], label: str) -> str:
+    lines = [f"# HELP {name} {description}", f"# TYPE {name} gauge"]
+    for label_value, value in sorted(values.items()):
+        if value is not None:
+            lines.append(f'{name}{{{label}="{label_value}"}} {value}')
+    return "\n".join(lines)
+
+def render_metrics(extra: str = "") -> str:
+    sections = [stage_latency.render(), stage_errors.render(), stage_items.render()]
+    if extra:
+        sections.append(extra)
+    return "\n".join(sections) + "\n"
@@ -0,0 +1,16 @@
+from pydantic import BaseModel
+from typing import List, Optional
+
+# Define the chunk schema
+class Chunk(BaseModel):
+    id: str
+    source_doc_id: str
+    chunk_index: int
+    section_heading: str
+    journal: str
+    publish_year: int
+    usage_count: int
+    attributes: List[str]
+    link: Optional[str] = None
+    doi: Optional[str] = None
+    text: str
@@ -0,0 +1,102 @@
+# Retrieval-augmented answers: token-budgeted, de-duplicated, diverse (MMR) context selection
+
+import os
+from typing import AsyncIterator, Dict, List, Tuple
+import numpy as np
+from dotenv import load_dotenv
+from app.ingestion import estimate_tokens
+from app.llm import acomplete, astream
+
+load_dotenv()
+
+# Max (estimated) tokens of chunk text put into the prompt
+ASK_CONTEXT_TOKENS = int(os.getenv("ASK_CONTEXT_TOKENS", "3000"))
+# Candidates fetched from the vector DB per requested source
+ASK_CANDIDATE_MULTIPLIER = int(os.getenv("ASK_CANDIDATE_MULTIPLIER", "3"))
+# Chunks this similar to an already selected chunk are treated as duplicates
+ASK_DUPLICATE_THRESHOLD = float(os.getenv("ASK_DUPLICATE_THRESHOLD", "0.95"))
+# MMR trade-off: 1.0 = relevance only, 0.0 = diversity only
+ASK_MMR_LAMBDA = float(os.getenv("ASK_MMR_LAMBDA", "0.7"))
+
+ASK_PROMPT = """Use the context below to answer the user's question. 
+Cite sources inline using [Source X] format.
+
+{context}
+
+Question: {question}
+Answer:"""
+
+CITATION_FIELDS = (
+    "id", "source_doc_id", "chunk_index", "section_heading", "journal", "publish_year",
+    "similarity_score", "usage_count", "link", "doi"
+)
+
+def select_context(matches: List[Dict], vectors: Dict[str, List[float]], k: int,
+                   max_tokens: int = ASK_CONTEXT_TOKENS) -> Tuple[List[Dict], Dict]:
+    # Greedy MMR over the candidates, skipping near-duplicates and chunks that do not fit the budget.
+    # CPU-bound (callers run it on a worker thread): the candidates' cosine similarities are computed
+    # once as a matrix, and each pick updates every candidate's redundancy with one vector operation.
+    stats = {"candidates": len(matches), "duplicates": 0, "over_budget": 0, "context_tokens": 0}
+    if not matches:
+        return [], stats
+    rows = [vectors.get(chunk["id"]) for chunk in matches]
+    dimension = next((len(row) for row in rows if row is not None), 0)
+    matrix = np.zeros((len(matches), dimension))
+    for position, row in enumerate(rows):
+        if row is not None:
+            matrix[position] = row
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix /= np.where(norms > 0, norms, 1)
+    # Candidates without a vector have zero rows, so they are never redundant with anything
+    similarities = matrix @ matrix.T
+    relevance = np.array([chunk["similarity_score"] for chunk in matches])
+    # Highest similarity to a selected chunk; none is selected yet
+    redundancy = np.full(len(matches), -np.inf)
+    available = np.ones(len(matches), dtype=bool)
+
+    selected = []
+    used_tokens = 0
+    while available.any() and len(selected) < k:
+        penalty = np.where(np.isfinite(redundancy), redundancy, 0.0)
+        scores = ASK_MMR_LAMBDA * relevance - (1 - ASK_MMR_LAMBDA) * penalty
+        best = int(np.argmax(np.where(available, scores, -np.inf)))
+        available[best] = False
+
+        if penalty[best] >= ASK_DUPLICATE_THRESHOLD:
+            stats["duplicates"] += 1
+            continue
+        tokens = estimate_tokens(matches[best]["text"])
+        if used_tokens + tokens > max_tokens:
+            stats["over_budget"] += 1
+            continue
+
+        selected.append(matches[best])
+        if rows[best] is not None:
+            np.maximum(redundancy, similarities[best], out=redundancy)
+        used_tokens += tokens
+
+    stats["context_tokens"] = used_tokens
+    return selected, stats
+
+def build_prompt(question: str, selected: List[Dict]) -> Tuple[str, List[Dict]]:
+    context = ""
+    citations = []
+    for idx, chunk in enumerate(selected, start=1):
+        context += f"[Source {idx}] {chunk['text']}\n\n"
+        citation = {field: chunk.get(field) for field in CITATION_FIELDS}
+        citation["source_number"] = idx
+        citations.append(citation)
+    return ASK_PROMPT.format(context=context, question=question), citations
+
+async def answer(question: str, selected: List[Dict], stats: Dict) -> Dict:
+    prompt, citations = build_prompt(question, selected)
+    text = await acomplete(prompt, temperature=0.7)
+    return {"answer": text, "citations": citations, "prompt_tokens": estimate_tokens(prompt), **stats}
+
+async def answer_stream(question: str, selected: List[Dict], stats: Dict) -> AsyncIterator[Tuple[str, Dict]]:
+    # Citations go first so the client can show them while the answer is still being generated
+    prompt, citations = build_prompt(question, selected)
+    yield "citations", {"citations": citations}
+    async for delta in astream(prompt, temperature=0.7):
+        yield "delta", {"text": delta}
+    yield "done", {"prompt_tokens": estimate_tokens(prompt), **stats}
@@ -0,0 +1,372 @@
+# Binary snapshots of the vector store: export ids, vectors, metadata and documents to one file and restore
+# them with bulk writes, without embedding anything again. Also used to seed a new node (SNAPSHOT_SEED).
+#
+# File layout (little-endian):
+#   MAGIC, padded to 64 bytes
+#   vectors        float32, chunks x vector_dimension, one contiguous row-major block (as stored in the index)
+#   full_vectors   float32, chunks x embedding_dimension; only with compact storage and re-ranking,
+#                  rows without a stored full vector are NaN
+#   <column>_offsets uint64, chunks + 1 byte offsets into <column>, for the ids, documents and metadatas
+#   <column>       UTF-8 strings back to back (metadatas as JSON, without "text", which is the document)
+#   footer         JSON: counts, dimensions, the embedder and each block's offset, length and CRC-32
+#   footer length  uint64, then MAGIC again
+# Every block starts on a 64-byte boundary, so the vector blocks can be memory-mapped as numpy arrays.
+#
+#   python -m app.snapshots export snapshots/nightly.snapshot
+#   python -m app.snapshots restore snapshots/nightly.snapshot   # replaces the store; --merge upserts into it
+#   python -m app.snapshots info snapshots/nightly.snapshot
+
+import argparse
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import time
+import uuid
+import zlib
+from typing import Dict, List, Optional
+import numpy as np
+from dotenv import load_dotenv
+from app.catalog import catalog
+from app.clients import http_client
+from app.compact_vectors import VECTOR_INDEX_DIMENSIONS, full_vectors
+from app.embedding import provider
+from app.lexical import lexical_index
+from app.vector_db import check_embedding_provider, clear_chunks, collection_metadata, count_chunks
+from app.vector_db import get_chunks_with_embeddings
+from app.vector_db import mark_attribute_keys, restore_chunks, upsert_chunks_to_db
+from app.workers import worker
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshots")
+# Chunks read per page on export and written per bulk upsert on restore
+SNAPSHOT_PAGE_SIZE = int(os.getenv("SNAPSHOT_PAGE_SIZE", "1000"))
+# Path or http(s) URL of a snapshot restored at startup when the vector store is empty (seeds new nodes)
+SNAPSHOT_SEED = os.getenv("SNAPSHOT_SEED", "")
+
+MAGIC = b"GENAISNP"
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+STRING_COLUMNS = ("ids", "documents", "metadatas")
+
+def snapshot_path(directory: str = SNAPSHOT_DIR) -> str:
+    return os.path.join(directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}.snapshot")
+
+class StringColumn:
+    # Spooled to a temporary file during export, since the vector block has to be written first
+    def __init__(self):
+        self.file = tempfile.TemporaryFile()
+        self.offsets = [0]
+
+    def append(self, value: str):
+        data = value.encode("utf-8")
+        self.file.write(data)
+        self.offsets.append(self.offsets[-1] + len(data))
+
+class BlockWriter:
+    def __init__(self, handle):
+        self.handle = handle
+        self.blocks: Dict[str, Dict] = {}
+        self.current = None
+
+    def _align(self):
+        padding = -self.handle.tell() % ALIGNMENT
+        if padding:
+            self.handle.write(b"\0" * padding)
+
+    def begin(self, name: str):
+        self._align()
+        self.current = self.blocks[name] = {"offset": self.handle.tell(), "length": 0, "crc32": 0}
+
+    def write(self, data: bytes):
+        self.handle.write(data)
+        self.current["length"] += len(data)
+        self.current["crc32"] = zlib.crc32(data, self.current["crc32"])
+
+    def block(self, name: str, data: bytes):
+        self.begin(name)
+        self.write(data)
+
+def export_snapshot(path: str, page_size: int = SNAPSHOT_PAGE_SIZE) -> Dict:
+    # Not a point-in-time copy: pages are read by offset, so chunks written meanwhile can shift them and a
+    # chunk could be missed or exported twice. An export during which the writer published fails instead.
+    started = time.perf_counter()
+    generation = worker.published_generation()
+    metadata = collection_metadata()
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = f"{path}.partial"
+    columns = {name: StringColumn() for name in STRING_COLUMNS}
+    full_spool = tempfile.TemporaryFile() if full_vectors is not None else None
+    full_dimension = metadata.get("embedding_dimension") or provider.dimension
+    dimension = None
+    count = 0
+    try:
+        with open(partial, "wb") as handle:
+            handle.write(MAGIC.ljust(ALIGNMENT, b"\0"))
+            writer = BlockWriter(handle)
+            writer.begin("vectors")
+            while True:
+                page = get_chunks_with_embeddings(offset=count, limit=page_size)
+                if not page["ids"]:
+                    break
+                vectors = np.asarray(page["embeddings"], dtype=np.float32).reshape(len(page["ids"]), -1)
+                if dimension is None:
+                    dimension = vectors.shape[1]
+                elif vectors.shape[1] != dimension:
+                    raise RuntimeError(f"Chunks with {vectors.shape[1]}-dim and {dimension}-dim vectors in one store")
+                writer.write(vectors.tobytes())
+                for chunk_id, chunk_metadata, document in zip(page["ids"], page["metadatas"], page["documents"]):
+                    chunk_metadata = dict(chunk_metadata or {})
+                    if chunk_metadata.get("text") == document:
+                        del chunk_metadata["text"]
+                    columns["ids"].append(chunk_id)
+                    columns["documents"].append(document or "")
+                    columns["metadatas"].append(json.dumps(chunk_metadata, separators=(",", ":")))
+                if full_spool is not None:
+                    stored = full_vectors.get_many(page["ids"])
+                    rows = np.full((len(page["ids"]), full_dimension), np.nan, dtype=np.float32)
+                    for row, chunk_id in enumerate(page["ids"]):
+                        if chunk_id in stored:
+                            rows[row] = stored[chunk_id]
+                    full_spool.write(rows.tobytes())
+                count += len(page["ids"])
+
+            if full_spool is not None:
+                writer.begin("full_vectors")
+                full_spool.seek(0)
+                while data := full_spool.read(1 << 20):
+                    writer.write(data)
+            for name, column in columns.items():
+                writer.block(f"{name}_offsets", np.asarray(column.offsets, dtype=np.uint64).tobytes())
+                writer.begin(name)
+                column.file.seek(0)
+                while data := column.file.read(1 << 20):
+                    writer.write(data)
+
+            footer = {
+                "format_version": FORMAT_VERSION,
+                "created_at": time.time(),
+                "chunks": count,
+                "vector_dimension": dimension or VECTOR_INDEX_DIMENSIONS or provider.dimension,
+                "full_vector_dimension": full_dimension if full_spool is not None else None,
+                "embedding_provider": metadata.get("embedding_provider"),
+                "embedding_model": metadata.get("embedding_model"),
+                "embedding_dimension": metadata.get("embedding_dimension"),
+                "attribute_keys": bool(metadata.get("attribute_keys")),
+                "blocks": writer.blocks
+            }
+            data = json.dumps(footer).encode("utf-8")
+            handle.write(data)
+            handle.write(struct.pack("<Q", len(data)) + MAGIC)
+        if worker.published_generation() != generation:
+            raise RuntimeError("The store changed during the export; retry once no ingestion is running")
+        os.replace(partial, path)
+    finally:
+        for column in columns.values():
+            column.file.close()
+        if full_spool is not None:
+            full_spool.close()
+        if os.path.exists(partial):
+            os.remove(partial)
+
+    elapsed = time.perf_counter() - started
+    size = os.path.getsize(path)
+    logger.info("Exported %d chunks to %s (%d bytes) in %.1fs", count, path, size, elapsed)
+    return {
+        "path": path,
+        "chunks": count,
+        "size_bytes": size,
+        "bytes_per_chunk": round(size / count, 1) if count else 0,
+        "seconds": round(elapsed, 3)
+    }
+
+class Snapshot:
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "rb")
+        try:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            self.file.close()
+            raise ValueError(f"{path} is not a snapshot")
+        tail = self.data[-16:]
+        if self.data[:len(MAGIC)] != MAGIC or len(tail) < 16 or tail[8:] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a snapshot")
+        footer_length = struct.unpack("<Q", tail[:8])[0]
+        self.header = json.loads(self.data[-16 - footer_length:-16])
+        if self.header["format_version"] > FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"{path} has snapshot format {self.header['format_version']}, newer than this version")
+        self.count = self.header["chunks"]
+        self.blocks = self.header["blocks"]
+        self.vectors = self._array("vectors", np.float32, (self.count, self.header["vector_dimension"]))
+        self.full_vectors = (
+            self._array("full_vectors", np.float32, (self.count, self.header["full_vector_dimension"]))
+            if "full_vectors" in self.blocks else None
+        )
+        self.offsets = {name: self._array(f"{name}_offsets", np.uint64, (self.count + 1,)) for name in STRING_COLUMNS}
+
+    def _array(self, name: str, dtype, shape) -> np.ndarray:
+        block = self.blocks[name]
+        return np.frombuffer(self.data, dtype=dtype, count=int(np.prod(shape)), offset=block["offset"]).reshape(shape)
+
+    def verify(self):
+        for name, block in self.blocks.items():
+            if zlib.crc32(self.data[block["offset"]:block["offset"] + block["length"]]) != block["crc32"]:
+                raise ValueError(f"Snapshot {self.path} is corrupt (checksum mismatch in {name})")
+
+    def strings(self, name: str, start: int, end: int) -> List[str]:
+        base = self.blocks[name]["offset"]
+        offsets = self.offsets[name][start:end + 1].tolist()
+        return [
+            self.data[base + offsets[i]:base + offsets[i + 1]].decode("utf-8") for i in range(end - start)
+        ]
+
+    def close(self):
+        # The numpy views must go before the map can be closed
+        self.vectors = self.full_vectors = self.offsets = None
+        self.data.close()
+        self.file.close()
+
+def snapshot_info(path: str) -> Dict:
+    snapshot = Snapshot(path)
+    try:
+        return {
+            "name": os.path.basename(path),
+            "size_bytes": os.path.getsize(path),
+            **{key: value for key, value in snapshot.header.items() if key != "blocks"}
+        }
+    finally:
+        snapshot.close()
+
+def list_snapshots(directory: str = SNAPSHOT_DIR) -> List[Dict]:
+    if not os.path.isdir(directory):
+        return []
+    snapshots = []
+    for name in sorted(os.listdir(directory)):
+        try:
+            snapshots.append(snapshot_info(os.path.join(directory, name)))
+        except (ValueError, OSError):
+            continue  # partial exports and unrelated files
+    return snapshots
+
+def restore_snapshot(path: str, batch_size: int = SNAPSHOT_PAGE_SIZE, replace: bool = False) -> Dict:
+    # Bulk upserts straight from the mapped file. replace first empties the store (chunks, full vectors,
+    # catalog and BM25 index), so it holds exactly the snapshot; otherwise chunks with the same ids are
+    # replaced and the others are kept.
+    started = time.perf_counter()
+    removed = 0
+    snapshot = Snapshot(path)
+    try:
+        header = snapshot.header
+        snapshot.verify()
+        recorded = (header["embedding_provider"], header["embedding_model"], header["embedding_dimension"])
+        if recorded != (None, None, None) and recorded != (provider.name, provider.model, provider.dimension):
+            raise RuntimeError(
+                f"Snapshot {path} was built with {recorded[0]}/{recorded[1]} ({recorded[2]} dims) but the configured "
+                f"embedder is {provider.name}/{provider.model} ({provider.dimension} dims)"
+            )
+        # Vectors are written as stored when this node indexes the same size as the exporting node; otherwise
+        # full-precision vectors go through the ingestion write path, which truncates them for this node
+        index_dimension = VECTOR_INDEX_DIMENSIONS or provider.dimension
+        if header["vector_dimension"] == index_dimension:
+            source = None
+        elif header["vector_dimension"] == provider.dimension:
+            source = "vectors"
+        elif (snapshot.full_vectors is not None and header["full_vector_dimension"] == provider.dimension
+              and not np.isnan(snapshot.full_vectors[:, 0]).any()):
+            source = "full_vectors"
+        else:
+            raise RuntimeError(
+                f"Snapshot {path} holds {header['vector_dimension']}-dim vectors but this node indexes "
+                f"{index_dimension}-dim vectors; set VECTOR_INDEX_DIMENSIONS to match"
+            )
+        check_embedding_provider(provider.name, provider.model, provider.dimension)
+        # Only after every check passed, so a snapshot that cannot be restored leaves the store as it was
+        if replace:
+            removed = clear_chunks()
+            catalog.clear()
+            lexical_index.clear()
+            worker.publish()
+
+        for start in range(0, snapshot.count, batch_size):
+            end = min(snapshot.count, start + batch_size)
+            ids = snapshot.strings("ids", start, end)
+            documents = snapshot.strings("documents", start, end)
+            metadatas = [
+                {**json.loads(metadata), "text": document}
+                for metadata, document in zip(snapshot.strings("metadatas", start, end), documents)
+            ]
+            if source is not None:
+                upsert_chunks_to_db(ids, np.array(getattr(snapshot, source)[start:end]).tolist(), metadatas)
+            else:
+                vectors = np.array(snapshot.vectors[start:end])
+                full = None
+                if snapshot.full_vectors is not None:
+                    rows = np.array(snapshot.full_vectors[start:end])
+                    full = {chunk_id: rows[i] for i, chunk_id in enumerate(ids) if not np.isnan(rows[i, 0])}
+                restore_chunks(ids, vectors, metadatas, full)
+            catalog.record_chunks(ids, metadatas)
+            lexical_index.add(ids, documents)
+            worker.publish()
+        if header["attribute_keys"]:
+            mark_attribute_keys()
+    finally:
+        snapshot.close()
+
+    elapsed = time.perf_counter() - started
+    logger.info("Restored %d chunks from %s in %.1fs", snapshot.count, path, elapsed)
+    return {
+        "path": path,
+        "chunks": snapshot.count,
+        "replaced": replace,
+        "removed": removed,
+        "seconds": round(elapsed, 3),
+        "chunks_per_second": round(snapshot.count / elapsed, 1) if elapsed > 0 else None
+    }
+
+def seed_from_snapshot(source: str = SNAPSHOT_SEED) -> Optional[Dict]:
+    # New nodes start from a snapshot instead of re-embedding the corpus; a store with chunks is left alone
+    if not source or count_chunks() > 0:
+        return None
+    path = source
+    if source.startswith(("http://", "https://")):
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        path = os.path.join(SNAPSHOT_DIR, "seed.snapshot")
+        with http_client.stream("GET", source) as response, open(path, "wb") as handle:
+            response.raise_for_status()
+            for data in response.iter_bytes(1 << 20):
+                handle.write(data)
+    # Also clears a catalog or BM25 index left over from a store that was deleted
+    return restore_snapshot(path, replace=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or restore a binary snapshot of the vector store")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="write a snapshot of the current store")
+    export.add_argument("path", nargs="?", default=None, help=f"default: a new file in {SNAPSHOT_DIR}/")
+    restore = commands.add_parser("restore", help="replace the store with a snapshot (no embedding calls)")
+    restore.add_argument("path")
+    restore.add_argument("--merge", action="store_true", help="upsert into the store instead of replacing it")
+    info = commands.add_parser("info", help="print a snapshot's header")
+    info.add_argument("path")
+    parser.add_argument("--page-size", type=int, default=SNAPSHOT_PAGE_SIZE)
+    args = parser.parse_args()
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+
+    if args.command == "export":
+        result = export_snapshot(args.path or snapshot_path(), args.page_size)
+    elif args.command == "restore":
+        result = restore_snapshot(args.path, args.page_size, replace=not args.merge)
+    else:
+        result = snapshot_info(args.path)
+    print(json.dumps(result, indent=2))
+
+if __name__ == "__main__":
+    main()
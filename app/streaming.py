@@ -0,0 +1,115 @@
+# Incremental parsing of remote or local chunk dumps (JSON array or NDJSON, optionally gzip-compressed)
+
+import codecs
+import itertools
+import json
+import zlib
+from typing import Dict, Iterable, Iterator
+from app.clients import http_client, http_fetch_slots
+
+STREAM_READ_BYTES = 64 * 1024
+GZIP_MAGIC = b"\x1f\x8b"
+
+def decompress_stream(byte_chunks: Iterable[bytes]) -> Iterator[bytes]:
+    # Gzip is detected from the magic bytes, so .gz files work whatever their content type
+    decompressor = None
+    head = b""
+    started = False
+    for data in byte_chunks:
+        if not started:
+            head += data
+            if len(head) < len(GZIP_MAGIC):
+                continue
+            started = True
+            data = head
+            if data[:2] == GZIP_MAGIC:
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if decompressor is None:
+            yield data
+        else:
+            yield decompressor.decompress(data)
+    if not started:
+        yield head
+    elif decompressor is not None:
+        yield decompressor.flush()
+
+def decode_stream(byte_chunks: Iterable[bytes]) -> Iterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    for data in byte_chunks:
+        text = decoder.decode(data)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+def _iter_array(text_chunks: Iterator[str], buffer: str, position: int) -> Iterator[Dict]:
+    decoder = json.JSONDecoder()
+    exhausted = False
+    position += 1  # skip the opening "["
+    while True:
+        # Skip whitespace and separators between elements
+        while position < len(buffer) and buffer[position] in " \t\r\n,":
+            position += 1
+        if position < len(buffer) and buffer[position] == "]":
+            return
+        if position < len(buffer):
+            try:
+                record, end = decoder.raw_decode(buffer, position)
+                yield record
+                position = end
+                continue
+            except json.JSONDecodeError:
+                if exhausted:
+                    raise
+        elif exhausted:
+            raise ValueError("Unexpected end of JSON array")
+
+        # Need more data: drop what has been consumed and read the next piece
+        buffer = buffer[position:]
+        position = 0
+        try:
+            buffer += next(text_chunks)
+        except StopIteration:
+            exhausted = True
+
+def _iter_lines(text_chunks: Iterator[str], buffer: str) -> Iterator[Dict]:
+    pending = ""
+    for text in itertools.chain([buffer], text_chunks):
+        pending += text
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+    if pending.strip():
+        yield json.loads(pending)
+
+def iter_json_records(text_chunks: Iterable[str]) -> Iterator[Dict]:
+    # Yields one record at a time so memory stays flat regardless of the dump size
+    text_chunks = iter(text_chunks)
+    buffer = ""
+    for text in text_chunks:
+        buffer += text
+        if buffer.strip():
+            break
+    stripped = buffer.lstrip()
+    if not stripped:
+        return
+    if stripped[0] == "[":
+        yield from _iter_array(text_chunks, buffer, len(buffer) - len(stripped))
+    else:
+        yield from _iter_lines(text_chunks, buffer)
+
+def stream_records(file_url: str) -> Iterator[Dict]:
+    # Uses the shared pooled HTTP client; Content-Encoding (e.g. gzip) is decoded by httpx.
+    # A slot is held for the whole download, so at most HTTP_FETCH_CONCURRENCY files are fetched at once.
+    with http_fetch_slots, http_client.stream("GET", file_url) as response:
+        response.raise_for_status()
+        byte_chunks = response.iter_bytes(chunk_size=STREAM_READ_BYTES)
+        yield from iter_json_records(decode_stream(decompress_stream(byte_chunks)))
+
+def read_records(path: str) -> Iterator[Dict]:
+    # Local files go through the same incremental parser, so large dumps are never loaded whole
+    with open(path, "rb") as f:
+        byte_chunks = iter(lambda: f.read(STREAM_READ_BYTES), b"")
+        yield from iter_json_records(decode_stream(decompress_stream(byte_chunks)))
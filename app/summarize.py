@@ -0,0 +1,171 @@
+# Hierarchical (map-reduce) summarization with a content-addressed summary cache
+
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from app.ingestion import estimate_tokens
+from app.llm import CHAT_MODEL, acomplete, astream
+
+load_dotenv()
+
+SUMMARY_CACHE_PATH = os.getenv("SUMMARY_CACHE_PATH", "summary_cache/summaries.sqlite3")
+# A group is at most this many chunks and this many (estimated) tokens
+SUMMARY_GROUP_CHUNKS = int(os.getenv("SUMMARY_GROUP_CHUNKS", "8"))
+SUMMARY_GROUP_TOKENS = int(os.getenv("SUMMARY_GROUP_TOKENS", "6000"))
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", "4"))
+
+DOCUMENT_PROMPT = "Summarize the following academic document:\n\n{text}"
+# Group summaries are cached by prompt, so it has no position: "part 2 of 5" changes whenever a group is added
+GROUP_PROMPT = (
+    "Summarize the following excerpt of an academic document. "
+    "Keep the key findings, methods and numbers:\n\n{text}"
+)
+REDUCE_PROMPT = (
+    "The following are summaries of consecutive parts of an academic document. "
+    "Combine them into one coherent summary of the whole document:\n\n{text}"
+)
+
+def content_hash(*parts: str) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+class SummaryCache:
+    def __init__(self, path: str = SUMMARY_CACHE_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS summaries (key TEXT PRIMARY KEY, summary TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self.db.commit()
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self.lock:
+            row = self.db.execute("SELECT summary FROM summaries WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key: str, summary: str):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO summaries VALUES (?, ?, ?)", (key, summary, time.time()))
+            self.db.commit()
+
+summary_cache = SummaryCache()
+
+async def cached_complete(kind: str, prompt: str, stats: Dict) -> str:
+    # Keyed by prompt content, so identical groups are summarized once across requests and documents.
+    # The cache is SQLite, so it is read and written on a worker thread rather than the event loop.
+    key = content_hash(kind, CHAT_MODEL, prompt)
+    summary = await asyncio.to_thread(summary_cache.get, key)
+    if summary is not None:
+        stats["cached_calls"] += 1
+        return summary
+    summary = await acomplete(prompt)
+    await asyncio.to_thread(summary_cache.put, key, summary)
+    stats["llm_calls"] += 1
+    return summary
+
+async def cached_stream(kind: str, prompt: str, stats: Dict) -> AsyncIterator[str]:
+    # Streaming variant of cached_complete: a cached result is yielded in one piece
+    key = content_hash(kind, CHAT_MODEL, prompt)
+    summary = await asyncio.to_thread(summary_cache.get, key)
+    if summary is not None:
+        stats["cached_calls"] += 1
+        yield summary
+        return
+    parts = []
+    async for delta in astream(prompt):
+        parts.append(delta)
+        yield delta
+    await asyncio.to_thread(summary_cache.put, key, "".join(parts).strip())
+    stats["llm_calls"] += 1
+
+async def gather_limited(calls, concurrency: int = SUMMARY_CONCURRENCY) -> List:
+    # Like asyncio.gather, but at most `concurrency` calls of one request run at the same time
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(call):
+        async with semaphore:
+            return await call
+
+    return await asyncio.gather(*(run(call) for call in calls))
+
+def group_texts(texts: List[str], max_chunks: int = SUMMARY_GROUP_CHUNKS,
+                max_tokens: int = SUMMARY_GROUP_TOKENS) -> List[List[str]]:
+    # Boundaries only depend on the texts before them: editing a chunk leaves the groups before it (and their
+    # cached summaries) intact, changes its own group, and shifts the later ones if its size moves a boundary
+    groups = []
+    group = []
+    group_tokens = 0
+    for text in texts:
+        tokens = estimate_tokens(text)
+        if group and (len(group) >= max_chunks or group_tokens + tokens > max_tokens):
+            groups.append(group)
+            group = []
+            group_tokens = 0
+        group.append(text)
+        group_tokens += tokens
+    if group:
+        groups.append(group)
+    return groups
+
+async def final_prompt(texts: List[str], stats: Dict) -> Tuple[str, str]:
+    # Runs the map levels and returns the last (kind, prompt) to send, so it can be completed or streamed
+    groups = group_texts(texts)
+    if len(groups) == 1:
+        return "document", DOCUMENT_PROMPT.format(text="\n\n".join(groups[0]))
+
+    # Map: summarize groups in parallel
+    prompts = [GROUP_PROMPT.format(text="\n\n".join(group)) for group in groups]
+    partials = await gather_limited([cached_complete("group", prompt, stats) for prompt in prompts])
+    stats["groups"] += len(groups)
+
+    # Reduce: combine partial summaries, going up another level if they still do not fit in one prompt
+    if sum(estimate_tokens(partial) for partial in partials) > SUMMARY_GROUP_TOKENS:
+        return await final_prompt(partials, stats)
+    numbered = [f"Part {part} of {len(partials)}:\n{partial}" for part, partial in enumerate(partials, start=1)]
+    return "reduce", REDUCE_PROMPT.format(text="\n\n".join(numbered))
+
+def document_key(doc_id: str, chunk_ids: List[str], texts: List[str]) -> str:
+    return content_hash("summary", CHAT_MODEL, doc_id, *chunk_ids, *texts)
+
+async def summarize_document(doc_id: str, chunk_ids: List[str], texts: List[str]) -> Dict:
+    stats = {"groups": 0, "llm_calls": 0, "cached_calls": 0}
+
+    # Whole-document cache: an unchanged document is answered without touching the groups
+    doc_key = document_key(doc_id, chunk_ids, texts)
+    summary = await asyncio.to_thread(summary_cache.get, doc_key)
+    if summary is not None:
+        return {"summary": summary, "cached": True, **stats}
+
+    kind, prompt = await final_prompt(texts, stats)
+    summary = await cached_complete(kind, prompt, stats)
+    await asyncio.to_thread(summary_cache.put, doc_key, summary)
+    return {"summary": summary, "cached": False, **stats}
+
+async def summarize_document_stream(doc_id: str, chunk_ids: List[str], texts: List[str]) -> AsyncIterator[Tuple[str, Dict]]:
+    # Yields ("delta", {"text": ...}) events for the final summary, then ("done", stats)
+    stats = {"groups": 0, "llm_calls": 0, "cached_calls": 0}
+    doc_key = document_key(doc_id, chunk_ids, texts)
+    summary = await asyncio.to_thread(summary_cache.get, doc_key)
+    if summary is not None:
+        yield "delta", {"text": summary}
+        yield "done", {"cached": True, **stats}
+        return
+
+    kind, prompt = await final_prompt(texts, stats)
+    parts = []
+    async for delta in cached_stream(kind, prompt, stats):
+        parts.append(delta)
+        yield "delta", {"text": delta}
+    await asyncio.to_thread(summary_cache.put, doc_key, "".join(parts).strip())
+    yield "done", {"cached": False, **stats}
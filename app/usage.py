@@ -0,0 +1,156 @@
+# Write-behind usage counts: retrievals are counted in memory and flushed to chunk metadata in bulk
+
+import logging
+import os
+import sqlite3
+import threading
+from collections import Counter
+from typing import Dict, Iterable
+from dotenv import load_dotenv
+from app.metrics import stage
+from app.vector_db import get_usage_counts, set_usage_counts
+from app.workers import worker
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+USAGE_FLUSH_SECONDS = float(os.getenv("USAGE_FLUSH_SECONDS", "30"))
+# Ids read and updated per Chroma call during a flush
+USAGE_FLUSH_BATCH = int(os.getenv("USAGE_FLUSH_BATCH", "1000"))
+# Read-only workers flush their counts here; the writer adds them up and writes them to chunk metadata
+USAGE_SPOOL_PATH = os.getenv("USAGE_SPOOL_PATH", "usage_store/spool.sqlite3")
+
+class UsageSpool:
+    def __init__(self, path: str = USAGE_SPOOL_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Several processes write here, so wait for the file lock instead of failing
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS spool (chunk_id TEXT PRIMARY KEY, hits INTEGER NOT NULL)")
+        self.lock = threading.Lock()
+
+    def put(self, deltas: Counter):
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            self.db.executemany(
+                "INSERT INTO spool (chunk_id, hits) VALUES (?, ?) "
+                "ON CONFLICT (chunk_id) DO UPDATE SET hits = hits + excluded.hits", deltas.items()
+            )
+            self.db.execute("COMMIT")
+
+    def take(self) -> Counter:
+        # Read and clear in one transaction, so counts spooled meanwhile wait for the next flush
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self.db.execute("SELECT chunk_id, hits FROM spool").fetchall()
+                self.db.execute("DELETE FROM spool")
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+        return Counter(dict(rows))
+
+class UsageCounter:
+    def __init__(self, flush_seconds: float = USAGE_FLUSH_SECONDS, batch_size: int = USAGE_FLUSH_BATCH,
+                 spool_path: str = USAGE_SPOOL_PATH):
+        self.flush_seconds = flush_seconds
+        self.batch_size = max(1, batch_size)
+        self.spool = UsageSpool(spool_path)
+        self.pending = Counter()
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.totals = {"recorded": 0, "flushed": 0, "spooled": 0, "flushes": 0, "flush_errors": 0}
+
+    def record(self, ids: Iterable[str]):
+        # Request path: one Counter update under a lock, no I/O
+        ids = list(ids)
+        if not ids:
+            return
+        with self.lock:
+            self.pending.update(ids)
+            self.totals["recorded"] += len(ids)
+
+    def pending_count(self, chunk_id: str) -> int:
+        # Retrievals not flushed yet, so responses can show up-to-date counts
+        with self.lock:
+            return self.pending.get(chunk_id, 0)
+
+    def _spool(self) -> int:
+        with self.lock:
+            deltas, self.pending = self.pending, Counter()
+        if not deltas:
+            return 0
+        try:
+            self.spool.put(deltas)
+        except Exception:
+            with self.lock:
+                self.pending.update(deltas)
+                self.totals["flush_errors"] += 1
+            logger.exception("Usage count spool failed; %d ids kept for the next flush", len(deltas))
+            return 0
+        with self.lock:
+            self.totals["spooled"] += len(deltas)
+            self.totals["flushes"] += 1
+        return len(deltas)
+
+    def flush(self) -> int:
+        if not worker.is_writer:
+            return self._spool()
+        with self.flush_lock:
+            with self.lock:
+                deltas, self.pending = self.pending, Counter()
+            try:
+                deltas.update(self.spool.take())
+            except Exception:
+                logger.exception("Reading the usage spool failed; spooled counts are kept for the next flush")
+            if not deltas:
+                return 0
+            ids = list(deltas)
+            flushed = 0
+            try:
+                with stage("usage_flush", items=len(ids)):
+                    for offset in range(0, len(ids), self.batch_size):
+                        page = ids[offset:offset + self.batch_size]
+                        stored = get_usage_counts(page)  # chunks deleted since they were retrieved are dropped
+                        if stored:
+                            set_usage_counts({chunk_id: count + deltas[chunk_id] for chunk_id, count in stored.items()})
+                        for chunk_id in page:
+                            del deltas[chunk_id]
+                        flushed += len(stored)
+            except Exception:
+                # Counts that were not written are kept for the next flush
+                with self.lock:
+                    self.pending.update(deltas)
+                    self.totals["flush_errors"] += 1
+                logger.exception("Usage count flush failed; %d ids kept for the next flush", len(deltas))
+            with self.lock:
+                self.totals["flushed"] += flushed
+                self.totals["flushes"] += 1
+            return flushed
+
+    def _run(self):
+        while not self.stopping.wait(self.flush_seconds):
+            self.flush()
+
+    def start(self):
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._run, name="usage-flush", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        # Final flush so counts recorded since the last one are not lost on shutdown
+        self.stopping.set()
+        if self.thread:
+            self.thread.join(self.flush_seconds)
+            self.thread = None
+        self.flush()
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {"pending_ids": len(self.pending), "pending_hits": sum(self.pending.values()), **self.totals}
+
+usage_counter = UsageCounter()
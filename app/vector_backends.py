@@ -0,0 +1,903 @@
+# Vector store backends. vector_db talks to one collection with Chroma's interface (VectorCollection);
+# "chroma" is the default and "numpy" is an in-process, memory-mapped alternative. Either can be sharded.
+
+import hashlib
+import heapq
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Dict, List, NamedTuple, Optional, Protocol, Sequence, Tuple
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# chroma or numpy
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+NUMPY_STORE_PATH = os.getenv("NUMPY_STORE_PATH", "numpy_store")
+# IVF partitions for the numpy backend (0 = exact search over every row) and partitions scanned per query
+NUMPY_IVF_LISTS = int(os.getenv("NUMPY_IVF_LISTS", "0"))
+NUMPY_IVF_PROBE = int(os.getenv("NUMPY_IVF_PROBE", "8"))
+# Metadata field to shard by (e.g. journal or publish_year; empty = one collection), years per
+# publish_year shard, and threads used to query shards in parallel
+VECTOR_SHARD_KEY = os.getenv("VECTOR_SHARD_KEY", "")
+VECTOR_SHARD_YEAR_BUCKET = int(os.getenv("VECTOR_SHARD_YEAR_BUCKET", "10"))
+VECTOR_SHARD_WORKERS = int(os.getenv("VECTOR_SHARD_WORKERS", "8"))
+
+COLLECTION_NAME = "journal_chunks"
+SHARD_PREFIX = COLLECTION_NAME + "__"
+
+class VectorCollection(Protocol):
+    # The subset of chromadb's Collection that vector_db and the backfills use
+    name: str
+
+    @property
+    def metadata(self) -> Optional[Dict]: ...
+
+    def modify(self, metadata: Dict): ...
+
+    def count(self) -> int: ...
+
+    def peek(self, limit: int = 10) -> Dict: ...
+
+    def add(self, ids: List[str], embeddings: List[List[float]], metadatas: List[Dict], documents: List[str]): ...
+
+    def upsert(self, ids: List[str], embeddings: List[List[float]], metadatas: List[Dict], documents: List[str]): ...
+
+    def update(self, ids: List[str], embeddings: Optional[List[List[float]]] = None,
+               metadatas: Optional[List[Dict]] = None, documents: Optional[List[str]] = None): ...
+
+    def delete(self, ids: List[str]): ...
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[Dict] = None, limit: Optional[int] = None,
+            offset: Optional[int] = None, include: Sequence[str] = ("metadatas", "documents")) -> Dict: ...
+
+    def query(self, query_embeddings: List[List[float]], n_results: int = 10, where: Optional[Dict] = None,
+              include: Sequence[str] = ("metadatas", "documents", "distances")) -> Dict: ...
+
+# Scalar metadata values go into an indexed (key, value, id) table that answers where clauses with index
+# seeks. Strings longer than this (the chunk text) are left out.
+FILTER_VALUE_LIMIT = 256
+
+def filter_fields(chunk_id: str, metadata: Dict) -> List[Tuple[str, str, object]]:
+    return [
+        (chunk_id, key, value) for key, value in metadata.items()
+        if isinstance(value, (bool, int, float)) or (isinstance(value, str) and len(value) <= FILTER_VALUE_LIMIT)
+    ]
+
+OPERATORS = {"$eq": "=", "$ne": "!=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+def where_sql(where: Dict) -> Tuple[str, list]:
+    # Translate a Chroma where clause into a query selecting the matching ids from the fields table
+    selects, params = [], []
+    for key, condition in where.items():
+        if key in ("$and", "$or"):
+            parts = [where_sql(item) for item in condition]
+            compound = (" INTERSECT " if key == "$and" else " UNION ").join(sql for sql, _ in parts)
+            selects.append(f"SELECT id FROM ({compound})")
+            params.extend(param for _, part_params in parts for param in part_params)
+            continue
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for operator, value in condition.items():
+            if operator in ("$in", "$nin"):
+                negate = "NOT " if operator == "$nin" else ""
+                selects.append(f"SELECT id FROM fields WHERE key = ? AND value {negate}IN ({','.join('?' * len(value))})")
+                params.extend([key, *value])
+            elif operator in OPERATORS:
+                selects.append(f"SELECT id FROM fields WHERE key = ? AND value {OPERATORS[operator]} ?")
+                params.extend([key, value])
+            else:
+                raise ValueError(f"Unsupported where operator '{operator}'")
+    return " INTERSECT ".join(selects), params
+
+class IndexState(NamedTuple):
+    # Replaced as a whole on every change, so a query can work on a snapshot without holding the lock
+    generation: Optional[int]
+    matrix: np.ndarray            # rows x dimension, unit-length float32 (memory-mapped)
+    row_ids: np.ndarray           # id per row, None for rows that were deleted or superseded
+    lists: np.ndarray             # IVF partition per row (-1 = unassigned)
+    centroids: Optional[np.ndarray]
+
+class NumpyCollection:
+    """Append-only float32 vector file, memory-mapped and searched with exact cosine top-k.
+
+    Ids, metadata and documents live in a SQLite side store next to it. Rows are never rewritten in
+    place: an upsert appends a new row and the old one becomes dead until compaction. Other processes
+    map the same file read-only (the page cache is shared, nothing is copied) and reload when the
+    generation number in the side store changes. With ivf_lists set, rows are assigned to k-means
+    partitions once there is enough data, and a query scans only the ivf_probe closest partitions.
+    """
+
+    def __init__(self, path: str = NUMPY_STORE_PATH, name: str = COLLECTION_NAME,
+                 ivf_lists: int = NUMPY_IVF_LISTS, ivf_probe: int = NUMPY_IVF_PROBE):
+        self.name = name
+        self.path = path
+        self.ivf_lists = ivf_lists
+        self.ivf_probe = ivf_probe
+        os.makedirs(path, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(path, "meta.sqlite3"), check_same_thread=False, timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " id TEXT PRIMARY KEY, row INTEGER NOT NULL, list INTEGER NOT NULL DEFAULT -1,"
+            " metadata TEXT NOT NULL, document TEXT"
+            ");"
+            "CREATE TABLE IF NOT EXISTS fields ("
+            " id TEXT NOT NULL, key TEXT NOT NULL, value, PRIMARY KEY (key, value, id)"
+            ") WITHOUT ROWID;"
+            "CREATE INDEX IF NOT EXISTS fields_id ON fields (id);"
+            "CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value);"
+        )
+        # Stores written before the fields table existed
+        if not self.db.execute("SELECT 1 FROM fields LIMIT 1").fetchone():
+            for chunk_id, metadata in self.db.execute("SELECT id, metadata FROM chunks").fetchall():
+                self.db.executemany("INSERT OR IGNORE INTO fields (id, key, value) VALUES (?, ?, ?)",
+                                    filter_fields(chunk_id, json.loads(metadata)))
+        self.db.commit()
+        self.lock = threading.Lock()
+        # Vector file replaced by compaction, removed once the new one is committed
+        self.retired_file = None
+        self.state = IndexState(None, np.zeros((0, 0), dtype=np.float32), np.array([], dtype=object),
+                                np.array([], dtype=np.int32), None)
+
+    # --- side store helpers (call with self.lock held) ---
+
+    def _info(self, key: str, default=None):
+        row = self.db.execute("SELECT value FROM info WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_info(self, key: str, value):
+        self.db.execute("INSERT OR REPLACE INTO info (key, value) VALUES (?, ?)", (key, value))
+
+    def _vector_file(self) -> str:
+        return os.path.join(self.path, self._info("vector_file", "vectors-0.f32"))
+
+    def _map(self, vector_file: str, rows: int, dimension: int) -> np.ndarray:
+        if not rows:
+            return np.zeros((0, dimension), dtype=np.float32)
+        return np.memmap(vector_file, dtype=np.float32, mode="r", shape=(rows, dimension))
+
+    def _refresh(self) -> IndexState:
+        # Reload ids and the mapping when another process (or compaction) changed the store
+        generation = int(self._info("generation", 0))
+        if generation == self.state.generation:
+            return self.state
+        if self.db.in_transaction:
+            return self._load(generation)
+        # Read everything from one snapshot; a compaction can remove the file between snapshots, so retry
+        for attempt in range(3):
+            self.db.execute("BEGIN")
+            try:
+                return self._load(int(self._info("generation", 0)))
+            except FileNotFoundError:
+                if attempt == 2:
+                    raise
+            finally:
+                self.db.commit()
+
+    def _load(self, generation: int) -> IndexState:
+        rows = int(self._info("rows", 0))
+        dimension = int(self._info("dimension", 0))
+        row_ids = np.full(rows, None, dtype=object)
+        lists = np.full(rows, -1, dtype=np.int32)
+        for chunk_id, row, partition in self.db.execute("SELECT id, row, list FROM chunks"):
+            row_ids[row] = chunk_id
+            lists[row] = partition
+        centroids = self._info("centroids")
+        if centroids is not None:
+            centroids = np.frombuffer(centroids, dtype=np.float32).reshape(-1, dimension)
+        self.state = IndexState(generation, self._map(self._vector_file(), rows, dimension), row_ids, lists, centroids)
+        return self.state
+
+    def _begin(self) -> IndexState:
+        # Writers from every process are serialized by SQLite's write lock
+        self.db.execute("BEGIN IMMEDIATE")
+        return self._refresh()
+
+    def _commit(self, state: IndexState):
+        generation = int(self._info("generation", 0)) + 1
+        self._set_info("generation", generation)
+        self.db.commit()
+        self.state = state._replace(generation=generation)
+        if self.retired_file:
+            os.remove(self.retired_file)
+            self.retired_file = None
+
+    def _normalize(self, embeddings, state: IndexState) -> np.ndarray:
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.ndim != 2:
+            vectors = vectors.reshape(len(embeddings), -1)
+        dimension = state.matrix.shape[1] or int(self._info("dimension", 0))
+        if dimension and vectors.shape[1] != dimension:
+            raise ValueError(f"Collection expecting embedding with dimension of {dimension}, got {vectors.shape[1]}")
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def _assign(self, vectors: np.ndarray, centroids: Optional[np.ndarray]) -> np.ndarray:
+        if centroids is None or not len(vectors):
+            return np.full(len(vectors), -1, dtype=np.int32)
+        return np.concatenate([
+            np.argmax(vectors[start:start + 65536] @ centroids.T, axis=1)
+            for start in range(0, len(vectors), 65536)
+        ]).astype(np.int32)
+
+    def _append(self, state: IndexState, ids: List[str], vectors: np.ndarray) -> Tuple[IndexState, np.ndarray]:
+        # Write the rows after the last committed one (a crashed writer may have left extra bytes there)
+        rows = len(state.row_ids)
+        dimension = vectors.shape[1]
+        vector_file = self._vector_file()
+        with open(vector_file, "r+b" if os.path.exists(vector_file) else "wb") as handle:
+            handle.seek(rows * dimension * 4)
+            handle.write(np.ascontiguousarray(vectors).tobytes())
+        self._set_info("rows", rows + len(ids))
+        self._set_info("dimension", dimension)
+        lists = self._assign(vectors, state.centroids)
+        state = state._replace(
+            matrix=self._map(vector_file, rows + len(ids), dimension),
+            row_ids=np.concatenate([state.row_ids, np.array(ids, dtype=object)]),
+            lists=np.concatenate([state.lists, lists])
+        )
+        return state, np.arange(rows, rows + len(ids))
+
+    def _kill(self, state: IndexState, rows: Sequence[int]) -> IndexState:
+        rows = [row for row in rows if row < len(state.row_ids)]
+        if not rows:
+            return state
+        row_ids = state.row_ids.copy()
+        row_ids[rows] = None
+        return state._replace(row_ids=row_ids)
+
+    def _existing(self, ids: Sequence[str]) -> Dict[str, Tuple[Dict, Optional[str], int]]:
+        if not ids:
+            return {}
+        placeholders = ",".join("?" * len(ids))
+        rows = self.db.execute(
+            f"SELECT id, metadata, document, row FROM chunks WHERE id IN ({placeholders})", list(ids)
+        ).fetchall()
+        return {chunk_id: (json.loads(metadata), document, row) for chunk_id, metadata, document, row in rows}
+
+    def _index_fields(self, ids: List[str], metadatas: List[Dict]):
+        placeholders = ",".join("?" * len(ids))
+        self.db.execute(f"DELETE FROM fields WHERE id IN ({placeholders})", list(ids))
+        self.db.executemany(
+            "INSERT OR IGNORE INTO fields (id, key, value) VALUES (?, ?, ?)",
+            [field for chunk_id, metadata in zip(ids, metadatas) for field in filter_fields(chunk_id, metadata)]
+        )
+
+    def _write(self, ids: List[str], embeddings, metadatas: List[Dict], documents: List[Optional[str]]):
+        state = self.state
+        try:
+            state = self._begin()
+            vectors = self._normalize(embeddings, state)
+            state = self._kill(state, [row for _, _, row in self._existing(ids).values()])
+            state, rows = self._append(state, ids, vectors)
+            self.db.executemany(
+                "INSERT INTO chunks (id, row, list, metadata, document) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET row = excluded.row, list = excluded.list, "
+                "metadata = excluded.metadata, document = excluded.document",
+                [
+                    (chunk_id, int(row), int(partition), json.dumps(metadata), document)
+                    for chunk_id, row, partition, metadata, document
+                    in zip(ids, rows, state.lists[rows], metadatas, documents)
+                ]
+            )
+            self._index_fields(ids, metadatas)
+            state = self._maintain(state)
+            self._commit(state)
+        except Exception:
+            self.db.rollback()
+            raise
+
+    def _maintain(self, state: IndexState) -> IndexState:
+        # Train (or retrain, after 4x growth) the IVF partitions, and compact once most rows are dead
+        live = int(np.count_nonzero(state.row_ids != None))  # noqa: E711
+        trained = int(self._info("ivf_trained_rows", 0))
+        if self.ivf_lists and live >= self.ivf_lists * 16 and (state.centroids is None or live >= 4 * trained):
+            state = self._train(state, live)
+        dead = len(state.row_ids) - live
+        if dead > 1000 and dead > live:
+            state = self._compact(state)
+        return state
+
+    def _train(self, state: IndexState, live: int) -> IndexState:
+        # Spherical k-means on a sample of live rows, then assign every row to its closest centroid
+        rows = np.flatnonzero(state.row_ids != None)  # noqa: E711
+        rng = np.random.default_rng(0)
+        sample = state.matrix[np.sort(rng.choice(rows, min(len(rows), self.ivf_lists * 64), replace=False))]
+        centroids = sample[rng.choice(len(sample), self.ivf_lists, replace=False)].copy()
+        for _ in range(10):
+            assigned = np.argmax(sample @ centroids.T, axis=1)
+            for partition in range(self.ivf_lists):
+                members = sample[assigned == partition]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[partition] = centroid / (np.linalg.norm(centroid) or 1.0)
+        lists = self._assign(state.matrix, centroids)
+        self.db.executemany(
+            "UPDATE chunks SET list = ? WHERE id = ?", [(int(lists[row]), state.row_ids[row]) for row in rows]
+        )
+        self._set_info("centroids", centroids.tobytes())
+        self._set_info("ivf_trained_rows", live)
+        # Rewrite the file grouped by partition, so a probed partition is read as one contiguous run
+        return self._compact(state._replace(lists=lists, centroids=centroids), rows[np.argsort(lists[rows], kind="stable")])
+
+    def _compact(self, state: IndexState, rows: Optional[np.ndarray] = None) -> IndexState:
+        # Rewrite live rows into a new file; readers still mapping the old one keep a valid view until they reload
+        if rows is None:
+            rows = np.flatnonzero(state.row_ids != None)  # noqa: E711
+        old_file = self._vector_file()
+        generation = int(self._info("generation", 0)) + 1
+        vector_file = f"vectors-{generation}.f32"
+        with open(os.path.join(self.path, vector_file), "wb") as handle:
+            for start in range(0, len(rows), 65536):
+                handle.write(np.ascontiguousarray(state.matrix[rows[start:start + 65536]]).tobytes())
+        row_ids = state.row_ids[rows]
+        self.db.executemany(
+            "UPDATE chunks SET row = ? WHERE id = ?", [(row, chunk_id) for row, chunk_id in enumerate(row_ids)]
+        )
+        self._set_info("vector_file", vector_file)
+        self._set_info("rows", len(rows))
+        self.retired_file = old_file if os.path.exists(old_file) else None
+        return state._replace(
+            matrix=self._map(os.path.join(self.path, vector_file), len(rows), state.matrix.shape[1]),
+            row_ids=row_ids,
+            lists=state.lists[rows]
+        )
+
+    # --- VectorCollection ---
+
+    @property
+    def metadata(self) -> Optional[Dict]:
+        with self.lock:
+            return json.loads(self._info("collection_metadata", "{}"))
+
+    def modify(self, metadata: Dict):
+        with self.lock:
+            self._set_info("collection_metadata", json.dumps(metadata))
+            self.db.commit()
+
+    def count(self) -> int:
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def peek(self, limit: int = 10) -> Dict:
+        return self.get(limit=limit, include=["embeddings", "metadatas", "documents"])
+
+    def add(self, ids: List[str], embeddings: List[List[float]], metadatas: List[Dict], documents: List[str]):
+        # Like Chroma, ids that already exist are left untouched
+        with self.lock:
+            existing = self._existing(ids)
+            keep = [i for i, chunk_id in enumerate(ids) if chunk_id not in existing]
+            if keep:
+                self._write([ids[i] for i in keep], [embeddings[i] for i in keep],
+                            [metadatas[i] for i in keep], [documents[i] for i in keep])
+
+    def upsert(self, ids: List[str], embeddings: List[List[float]], metadatas: List[Dict], documents: List[str]):
+        with self.lock:
+            self._write(list(ids), embeddings, metadatas, documents)
+
+    def update(self, ids: List[str], embeddings: Optional[List[List[float]]] = None,
+               metadatas: Optional[List[Dict]] = None, documents: Optional[List[str]] = None):
+        # Metadata is merged into the stored metadata; unknown ids are ignored
+        with self.lock:
+            existing = self._existing(ids)
+            positions = [i for i, chunk_id in enumerate(ids) if chunk_id in existing]
+            if not positions:
+                return
+            if embeddings is not None:
+                merged_metadatas, merged_documents = [], []
+                for i in positions:
+                    metadata, document, _ = existing[ids[i]]
+                    merged_metadatas.append({**metadata, **(metadatas[i] if metadatas else {})})
+                    merged_documents.append(documents[i] if documents else document)
+                self._write([ids[i] for i in positions], [embeddings[i] for i in positions],
+                            merged_metadatas, merged_documents)
+                return
+            rows = []
+            for i in positions:
+                metadata, document, _ = existing[ids[i]]
+                rows.append((
+                    json.dumps({**metadata, **(metadatas[i] if metadatas else {})}),
+                    documents[i] if documents else document,
+                    ids[i]
+                ))
+            self.db.executemany("UPDATE chunks SET metadata = ?, document = ? WHERE id = ?", rows)
+            self._index_fields([chunk_id for _, _, chunk_id in rows], [json.loads(row[0]) for row in rows])
+            self.db.commit()
+
+    def delete(self, ids: List[str]):
+        with self.lock:
+            try:
+                state = self._begin()
+                rows = [row for _, _, row in self._existing(ids).values()]
+                placeholders = ",".join("?" * len(ids))
+                self.db.execute(f"DELETE FROM chunks WHERE id IN ({placeholders})", list(ids))
+                self.db.execute(f"DELETE FROM fields WHERE id IN ({placeholders})", list(ids))
+                state = self._maintain(self._kill(state, rows))
+                self._commit(state)
+            except Exception:
+                self.db.rollback()
+                raise
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[Dict] = None, limit: Optional[int] = None,
+            offset: Optional[int] = None, include: Sequence[str] = ("metadatas", "documents")) -> Dict:
+        clauses, params = [], []
+        if ids is not None:
+            if not ids:
+                return self._result([], [], [], [], include)
+            clauses.append(f"id IN ({','.join('?' * len(ids))})")
+            params.extend(ids)
+        if where:
+            sql, where_params = where_sql(where)
+            clauses.append(f"id IN ({sql})")
+            params.extend(where_params)
+        query = "SELECT id, row, metadata, document FROM chunks"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY rowid"
+        if limit is not None or offset:
+            query += " LIMIT ? OFFSET ?"
+            params.extend([-1 if limit is None else limit, offset or 0])
+        with self.lock:
+            state = self._refresh()
+            rows = self.db.execute(query, params).fetchall()
+        if ids is not None:
+            position = {chunk_id: i for i, chunk_id in enumerate(ids)}
+            rows.sort(key=lambda row: position[row[0]])
+        return self._result(
+            [row[0] for row in rows],
+            [json.loads(row[2]) for row in rows],
+            [row[3] for row in rows],
+            [np.array(state.matrix[row[1]]) for row in rows] if "embeddings" in include else [],
+            include
+        )
+
+    def _result(self, ids, metadatas, documents, embeddings, include) -> Dict:
+        return {
+            "ids": ids,
+            "metadatas": metadatas if "metadatas" in include else None,
+            "documents": documents if "documents" in include else None,
+            "embeddings": embeddings if "embeddings" in include else None,
+            "include": list(include)
+        }
+
+    def _candidates(self, state: IndexState, query: np.ndarray, allowed: Optional[np.ndarray],
+                    n_results: int) -> Optional[np.ndarray]:
+        # Rows to score for one query: the allowed (filtered) rows or the probed IVF partitions; None = every row
+        if state.centroids is None or not self.ivf_probe:
+            return allowed
+        rows = np.flatnonzero(state.row_ids != None) if allowed is None else allowed  # noqa: E711
+        probe = np.argsort(-(state.centroids @ query))[:self.ivf_probe]
+        probed = rows[np.isin(state.lists[rows], probe)]
+        # A narrow filter can leave too few rows in the probed partitions; scan all allowed rows then
+        return probed if len(probed) >= n_results else allowed
+
+    def _score_rows(self, matrix: np.ndarray, rows: np.ndarray, query: np.ndarray) -> np.ndarray:
+        # Probed IVF partitions are contiguous runs of rows: score long runs on the mapping itself and
+        # gather only the scattered rows (appended since training, or picked out by a filter)
+        scores = np.empty(len(rows), dtype=np.float32)
+        if not len(rows):
+            return scores
+        breaks = np.flatnonzero(np.diff(rows) != 1) + 1
+        starts = np.concatenate([[0], breaks])
+        ends = np.concatenate([breaks, [len(rows)]])
+        long = ends - starts >= 64
+        for start, end in zip(starts[long], ends[long]):
+            scores[start:end] = matrix[rows[start]:rows[end - 1] + 1] @ query
+        positions = np.flatnonzero(np.repeat(~long, ends - starts))
+        if len(positions):
+            scores[positions] = matrix[rows[positions]] @ query
+        return scores
+
+    def _top_k(self, state: IndexState, query: np.ndarray, rows: Optional[np.ndarray], dead: np.ndarray,
+               n_results: int) -> Tuple[np.ndarray, np.ndarray]:
+        if rows is None:
+            # Full scan: one matrix-vector product over the mapped file, dead rows masked out
+            scores = state.matrix @ query
+            scores[dead] = -np.inf
+            top = min(n_results, len(scores) - int(np.count_nonzero(dead)))
+        else:
+            scores = self._score_rows(state.matrix, rows, query)
+            top = min(n_results, len(rows))
+        if top <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        best = np.argpartition(-scores, top - 1)[:top]
+        best = best[np.argsort(-scores[best])]
+        return (best if rows is None else rows[best]), scores[best]
+
+    def query(self, query_embeddings: List[List[float]], n_results: int = 10, where: Optional[Dict] = None,
+              include: Sequence[str] = ("metadatas", "documents", "distances")) -> Dict:
+        with self.lock:
+            state = self._refresh()
+            allowed = None
+            if where:
+                sql, params = where_sql(where)
+                allowed = np.sort(np.array(
+                    [row for row, in self.db.execute(f"SELECT row FROM chunks WHERE id IN ({sql})", params)],
+                    dtype=np.int64
+                ))
+                # Rows committed by another process after our snapshot are not mapped yet
+                allowed = allowed[allowed < len(state.row_ids)]
+        dead = state.row_ids == None  # noqa: E711
+        result_ids, distances, result_rows = [], [], []
+        if state.matrix.shape[1]:
+            for query in self._normalize(query_embeddings, state):
+                rows = self._candidates(state, query, allowed, n_results)
+                rows, scores = self._top_k(state, query, rows, dead, n_results)
+                result_rows.append(rows)
+                result_ids.append([state.row_ids[row] for row in rows])
+                distances.append([float(1.0 - score) for score in scores])
+        else:
+            result_rows = [[] for _ in query_embeddings]
+            result_ids = [[] for _ in query_embeddings]
+            distances = [[] for _ in query_embeddings]
+
+        stored = {}
+        if "metadatas" in include or "documents" in include:
+            with self.lock:
+                stored = self._existing([chunk_id for ids in result_ids for chunk_id in ids])
+        return {
+            "ids": result_ids,
+            "distances": distances if "distances" in include else None,
+            "metadatas": [[stored.get(i, (None, None, None))[0] for i in ids] for ids in result_ids]
+            if "metadatas" in include else None,
+            "documents": [[stored.get(i, (None, None, None))[1] for i in ids] for ids in result_ids]
+            if "documents" in include else None,
+            "embeddings": [[np.array(state.matrix[row]) for row in rows] for rows in result_rows]
+            if "embeddings" in include else None,
+            "include": list(include)
+        }
+
+    def stats(self) -> Dict:
+        with self.lock:
+            state = self._refresh()
+        live = int(np.count_nonzero(state.row_ids != None))  # noqa: E711
+        return {
+            "rows": len(state.row_ids),
+            "live_rows": live,
+            "dead_rows": len(state.row_ids) - live,
+            "dimension": state.matrix.shape[1],
+            "ivf_lists": 0 if state.centroids is None else len(state.centroids),
+            "ivf_probe": self.ivf_probe if state.centroids is not None else 0,
+            "vector_bytes": state.matrix.nbytes
+        }
+
+class BackendStore:
+    # Opens and lists named collections of one backend; a sharded collection keeps one per shard
+    def __init__(self, backend: str = VECTOR_BACKEND):
+        if backend not in ("chroma", "numpy"):
+            raise ValueError(f"Unknown VECTOR_BACKEND '{backend}', expected chroma or numpy")
+        self.backend = backend
+        self.client = None
+        self.system = None
+        if backend == "chroma":
+            # Imported here so the numpy backend runs without chromadb's native dependencies loaded
+            import chromadb
+            os.makedirs("chromadb_store", exist_ok=True)
+            self.client = chromadb.PersistentClient(path="chromadb_store")
+            # client._system looks the system up in chromadb's per-path cache, so keep the one this store
+            # was opened on; close() must stop it even after a newer store replaced it in the cache
+            self.system = self.client._system
+
+    def reopened(self) -> "BackendStore":
+        # Chroma keeps each collection's HNSW index in memory and does not see another process's writes;
+        # a store on a fresh system reloads it from disk. This store and its collections keep working until
+        # close(), so callers swap the new one in and close this one once nothing uses it anymore.
+        # The numpy backend re-reads its files whenever their generation changes, so it has nothing to reload.
+        if self.client is None:
+            return self
+        self.client.clear_system_cache()
+        return BackendStore(self.backend)
+
+    def close(self):
+        if self.system is not None:
+            self.system.stop()
+            self.system = None
+
+    def open(self, name: str, metadata: Optional[Dict] = None) -> VectorCollection:
+        if self.client is not None:
+            return self.client.get_or_create_collection(name=name, metadata={"hnsw:space": "cosine", **(metadata or {})})
+        path = NUMPY_STORE_PATH if name == COLLECTION_NAME else os.path.join(NUMPY_STORE_PATH, "shards", name)
+        collection = NumpyCollection(path, name=name)
+        if metadata and not collection.metadata:
+            collection.modify(metadata)
+        return collection
+
+    def names(self) -> List[str]:
+        if self.client is not None:
+            return [item if isinstance(item, str) else item.name for item in self.client.list_collections()]
+        shards = os.path.join(NUMPY_STORE_PATH, "shards")
+        return [COLLECTION_NAME] + (os.listdir(shards) if os.path.isdir(shards) else [])
+
+def shard_name(value) -> str:
+    # Collection names allow only [a-zA-Z0-9._-]; the digest keeps journals that slug alike apart
+    if value is None:
+        return SHARD_PREFIX + "none"
+    slug = re.sub(r"[^a-z0-9]+", "-", str(value).lower()).strip("-")[:40] or "x"
+    return f"{SHARD_PREFIX}{slug}-{hashlib.sha1(str(value).encode('utf-8')).hexdigest()[:8]}"
+
+def where_conditions(where: Optional[Dict]):
+    # (field, operator, value) conditions that must all hold; $or branches are skipped, which only
+    # means fewer shards can be ruled out
+    for key, condition in (where or {}).items():
+        if key == "$and":
+            for item in condition:
+                yield from where_conditions(item)
+        elif key == "$or":
+            continue
+        elif isinstance(condition, dict):
+            for operator, value in condition.items():
+                yield key, operator, value
+        else:
+            yield key, "$eq", condition
+
+class ShardedCollection:
+    """One collection per value of a shard key (journal, publish_year bucket, ...), used like one collection.
+
+    Writes are routed by the chunk's metadata. Queries go only to the shards a where clause can match,
+    run in parallel, and the per-shard top-k lists are merged by distance. The base collection keeps
+    the collection metadata and any chunks written before sharding was enabled (see reshard).
+    """
+
+    def __init__(self, store: BackendStore, key: str = VECTOR_SHARD_KEY, year_bucket: int = VECTOR_SHARD_YEAR_BUCKET,
+                 workers: int = VECTOR_SHARD_WORKERS):
+        self.store = store
+        self.key = key
+        self.year_bucket = year_bucket
+        self.name = COLLECTION_NAME
+        self.base = store.open(COLLECTION_NAME)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="shard")
+        self.lock = threading.Lock()
+        # name -> (shard key, shard value, collection)
+        self.shards: Dict[str, Tuple[Optional[str], object, VectorCollection]] = {}
+        self.refreshed = 0.0
+        self.base_count = 0
+        self._refresh(force=True)
+
+    def _shard_value(self, metadata: Optional[Dict]):
+        value = (metadata or {}).get(self.key)
+        if value is None or value == "":
+            return None
+        if self.key == "publish_year":
+            return int(value) // self.year_bucket * self.year_bucket
+        return value
+
+    def _refresh(self, force: bool = False) -> Dict:
+        # Shards created by other processes are picked up within a second
+        with self.lock:
+            if force or time.monotonic() - self.refreshed > 1.0:
+                for name in self.store.names():
+                    if name.startswith(SHARD_PREFIX) and name not in self.shards:
+                        shard = self.store.open(name)
+                        metadata = shard.metadata or {}
+                        self.shards[name] = (metadata.get("shard_key"), metadata.get("shard_value"), shard)
+                self.base_count = self.base.count()
+                self.refreshed = time.monotonic()
+            return dict(self.shards)
+
+    def _targets(self, where: Optional[Dict] = None) -> List[VectorCollection]:
+        # Shards whose key value can satisfy where; shards of another key and the base always qualify
+        conditions = [(operator, value) for field, operator, value in where_conditions(where) if field == self.key]
+        targets = [self.base] if self.base_count else []
+        for name, (key, value, shard) in sorted(self._refresh().items()):
+            if key != self.key or all(self._shard_matches(value, operator, operand) for operator, operand in conditions):
+                targets.append(shard)
+        return targets
+
+    def _shard_matches(self, value, operator: str, operand) -> bool:
+        if operator in ("$ne", "$nin"):
+            return True
+        if value is None:
+            # Chunks without the key never match a condition on it
+            return False
+        if operator == "$eq":
+            return self._shard_value({self.key: operand}) == value
+        if operator == "$in":
+            return value in {self._shard_value({self.key: item}) for item in operand}
+        if self.key != "publish_year":
+            return True
+        low, high = value, value + self.year_bucket - 1
+        return {
+            "$gt": high > operand, "$gte": high >= operand, "$lt": low < operand, "$lte": low <= operand
+        }.get(operator, True)
+
+    def _shard_for(self, value) -> VectorCollection:
+        name = shard_name(value)
+        shards = self._refresh()
+        if name not in shards or shards[name][0] != self.key:
+            # A new shard, or one a previous shard key left under the same name (journal_chunks__none is
+            # shared by every key): stamp it with the current key so queries can tell which chunks it holds
+            stamp = {"shard_key": self.key} if value is None else {"shard_key": self.key, "shard_value": value}
+            with self.lock:
+                if name in self.shards:
+                    shard = self.shards[name][2]
+                    # hnsw:* settings are fixed at creation and may not be passed to modify
+                    kept = {
+                        k: v for k, v in (shard.metadata or {}).items()
+                        if not k.startswith("hnsw:") and k not in ("shard_key", "shard_value")
+                    }
+                    shard.modify(metadata={**kept, **stamp})
+                else:
+                    shard = self.store.open(name, stamp)
+                self.shards[name] = (self.key, value, shard)
+                shards = dict(self.shards)
+        return shards[name][2]
+
+    def _fan_out(self, targets: List, call) -> List:
+        if len(targets) == 1:
+            return [call(targets[0])]
+        return list(self.executor.map(call, targets))
+
+    def _everywhere(self) -> List[VectorCollection]:
+        return [self.base] + [shard for _, _, shard in self._refresh().values()]
+
+    def _owners(self, ids: List[str]) -> List[Tuple[VectorCollection, List[int]]]:
+        # Each collection holding some of the ids, with their positions in ids (one id lookup per shard)
+        if not ids:
+            return []
+        position = {chunk_id: i for i, chunk_id in enumerate(ids)}
+        collections = self._everywhere()
+        held = self._fan_out(collections, lambda shard: shard.get(ids=ids, include=[])["ids"])
+        return [
+            (shard, [position[chunk_id] for chunk_id in found]) for shard, found in zip(collections, held) if len(found)
+        ]
+
+    def _write(self, method: str, ids: List[str], embeddings, metadatas: List[Dict], documents: List[str]):
+        routes: Dict[object, List[int]] = {}
+        for i, metadata in enumerate(metadatas):
+            routes.setdefault(self._shard_value(metadata), []).append(i)
+        placed = {}
+        for value, positions in routes.items():
+            shard = self._shard_for(value)
+            getattr(shard, method)(
+                ids=[ids[i] for i in positions],
+                embeddings=[embeddings[i] for i in positions],
+                metadatas=[metadatas[i] for i in positions],
+                documents=[documents[i] for i in positions]
+            )
+            placed[shard.name] = {ids[i] for i in positions}
+        # A chunk whose key value changed (or that predates sharding) is removed from where it was
+        def remove_stale(shard):
+            moved = [chunk_id for chunk_id in ids if chunk_id not in placed.get(shard.name, ())]
+            stale = shard.get(ids=moved, include=[])["ids"] if moved else []
+            if len(stale):
+                shard.delete(ids=list(stale))
+
+        self._fan_out(self._everywhere(), remove_stale)
+
+    # --- VectorCollection ---
+
+    @property
+    def metadata(self) -> Optional[Dict]:
+        return self.base.metadata
+
+    def modify(self, metadata: Dict):
+        self.base.modify(metadata=metadata)
+
+    def count(self) -> int:
+        return sum(self._fan_out(self._everywhere(), lambda shard: shard.count()))
+
+    def peek(self, limit: int = 10) -> Dict:
+        return self.get(limit=limit, include=["embeddings", "metadatas", "documents"])
+
+    def add(self, ids: List[str], embeddings: List[List[float]], metadatas: List[Dict], documents: List[str]):
+        existing = set(self.get(ids=ids, include=[])["ids"])
+        keep = [i for i, chunk_id in enumerate(ids) if chunk_id not in existing]
+        if keep:
+            self._write("add", [ids[i] for i in keep], [embeddings[i] for i in keep],
+                        [metadatas[i] for i in keep], [documents[i] for i in keep])
+
+    def upsert(self, ids: List[str], embeddings: List[List[float]], metadatas: List[Dict], documents: List[str]):
+        self._write("upsert", ids, embeddings, metadatas, documents)
+
+    def update(self, ids: List[str], embeddings: Optional[List[List[float]]] = None,
+               metadatas: Optional[List[Dict]] = None, documents: Optional[List[str]] = None):
+        # Sent only to the shard holding each id; updates are not re-routed, so they must not change the key
+        def pick(values, positions):
+            return None if values is None else [values[i] for i in positions]
+
+        self._fan_out(self._owners(ids), lambda owner: owner[0].update(
+            ids=pick(ids, owner[1]), embeddings=pick(embeddings, owner[1]),
+            metadatas=pick(metadatas, owner[1]), documents=pick(documents, owner[1])
+        ))
+
+    def delete(self, ids: List[str]):
+        self._fan_out(self._owners(ids), lambda owner: owner[0].delete(ids=[ids[i] for i in owner[1]]))
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[Dict] = None, limit: Optional[int] = None,
+            offset: Optional[int] = None, include: Sequence[str] = ("metadatas", "documents")) -> Dict:
+        include = list(include)
+        keys = ["ids"] + [key for key in ("embeddings", "metadatas", "documents") if key in include]
+        merged = {key: [] for key in keys}
+        if ids is not None:
+            pages = self._fan_out(self._targets(where), lambda shard: shard.get(ids=ids, where=where, include=include))
+        else:
+            # Pages run across shards in a fixed order: skip whole shards until offset is reached
+            pages, skip, wanted = [], offset or 0, limit
+            for shard in self._targets(where):
+                if wanted is not None and wanted <= 0:
+                    break
+                if skip:
+                    size = shard.count() if where is None else len(shard.get(where=where, include=[])["ids"])
+                    if size <= skip:
+                        skip -= size
+                        continue
+                page = shard.get(where=where, limit=wanted, offset=skip or None, include=include)
+                skip = 0
+                if wanted is not None:
+                    wanted -= len(page["ids"])
+                pages.append(page)
+        for page in pages:
+            for key in keys:
+                merged[key].extend(page[key] if page[key] is not None else [])
+        if ids is not None:
+            position = {chunk_id: i for i, chunk_id in enumerate(ids)}
+            order = sorted(range(len(merged["ids"])), key=lambda i: position[merged["ids"][i]])
+            merged = {key: [values[i] for i in order] for key, values in merged.items()}
+        return {**{key: None for key in ("embeddings", "metadatas", "documents")}, **merged, "include": list(include)}
+
+    def query(self, query_embeddings: List[List[float]], n_results: int = 10, where: Optional[Dict] = None,
+              include: Sequence[str] = ("metadatas", "documents", "distances")) -> Dict:
+        include = list(dict.fromkeys(list(include) + ["distances"]))
+        results = self._fan_out(self._targets(where), lambda shard: shard.query(
+            query_embeddings=query_embeddings, n_results=n_results, where=where, include=include
+        ))
+        keys = ["ids"] + [key for key in ("distances", "embeddings", "metadatas", "documents") if key in include]
+        merged = {key: [] for key in keys}
+        for row in range(len(query_embeddings)):
+            # Each shard's list is sorted by distance, so a heap merge yields the global top-k
+            best = list(islice(heapq.merge(*[
+                [(distance, shard, i) for i, distance in enumerate(result["distances"][row])]
+                for shard, result in enumerate(results)
+            ]), n_results))
+            for key in keys:
+                merged[key].append([results[shard][key][row][i] for _, shard, i in best])
+        return {**{key: None for key in ("embeddings", "metadatas", "documents")}, **merged, "include": include}
+
+    def reshard(self, page_size: int = 1000) -> int:
+        # Move chunks out of the base collection and out of shards of a previous shard key
+        sources = [self.base] + [shard for key, _, shard in self._refresh(force=True).values() if key != self.key]
+        moved = 0
+        for source in sources:
+            offset = 0
+            while True:
+                page = source.get(
+                    limit=page_size, offset=offset or None, include=["embeddings", "metadatas", "documents"]
+                )
+                if not len(page["ids"]):
+                    break
+                # Chunks already in the shard they belong to (one reused under the same name) stay and are
+                # skipped over; moving the others removes them from the source, so they are not skipped
+                values = [self._shard_value(metadata) for metadata in page["metadatas"]]
+                stay = [i for i, value in enumerate(values) if shard_name(value) == source.name]
+                move = [i for i, value in enumerate(values) if shard_name(value) != source.name]
+                if stay:
+                    self._shard_for(values[stay[0]])
+                if move:
+                    self.upsert(ids=[page["ids"][i] for i in move], embeddings=[page["embeddings"][i] for i in move],
+                                metadatas=[page["metadatas"][i] for i in move],
+                                documents=[page["documents"][i] for i in move])
+                moved += len(move)
+                offset += len(stay)
+        self._refresh(force=True)
+        return moved
+
+    def stats(self) -> Dict:
+        shards = self._refresh()
+        return {
+            "shard_key": self.key,
+            "shards": {name: shard.count() for name, (_, _, shard) in sorted(shards.items())},
+            "unsharded": self.base.count()
+        }
+
+def open_collection(store: BackendStore, shard_key: str = VECTOR_SHARD_KEY) -> VectorCollection:
+    if shard_key:
+        return ShardedCollection(store, shard_key)
+    return store.open(COLLECTION_NAME)
@@ -1,36 +1,359 @@
-import os
-import chromadb
-from typing import List, Dict
+import re
+import threading
+import numpy as np
+from typing import List, Dict, Optional
+from app.catalog import catalog
+from app.compact_vectors import VECTOR_INDEX_DIMENSIONS, VECTOR_RERANK_MULTIPLIER, full_vectors, truncate
+from app.compact_vectors import truncation_supported
+from app.metrics import log_payload, stage
+from app.vector_backends import VECTOR_BACKEND, BackendStore, NumpyCollection, ShardedCollection, VectorCollection
+from app.vector_backends import open_collection
+from app.workers import worker
 
-# Ensure ChromaDB directory exists
-os.makedirs("chromadb_store", exist_ok=True)
+# Chroma's PersistentClient by default, or the memory-mapped numpy store (VECTOR_BACKEND=numpy),
+# split into one collection per VECTOR_SHARD_KEY value when that is set.
+# Opened on first use rather than at import, so a worker can answer health checks while it loads.
+_store: Optional[BackendStore] = None
+_collection: Optional[VectorCollection] = None
+_open_lock = threading.Lock()
 
-# Initialize Chroma client
-client = chromadb.PersistentClient(path="chromadb_store")
-collection = client.get_or_create_collection(name="journal_chunks", metadata={"hnsw:space": "cosine"})
+def get_collection() -> VectorCollection:
+    global _store, _collection
+    if _collection is None:
+        with _open_lock:
+            if _collection is None:
+                _store = BackendStore(VECTOR_BACKEND)
+                _collection = open_collection(_store)
+    return _collection
+
+def warm_collection(collection: VectorCollection):
+    # Loads the ANN index into memory, so the first request does not pay for it
+    sample = collection.peek(1)
+    if sample["embeddings"] is not None and len(sample["embeddings"]):
+        collection.query(query_embeddings=[list(sample["embeddings"][0])], n_results=1, include=[])
+
+def reopen_collection():
+    # Read-only workers: load what the writer process stored since the collection was opened.
+    # Runs in the worker's reload thread: the new store is opened and warmed while requests keep using
+    # the old one, swapped in at once, and the old one is closed after the requests using it finished.
+    global _store, _collection
+    with _open_lock:
+        store = _store
+    if store is None or store.client is None:
+        return
+    fresh = store.reopened()
+    try:
+        collection = open_collection(fresh)
+        warm_collection(collection)
+    except Exception:
+        fresh.close()  # the old store keeps serving; the next publish retries
+        raise
+    with _open_lock:
+        _store, _collection = fresh, collection
+    worker.drain()
+    store.close()
+
+# Each attribute is also stored as its own boolean key (attr_<name>) so Chroma can filter on it
+ATTRIBUTE_PREFIX = "attr_"
+
+def attribute_key(attribute: str) -> str:
+    return ATTRIBUTE_PREFIX + re.sub(r"[^a-z0-9]+", "_", attribute.strip().lower()).strip("_")
+
+def build_where(journal: Optional[str] = None, year_from: Optional[int] = None, year_to: Optional[int] = None,
+                attributes: Optional[List[str]] = None) -> Optional[Dict]:
+    # Chroma where clause for the search filters; every attribute must be present
+    clauses = []
+    if journal:
+        clauses.append({"journal": journal})
+    if year_from is not None:
+        clauses.append({"publish_year": {"$gte": year_from}})
+    if year_to is not None:
+        clauses.append({"publish_year": {"$lte": year_to}})
+    for attribute in attributes or []:
+        clauses.append({attribute_key(attribute): True})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+def _update_collection_metadata(values: Dict):
+    # hnsw:* settings are fixed at creation and may not be passed to modify
+    collection = get_collection()
+    updated = {k: v for k, v in (collection.metadata or {}).items() if not k.startswith("hnsw:")}
+    updated.update(values)
+    collection.modify(metadata=updated)
+
+def check_embedding_provider(provider: str, model: str, dimension: int, record: bool = True):
+    # The collection records which embedder built it; vectors from a different one would give garbage scores.
+    # Read-only workers pass record=False and leave recording to the writer.
+    if VECTOR_INDEX_DIMENSIONS and not truncation_supported(provider, model):
+        raise RuntimeError(
+            f"VECTOR_INDEX_DIMENSIONS={VECTOR_INDEX_DIMENSIONS} truncates embeddings, which only works for "
+            f"text-embedding-3 models; {provider}/{model} vectors would lose recall. Set it to 0."
+        )
+    collection = get_collection()
+    metadata = collection.metadata or {}
+    recorded = (metadata.get("embedding_provider"), metadata.get("embedding_model"), metadata.get("embedding_dimension"))
+    if recorded == (None, None, None):
+        if not record:
+            return
+        _update_collection_metadata(
+            {"embedding_provider": provider, "embedding_model": model, "embedding_dimension": dimension}
+        )
+        return
+    if recorded != (provider, model, dimension):
+        raise RuntimeError(
+            f"Collection '{collection.name}' was built with {recorded[0]}/{recorded[1]} ({recorded[2]} dims) "
+            f"but the configured embedder is {provider}/{model} ({dimension} dims). "
+            f"Switch EMBEDDING_PROVIDER back or clear the vector store and re-ingest."
+        )
+
+    # Collections created before compact storage hold full vectors; check the stored size instead
+    index_dimension = VECTOR_INDEX_DIMENSIONS or dimension
+    recorded_index = metadata.get("embedding_index_dimension")
+    if recorded_index is None and collection.count():
+        recorded_index = len(collection.peek(1)["embeddings"][0])
+    if recorded_index is not None and recorded_index != index_dimension:
+        raise RuntimeError(
+            f"Collection '{collection.name}' stores {recorded_index}-dim vectors but VECTOR_INDEX_DIMENSIONS "
+            f"gives {index_dimension}. Set it back or clear the vector store and re-ingest."
+        )
+    if metadata.get("embedding_index_dimension") is None and record:
+        _update_collection_metadata({"embedding_index_dimension": index_dimension})
+
+def _index_embeddings(ids: List[str], embeddings: List[List[float]]) -> List[List[float]]:
+    # In compact mode the index gets truncated vectors and the full ones go to the re-rank store
+    if not VECTOR_INDEX_DIMENSIONS:
+        return embeddings
+    if full_vectors is not None:
+        full_vectors.put_many(ids, embeddings)
+    return [truncate(embedding, VECTOR_INDEX_DIMENSIONS) for embedding in embeddings]
 
 def add_chunk_to_db(id: str, embedding: List[float], metadata: Dict):
-    print(f"Embedding preview for {id}: {embedding[:5]}") 
-    collection.add(
-        ids=[id],
-        embeddings=[embedding],
-        metadatas=[metadata],
-        documents=[metadata["text"]]
-    )
+    log_payload(f"Embedding preview for {id}", embedding[:5])
+    with stage("vector_write", items=1):
+        get_collection().add(
+            ids=[id],
+            embeddings=_index_embeddings([id], [embedding]),
+            metadatas=[metadata],
+            documents=[metadata["text"]]
+        )
+    worker.publish()
+
+def upsert_chunks_to_db(ids: List[str], embeddings: List[List[float]], metadatas: List[Dict]):
+    # Bulk write: one collection.upsert for the whole batch, so re-uploaded ids replace the stored chunk
+    with stage("vector_write", items=len(ids)):
+        get_collection().upsert(
+            ids=ids,
+            embeddings=_index_embeddings(ids, embeddings),
+            metadatas=metadatas,
+            documents=[metadata["text"] for metadata in metadatas]
+        )
+
+def restore_chunks(ids: List[str], embeddings, metadatas: List[Dict], full_embeddings: Optional[Dict] = None):
+    # Snapshot restore: the vectors are written exactly as the index stored them, so nothing is embedded or truncated
+    with stage("vector_write", items=len(ids)):
+        get_collection().upsert(
+            ids=ids,
+            embeddings=embeddings,
+            metadatas=metadatas,
+            documents=[metadata["text"] for metadata in metadatas]
+        )
+    if full_vectors is not None and full_embeddings:
+        full_vectors.put_many(list(full_embeddings), list(full_embeddings.values()))
+
+def delete_chunks(ids: List[str]):
+    if not ids:
+        return
+    with stage("vector_write", items=len(ids)):
+        get_collection().delete(ids=ids)
+    if full_vectors is not None:
+        full_vectors.remove(ids)
+
+def clear_chunks(page_size: int = 1000) -> int:
+    # Deletes every chunk and its full vector; the collections and the recorded embedder are kept
+    collection = get_collection()
+    removed = 0
+    while True:
+        ids = list(collection.get(limit=page_size, include=[])["ids"])
+        if not ids:
+            break
+        delete_chunks(ids)
+        removed += len(ids)
+    if full_vectors is not None:
+        full_vectors.clear()
+    # Chunks written from now on may lack attr_<name> keys until the backfill ran again
+    _update_collection_metadata({"attribute_keys": False})
+    return removed
+
+def get_content_hashes(ids: List[str]) -> Dict[str, Optional[str]]:
+    # Stored content hash per id (None for chunks written before hashes were recorded); unknown ids are absent
+    if not ids:
+        return {}
+    with stage("vector_get", items=len(ids)):
+        stored = get_collection().get(ids=ids, include=["metadatas"])
+    return {
+        chunk_id: (metadata or {}).get("content_hash") for chunk_id, metadata in zip(stored["ids"], stored["metadatas"])
+    }
+
+def backfill_attribute_keys(page_size: int = 1000) -> int:
+    # Add attr_<name> keys to chunks written before attributes were filterable (runs once per collection)
+    collection = get_collection()
+    if (collection.metadata or {}).get("attribute_keys"):
+        return 0
+    offset = 0
+    while True:
+        page = collection.get(limit=page_size, offset=offset, include=["metadatas"])
+        if not page["ids"]:
+            break
+        metadatas = []
+        for metadata in page["metadatas"]:
+            metadata = dict(metadata or {})
+            for attribute in filter(None, str(metadata.get("attributes") or "").split(",")):
+                metadata[attribute_key(attribute)] = True
+            metadatas.append(metadata)
+        collection.update(ids=page["ids"], metadatas=metadatas)
+        offset += len(page["ids"])
+    _update_collection_metadata({"attribute_keys": True})
+    worker.publish()
+    return offset
+
+def get_usage_counts(ids: List[str]) -> Dict[str, int]:
+    with stage("vector_get", items=len(ids)):
+        stored = get_collection().get(ids=ids, include=["metadatas"])
+    return {
+        chunk_id: int((metadata or {}).get("usage_count") or 0)
+        for chunk_id, metadata in zip(stored["ids"], stored["metadatas"])
+    }
+
+def set_usage_counts(counts: Dict[str, int]):
+    # Metadata updates are merged by Chroma, so only usage_count is sent
+    with stage("vector_write", items=len(counts)):
+        get_collection().update(ids=list(counts), metadatas=[{"usage_count": count} for count in counts.values()])
 
-def query_chunks(embedding: List[float], k: int):
+def get_existing_ids(ids: List[str], where: Optional[Dict] = None) -> List[str]:
+    # Ids from the given list that are already stored and match where (no documents or embeddings are fetched)
+    if not ids:
+        return []
+    return get_collection().get(ids=ids, where=where, include=[])["ids"]
+
+def _query(embeddings: List[List[float]], k: int, where: Optional[Dict], include: List[str]):
+    collection = get_collection()
+    if not VECTOR_INDEX_DIMENSIONS:
+        return collection.query(query_embeddings=embeddings, n_results=k, where=where, include=include)
+    candidates = k * VECTOR_RERANK_MULTIPLIER if full_vectors is not None else k
     results = collection.query(
-        query_embeddings=[embedding],
-        n_results=k,
-        include=["distances", "metadatas", "documents"] 
+        query_embeddings=[truncate(embedding, VECTOR_INDEX_DIMENSIONS) for embedding in embeddings],
+        n_results=candidates,
+        where=where,
+        include=include
     )
-    print(f"Search raw results: {results}") 
+    if full_vectors is None:
+        return results
+    with stage("vector_rerank", items=len(embeddings)):
+        return _rerank(results, embeddings, k)
+
+def _rerank(results: Dict, embeddings: List[List[float]], k: int) -> Dict:
+    # Re-score the index candidates with the full vectors and keep the best k per query.
+    # Index and full-vector distances are not comparable, so a row with any candidate lacking a full vector
+    # (ingested before compact mode) keeps the index distances and vectors for all of its candidates.
+    keys = [key for key in ("ids", "distances", "metadatas", "documents", "embeddings") if results.get(key) is not None]
+    for key in keys:
+        results[key] = list(results[key])
+    for row, embedding in enumerate(embeddings):
+        ids = results["ids"][row]
+        stored = full_vectors.get_many(ids)
+        if len(stored) < len(set(ids)):
+            for key in keys:
+                results[key][row] = list(results[key][row])[:k]
+            continue
+        query = np.asarray(embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        distances = [
+            1.0 - float(stored[chunk_id] @ query) / (float(np.linalg.norm(stored[chunk_id])) or 1.0)
+            for chunk_id in ids
+        ]
+        order = sorted(range(len(ids)), key=distances.__getitem__)[:k]
+        for key in keys:
+            results[key][row] = [results[key][row][i] for i in order]
+        results["distances"][row] = [distances[i] for i in order]
+        if "embeddings" in keys:
+            # Callers comparing chunks to each other (e.g. MMR) get the full vectors as well
+            results["embeddings"][row] = [stored[chunk_id] for chunk_id in results["ids"][row]]
     return results
 
-def get_chunks_by_doc_id(doc_id: str):
-    results = collection.get(
-        where={"source_doc_id": doc_id}
-    )
-    print(f"Debug: get_chunks_by_doc_id('{doc_id}') results: {results}")
+def query_chunks(embedding: List[float], k: int, include_embeddings: bool = False, where: Optional[Dict] = None):
+    include = ["distances", "metadatas", "documents"] + (["embeddings"] if include_embeddings else [])
+    with stage("vector_query", items=1):
+        results = _query([embedding], k, where, include)
+    log_payload("Search raw results", results)
     return results
 
+def query_chunks_batch(embeddings: List[List[float]], k: int, where: Optional[Dict] = None):
+    # One multi-vector query; results are lists aligned with the input embeddings
+    with stage("vector_query", items=len(embeddings)):
+        return _query(embeddings, k, where, ["distances", "metadatas", "documents"])
+
+def get_chunk_ids_by_doc_id(doc_id: str) -> List[str]:
+    # Chunk ids of a document in chunk_index order
+    ids = catalog.chunk_ids(doc_id)
+    if ids:
+        return ids
+    results = get_collection().get(where={"source_doc_id": doc_id}, include=["metadatas"])
+    ordered = sorted(
+        zip(results["ids"], results["metadatas"]),
+        key=lambda item: (item[1] or {}).get("chunk_index", 0)
+    )
+    return [chunk_id for chunk_id, _ in ordered]
+
+def get_chunks_by_ids(ids: List[str]):
+    with stage("vector_get", items=len(ids)):
+        return get_collection().get(ids=ids, include=["metadatas", "documents"])
+
+def get_chunks_page(offset: int, limit: int):
+    # One page of chunk metadata in storage order
+    return get_collection().get(limit=limit, offset=offset, include=["metadatas"])
+
+def get_chunks_with_embeddings(offset: int, limit: int):
+    # One page of everything stored per chunk, in storage order (snapshots)
+    return get_collection().get(limit=limit, offset=offset, include=["embeddings", "metadatas", "documents"])
+
+def collection_metadata() -> Dict:
+    return dict(get_collection().metadata or {})
+
+def mark_attribute_keys():
+    # Chunks restored from a snapshot already carry attr_<name> keys, so the backfill need not run
+    _update_collection_metadata({"attribute_keys": True})
+
+def count_chunks() -> int:
+    return get_collection().count()
+
+def backend_stats() -> Dict:
+    collection = get_collection()
+    stats = {"backend": VECTOR_BACKEND, "chunks": collection.count()}
+    if isinstance(collection, (NumpyCollection, ShardedCollection)):
+        stats.update(collection.stats())
+    return stats
+
+def reshard_collection() -> int:
+    # Route chunks written before sharding (or under another shard key) to their shards
+    collection = get_collection()
+    if not isinstance(collection, ShardedCollection):
+        return 0
+    moved = collection.reshard()
+    if moved:
+        worker.publish()
+    return moved
+
+def get_chunks_by_doc_id(doc_id: str):
+    # The catalog knows the chunk ids, so this is a direct id lookup instead of a where-filter scan
+    ids = catalog.chunk_ids(doc_id)
+    collection = get_collection()
+    with stage("vector_get", items=len(ids)):
+        if ids:
+            results = collection.get(ids=ids)
+        else:
+            results = collection.get(
+                where={"source_doc_id": doc_id}
+            )
+    log_payload(f"get_chunks_by_doc_id('{doc_id}') results", results)
+    return results
@@ -0,0 +1,335 @@
+# Directory-watching ingestion daemon: new or changed chunk dumps dropped into a directory are ingested automatically
+
+import argparse
+import hashlib
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+from dotenv import load_dotenv
+from app.ingestion import batch_chunks, ingest_batch, prune_documents
+from app.models import Chunk
+from app.streaming import read_records
+from app.workers import worker
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Directory to watch; when set, the API process runs the watcher in the background
+WATCH_DIR = os.getenv("WATCH_DIR", "")
+WATCH_LEDGER_PATH = os.getenv("WATCH_LEDGER_PATH", "watch_store/ledger.sqlite3")
+WATCH_POLL_SECONDS = float(os.getenv("WATCH_POLL_SECONDS", "5"))
+# Files modified more recently than this are assumed to still be being written
+WATCH_SETTLE_SECONDS = float(os.getenv("WATCH_SETTLE_SECONDS", "2"))
+WATCH_WORKERS = int(os.getenv("WATCH_WORKERS", "4"))
+# Max files waiting for a worker; the scanner blocks when the queue is full
+WATCH_QUEUE_SIZE = int(os.getenv("WATCH_QUEUE_SIZE", "100"))
+WATCH_SCHEMA_VERSION = os.getenv("WATCH_SCHEMA_VERSION", "1.0")
+WATCH_REPLACE_DOCUMENTS = os.getenv("WATCH_REPLACE_DOCUMENTS", "true").lower() == "true"
+WATCH_SUFFIXES = (".json", ".jsonl", ".ndjson", ".json.gz", ".jsonl.gz", ".ndjson.gz")
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class Ledger:
+    # Processed-files log keyed by path; the stored hash decides whether a file changed since it was ingested
+    def __init__(self, path: str = WATCH_LEDGER_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " path TEXT PRIMARY KEY, sha256 TEXT NOT NULL, size INTEGER NOT NULL, mtime REAL NOT NULL,"
+            " status TEXT NOT NULL, chunks INTEGER NOT NULL DEFAULT 0, failed INTEGER NOT NULL DEFAULT 0,"
+            " inserted INTEGER NOT NULL DEFAULT 0, updated INTEGER NOT NULL DEFAULT 0,"
+            " unchanged INTEGER NOT NULL DEFAULT 0, deleted INTEGER NOT NULL DEFAULT 0, error TEXT,"
+            " started_at REAL, finished_at REAL);"
+            "CREATE INDEX IF NOT EXISTS files_status ON files (status);"
+        )
+        self.db.commit()
+        self.lock = threading.Lock()
+
+    def reset_interrupted(self):
+        # Files that were being processed when the daemon stopped are picked up again
+        with self.lock:
+            self.db.execute("UPDATE files SET status = 'interrupted' WHERE status = 'processing'")
+            self.db.commit()
+
+    def get(self, path: str) -> Optional[Dict]:
+        with self.lock:
+            row = self.db.execute("SELECT sha256, size, mtime, status FROM files WHERE path = ?", (path,)).fetchone()
+        return dict(zip(("sha256", "size", "mtime", "status"), row)) if row else None
+
+    def touch(self, path: str, size: int, mtime: float):
+        # Same content, new size/mtime (e.g. the file was copied over itself): no need to hash it again next scan
+        with self.lock:
+            self.db.execute("UPDATE files SET size = ?, mtime = ? WHERE path = ?", (size, mtime, path))
+            self.db.commit()
+
+    def start(self, path: str, sha256: str, size: int, mtime: float):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO files (path, sha256, size, mtime, status, started_at) "
+                "VALUES (?, ?, ?, ?, 'processing', ?)", (path, sha256, size, mtime, time.time())
+            )
+            self.db.commit()
+
+    def finish(self, path: str, status: str, stats: Dict, error: Optional[str] = None):
+        with self.lock:
+            self.db.execute(
+                "UPDATE files SET status = ?, chunks = ?, failed = ?, inserted = ?, updated = ?, unchanged = ?, "
+                "deleted = ?, error = ?, finished_at = ? WHERE path = ?",
+                (status, stats.get("chunks", 0), stats.get("failed", 0), stats.get("inserted", 0),
+                 stats.get("updated", 0), stats.get("unchanged", 0), stats.get("deleted", 0), error, time.time(), path)
+            )
+            self.db.commit()
+
+    def counts(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.db.execute("SELECT status, COUNT(*) FROM files GROUP BY status").fetchall())
+
+    def recent_failures(self, limit: int = 10) -> List[Dict]:
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT path, status, failed, error, finished_at FROM files "
+                "WHERE status IN ('failed', 'completed_with_errors') ORDER BY finished_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [dict(zip(("path", "status", "failed", "error", "finished_at"), row)) for row in rows]
+
+class DirectoryWatcher:
+    def __init__(self, directory: str, ledger: Optional[Ledger] = None, workers: int = WATCH_WORKERS,
+                 queue_size: int = WATCH_QUEUE_SIZE, schema_version: str = WATCH_SCHEMA_VERSION,
+                 replace_documents: bool = WATCH_REPLACE_DOCUMENTS, settle_seconds: float = WATCH_SETTLE_SECONDS):
+        self.directory = directory
+        self.ledger = ledger or Ledger()
+        self.workers = max(1, workers)
+        self.schema_version = schema_version
+        self.replace_documents = replace_documents
+        self.settle_seconds = settle_seconds
+        self.queue = queue.Queue(maxsize=max(1, queue_size))
+        self.queued = set()  # paths waiting or in progress, so a slow file is not queued twice
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.threads = []
+        self.started = None
+        self.totals = {"files": 0, "failed_files": 0, "chunks": 0, "failed_chunks": 0}
+        self.recent_files = deque(maxlen=10)
+        self.last_scan = {"at": None, "seconds": None, "queued": 0}
+
+    def _candidates(self):
+        for root, _, names in os.walk(self.directory):
+            for name in sorted(names):
+                if name.lower().endswith(WATCH_SUFFIXES):
+                    yield os.path.join(root, name)
+
+    def scan(self) -> int:
+        # Queues new or changed files; blocks while the queue is full, so a bulk drop is fed to workers gradually
+        start = time.perf_counter()
+        settled_before = time.time() - self.settle_seconds
+        queued = 0
+        for path in self._candidates():
+            if self.stopping.is_set():
+                break
+            with self.lock:
+                if path in self.queued:
+                    continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if stat.st_mtime > settled_before:
+                continue
+            entry = self.ledger.get(path)
+            seen = entry is not None and entry["status"] != "interrupted"
+            if seen and (entry["size"], entry["mtime"]) == (stat.st_size, stat.st_mtime):
+                continue
+            sha256 = file_hash(path)
+            if seen and entry["sha256"] == sha256:
+                self.ledger.touch(path, stat.st_size, stat.st_mtime)
+                continue
+            with self.lock:
+                self.queued.add(path)
+            while not self.stopping.is_set():
+                try:
+                    self.queue.put((path, sha256, stat.st_size, stat.st_mtime), timeout=1)
+                    queued += 1
+                    break
+                except queue.Full:
+                    continue
+        self.last_scan = {"at": time.time(), "seconds": round(time.perf_counter() - start, 3), "queued": queued}
+        return queued
+
+    def process(self, path: str, sha256: str, size: int, mtime: float) -> Dict:
+        self.ledger.start(path, sha256, size, mtime)
+        start = time.perf_counter()
+        stats = {"chunks": 0, "failed": 0, "inserted": 0, "updated": 0, "unchanged": 0, "deleted": 0}
+        uploaded = {}
+        error = None
+
+        def chunks():
+            # Invalid records are counted and skipped, like invalid records in an upload job
+            nonlocal error
+            for position, record in enumerate(read_records(path)):
+                try:
+                    chunk = Chunk(**record)
+                except (TypeError, ValueError) as e:
+                    stats["failed"] += 1
+                    error = f"Invalid chunk at position {position}: {e}"
+                    continue
+                uploaded.setdefault(chunk.source_doc_id, set()).add(chunk.id)
+                yield chunk
+
+        try:
+            for batch in batch_chunks(chunks()):
+                try:
+                    batch_stats = ingest_batch(batch, self.schema_version)
+                except Exception as e:
+                    stats["failed"] += len(batch)
+                    error = str(e)
+                    continue
+                for key in ("chunks", "inserted", "updated", "unchanged"):
+                    stats[key] += batch_stats[key]
+            if self.replace_documents and not stats["failed"]:
+                stats["deleted"] = prune_documents(uploaded)
+            status = "completed_with_errors" if stats["failed"] else "completed"
+        except Exception as e:
+            # Unreadable file (bad JSON, I/O error): it is retried once its content changes
+            status, error = "failed", str(e)
+
+        stats["seconds"] = round(time.perf_counter() - start, 3)
+        self.ledger.finish(path, status, stats, error)
+        with self.lock:
+            self.totals["files"] += 1
+            self.totals["failed_files"] += status == "failed"
+            self.totals["chunks"] += stats["chunks"]
+            self.totals["failed_chunks"] += stats["failed"]
+            self.recent_files.append({"path": path, "status": status, **stats})
+        log = logger.warning if status != "completed" else logger.info
+        log("Ingested %s: %s, %d chunks (%d failed) in %ss", path, status, stats["chunks"], stats["failed"],
+            stats["seconds"])
+        return stats
+
+    def _work(self):
+        while not self.stopping.is_set():
+            try:
+                item = self.queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            try:
+                self.process(*item)
+            except Exception:
+                logger.exception("Watcher failed on %s", item[0])
+            finally:
+                with self.lock:
+                    self.queued.discard(item[0])
+                self.queue.task_done()
+
+    def _poll(self, poll_seconds: float):
+        while not self.stopping.is_set():
+            try:
+                self.scan()
+            except Exception:
+                logger.exception("Scan of %s failed", self.directory)
+            self.stopping.wait(poll_seconds)
+
+    def start(self, poll_seconds: float = WATCH_POLL_SECONDS):
+        # Only the process that runs the watcher resets the ledger; read-only workers import it too
+        self.ledger.reset_interrupted()
+        os.makedirs(self.directory, exist_ok=True)
+        self.started = time.perf_counter()
+        self.stopping.clear()
+        self.threads = [
+            threading.Thread(target=self._work, name=f"watch-worker-{n}", daemon=True) for n in range(self.workers)
+        ]
+        self.threads.append(threading.Thread(target=self._poll, args=(poll_seconds,), name="watch-scan", daemon=True))
+        for thread in self.threads:
+            thread.start()
+        logger.info("Watching %s with %d workers", self.directory, self.workers)
+
+    def stop(self, timeout: float = 30):
+        self.stopping.set()
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
+
+    def drain(self):
+        # Wait until every queued file has been processed
+        self.queue.join()
+
+    def stats(self) -> Dict:
+        with self.lock:
+            totals = dict(self.totals)
+            recent_files = list(self.recent_files)
+            in_progress = len(self.queued) - self.queue.qsize()
+        elapsed = time.perf_counter() - self.started if self.started else None
+        return {
+            "directory": self.directory,
+            "running": bool(self.threads),
+            "workers": self.workers,
+            "queue_depth": self.queue.qsize(),
+            "in_progress": max(0, in_progress),
+            **totals,
+            "chunks_per_second": round(totals["chunks"] / elapsed, 1) if elapsed else None,
+            "ledger": self.ledger.counts(),
+            "last_scan": self.last_scan,
+            "recent_files": recent_files,
+            "recent_failures": self.ledger.recent_failures()
+        }
+
+watcher = DirectoryWatcher(WATCH_DIR) if WATCH_DIR else None
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest chunk dumps dropped into a directory")
+    parser.add_argument("--dir", default=WATCH_DIR or "app/static", help="directory to watch")
+    parser.add_argument("--workers", type=int, default=WATCH_WORKERS)
+    parser.add_argument("--poll-seconds", type=float, default=WATCH_POLL_SECONDS)
+    parser.add_argument("--schema-version", default=WATCH_SCHEMA_VERSION)
+    parser.add_argument("--once", action="store_true", help="ingest what is there now, then exit")
+    args = parser.parse_args()
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+    # Only one process may write the stores: refuse to run next to the API's writer
+    try:
+        worker.elect("writer")
+    except RuntimeError as e:
+        parser.exit(1, f"{e}; stop the server or set WATCH_DIR to run the watcher inside it\n")
+
+    # A one-off run is started after the files are in place, so there is nothing to wait to settle
+    daemon = DirectoryWatcher(
+        args.dir, workers=args.workers, schema_version=args.schema_version,
+        settle_seconds=0 if args.once else WATCH_SETTLE_SECONDS
+    )
+    daemon.start(poll_seconds=args.poll_seconds)
+    try:
+        if args.once:
+            # The first scan runs right away; wait for it, then for the queue to empty
+            while daemon.last_scan["at"] is None:
+                time.sleep(0.1)
+            daemon.drain()
+        else:
+            while True:
+                time.sleep(60)
+                stats = daemon.stats()
+                logger.info(
+                    "Watcher: %d files, %d chunks (%s chunks/s), %d queued, %d failed files",
+                    stats["files"], stats["chunks"], stats["chunks_per_second"], stats["queue_depth"],
+                    stats["failed_files"]
+                )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.stop()
+        worker.stop()
+    stats = daemon.stats()
+    logger.info("Ingested %d files, %d chunks, %d failed files", stats["files"], stats["chunks"], stats["failed_files"])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+# Multi-worker serving: one process (the writer) owns ingestion and every other write to the stores;
+# the other workers only read, and reload their in-memory state when the writer publishes new data
+
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+from dotenv import load_dotenv
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory file locks, so only single-worker serving is supported
+    fcntl = None
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Cold-start times are measured from here; app.main imports this module before anything heavy
+IMPORT_STARTED = time.monotonic()
+
+# auto: the first worker to take the writer lock becomes the writer and the others read (one of them
+# takes over if the writer exits); writer / reader: fixed roles, e.g. for separate deployments
+WORKER_ROLE = os.getenv("WORKER_ROLE", "auto")
+WORKER_STATE_DIR = os.getenv("WORKER_STATE_DIR", "worker_state")
+WORKER_TAKEOVER_SECONDS = float(os.getenv("WORKER_TAKEOVER_SECONDS", "5"))
+# How often a reader checks whether the writer published new data
+WORKER_REFRESH_SECONDS = float(os.getenv("WORKER_REFRESH_SECONDS", "1"))
+# A reader rebuilds its stores at most this often however often the writer publishes (every ingest batch),
+# waiting for a moment with no request in flight unless the data is already this much older
+WORKER_RELOAD_SECONDS = float(os.getenv("WORKER_RELOAD_SECONDS", "10"))
+# How long a replaced store is kept open for the requests still using it
+WORKER_DRAIN_SECONDS = float(os.getenv("WORKER_DRAIN_SECONDS", "60"))
+
+class Worker:
+    def __init__(self, role: str = WORKER_ROLE, state_dir: str = WORKER_STATE_DIR,
+                 takeover_seconds: float = WORKER_TAKEOVER_SECONDS, refresh_seconds: float = WORKER_REFRESH_SECONDS,
+                 reload_seconds: float = WORKER_RELOAD_SECONDS, drain_seconds: float = WORKER_DRAIN_SECONDS):
+        if role not in ("auto", "writer", "reader"):
+            raise ValueError(f"Unknown WORKER_ROLE '{role}', expected auto, writer or reader")
+        self.configured_role = role
+        # Until elect() runs (CLI tools, benchmarks) the process writes, as it always has
+        self.role = "reader" if role == "reader" else "writer"
+        self.state_dir = state_dir
+        self.takeover_seconds = takeover_seconds
+        self.refresh_seconds = refresh_seconds
+        self.reload_seconds = reload_seconds
+        self.drain_seconds = drain_seconds
+        self.lock_path = os.path.join(state_dir, "writer.lock")
+        self.generation_path = os.path.join(state_dir, "generation")
+        self.lock_file = None
+        self.lock = threading.Lock()
+        self.generation = None
+        self.reloads = 0
+        # Requests in flight per epoch; drain() starts a new epoch and waits for the older ones
+        self.requests = threading.Condition()
+        self.active = Counter()
+        self.epoch = 0
+        self.reload_callbacks: List[Callable[[], None]] = []
+        self.promote_callbacks: List[Callable[[], None]] = []
+        self.timings: Dict[str, float] = {}
+        self.ready = threading.Event()
+        self.error = None
+        self.stopping = threading.Event()
+        self.thread = None
+        self.reload_thread = None
+
+    @property
+    def is_writer(self) -> bool:
+        return self.role == "writer"
+
+    def _take_lock(self) -> bool:
+        if fcntl is None:
+            return True
+        os.makedirs(self.state_dir, exist_ok=True)
+        handle = open(self.lock_path, "a+")
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        handle.truncate(0)
+        handle.write(str(os.getpid()))
+        handle.flush()
+        self.lock_file = handle
+        return True
+
+    def elect(self, role: Optional[str] = None) -> str:
+        # The lock is held for the life of the process, so it is released even if the writer crashes.
+        # role overrides WORKER_ROLE, e.g. "writer" for a CLI tool that must not write next to a running server.
+        if role is not None:
+            if role not in ("auto", "writer", "reader"):
+                raise ValueError(f"Unknown worker role '{role}', expected auto, writer or reader")
+            self.configured_role = role
+        if self.configured_role == "reader":
+            self.role = "reader"
+        elif self._take_lock():
+            self.role = "writer"
+        elif self.configured_role == "writer":
+            raise RuntimeError(f"Another process holds the writer lock ({self.lock_path})")
+        else:
+            self.role = "reader"
+            self.thread = threading.Thread(target=self._watch_writer, name="writer-takeover", daemon=True)
+            self.thread.start()
+        self.generation = self._read_generation()
+        if not self.is_writer:
+            self.reload_thread = threading.Thread(target=self._watch_generation, name="reload", daemon=True)
+            self.reload_thread.start()
+        logger.info("Worker %d serving as %s", os.getpid(), self.role)
+        return self.role
+
+    def _watch_writer(self):
+        while not self.stopping.wait(self.takeover_seconds):
+            if self._take_lock():
+                self.role = "writer"
+                logger.info("Worker %d took over as writer", os.getpid())
+                for callback in self.promote_callbacks:
+                    callback()
+                return
+
+    def on_promote(self, callback: Callable[[], None]):
+        # Called when a reader takes over as writer
+        self.promote_callbacks.append(callback)
+
+    def on_reload(self, callback: Callable[[], None]):
+        # Called in readers when the writer published new data
+        self.reload_callbacks.append(callback)
+
+    def _read_generation(self) -> int:
+        try:
+            with open(self.generation_path) as handle:
+                return int(handle.read() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def published_generation(self) -> int:
+        # Latest generation the writer published, read from disk (so also current in read-only workers)
+        return self._read_generation()
+
+    def publish(self):
+        # Writer: tell readers that the stores changed (atomic replace, so a reader never sees a partial file)
+        if not self.is_writer:
+            return
+        with self.lock:
+            os.makedirs(self.state_dir, exist_ok=True)
+            generation = self._read_generation() + 1
+            temporary = f"{self.generation_path}.{os.getpid()}"
+            with open(temporary, "w") as handle:
+                handle.write(str(generation))
+            os.replace(temporary, self.generation_path)
+            self.generation = generation
+
+    def _watch_generation(self):
+        # Reader: reloads run in this thread, never in a request. Publishes are coalesced into at most one
+        # reload per reload_seconds, started while no request is in flight (or once the data is that stale)
+        reloaded = changed = 0.0
+        while not self.stopping.wait(self.refresh_seconds):
+            if self.is_writer:
+                return  # took over: the writer's stores are always current
+            if not self.ready.is_set():
+                continue  # the warm-up opens the stores
+            generation = self._read_generation()
+            if generation == self.generation:
+                continue
+            now = time.monotonic()
+            changed = changed or now
+            if now - reloaded < self.reload_seconds:
+                continue
+            if not self.idle() and now - changed < self.reload_seconds:
+                continue
+            self.reload(generation)
+            reloaded, changed = time.monotonic(), 0.0
+
+    def reload(self, generation: int):
+        with self.lock:
+            self.generation = generation
+        for callback in self.reload_callbacks:
+            try:
+                callback()
+            except Exception:
+                logger.exception("Reload after generation %d failed", generation)
+        self.reloads += 1
+
+    def request_started(self) -> int:
+        with self.requests:
+            self.active[self.epoch] += 1
+            return self.epoch
+
+    def request_finished(self, epoch: int):
+        with self.requests:
+            if epoch not in self.active:
+                return  # dropped by a drain that timed out
+            self.active[epoch] -= 1
+            if self.active[epoch] <= 0:
+                del self.active[epoch]
+                self.requests.notify_all()
+
+    def idle(self) -> bool:
+        with self.requests:
+            return not self.active
+
+    def drain(self) -> bool:
+        # Waits until the requests that started before this call finished, e.g. before closing a store they
+        # may still be using. Requests that outlive drain_seconds are no longer waited for.
+        with self.requests:
+            self.epoch += 1
+            current = self.epoch
+            drained = self.requests.wait_for(
+                lambda: all(epoch >= current for epoch in self.active), self.drain_seconds
+            )
+            if not drained:
+                for epoch in [epoch for epoch in self.active if epoch < current]:
+                    del self.active[epoch]
+                logger.warning("Requests still running after %.0fs; closing the old store anyway", self.drain_seconds)
+            return drained
+
+    def mark(self, phase: str):
+        # Seconds from import to this phase of the cold start
+        self.timings[phase] = round(time.monotonic() - IMPORT_STARTED, 3)
+
+    @contextmanager
+    def timed(self, component: str):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.timings[f"warm_up_{component}"] = round(time.monotonic() - started, 3)
+
+    def stop(self):
+        self.stopping.set()
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
+
+    def stats(self) -> Dict:
+        return {
+            "pid": os.getpid(),
+            "role": self.role,
+            "ready": self.ready.is_set(),
+            "error": self.error,
+            "generation": self.generation,
+            "reloads": self.reloads,
+            "cold_start_seconds": dict(self.timings)
+        }
+
+worker = Worker()
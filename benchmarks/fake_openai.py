@@ -0,0 +1,200 @@
+# Local stand-in for the OpenAI embeddings and chat-completions endpoints with configurable latency.
+# Point the app at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1 and any OPENAI_API_KEY.
+
+import argparse
+import base64
+import hashlib
+import json
+import math
+import random
+import re
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_DIMENSIONS = {"text-embedding-3-small": 1536, "text-embedding-3-large": 3072}
+
+# Each token is hashed into every prefix, so (like text-embedding-3) a truncated vector keeps most of the signal
+NESTED_PREFIXES = (64, 256, 1024)
+
+def hash_embedding(text: str, dimension: int) -> list:
+    # Same idea as HashingEmbeddingProvider: deterministic, and similar texts get similar vectors
+    vector = [0.0] * dimension
+    for token in re.findall(r"\w+", text.lower()):
+        digest = hashlib.blake2b(token.encode("utf-8"), digest_size=32).digest()
+        for slot, prefix in enumerate(NESTED_PREFIXES + (dimension,)):
+            bucket = int.from_bytes(digest[slot * 5:slot * 5 + 4], "little") % min(prefix, dimension)
+            vector[bucket] += 1.0 if digest[slot * 5 + 4] & 1 else -1.0
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+def truncate_embedding(vector: list, dimension: int) -> list:
+    # What the `dimensions` parameter does: keep the first dimensions and re-normalize
+    head = vector[:dimension]
+    norm = math.sqrt(sum(value * value for value in head)) or 1.0
+    return [value / norm for value in head]
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    config = {
+        "embedding_latency": 0.0, "embedding_latency_per_input": 0.0, "chat_latency": 0.0,
+        "chat_first_token_latency": 0.0, "jitter": 0.0
+    }
+    counters = {"embedding_requests": 0, "embedding_inputs": 0, "chat_requests": 0}
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _sleep(self, seconds: float):
+        jitter = self.config["jitter"]
+        time.sleep(max(0.0, seconds * (1 + random.uniform(-jitter, jitter))))
+
+    def _send(self, payload: dict, status: int = 200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/stats"):
+            with self.lock:
+                return self._send(dict(self.counters))
+        self._send({"error": {"message": "not found"}}, status=404)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if self.path.endswith("/embeddings"):
+            return self._embeddings(request)
+        if self.path.endswith("/chat/completions"):
+            return self._chat(request)
+        self._send({"error": {"message": f"unknown path {self.path}"}}, status=404)
+
+    def _embeddings(self, request: dict):
+        inputs = request["input"]
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        model = request.get("model", "text-embedding-3-small")
+        full_dimension = DEFAULT_DIMENSIONS.get(model, 1536)
+        dimension = request.get("dimensions") or full_dimension
+        with self.lock:
+            self.counters["embedding_requests"] += 1
+            self.counters["embedding_inputs"] += len(inputs)
+        self._sleep(self.config["embedding_latency"] + self.config["embedding_latency_per_input"] * len(inputs))
+
+        data = []
+        for index, text in enumerate(inputs):
+            vector = hash_embedding(text, full_dimension)
+            if dimension != full_dimension:
+                vector = truncate_embedding(vector, dimension)
+            if request.get("encoding_format") == "base64":
+                vector = base64.b64encode(struct.pack(f"<{dimension}f", *vector)).decode("ascii")
+            data.append({"object": "embedding", "index": index, "embedding": vector})
+        tokens = sum(len(text.split()) for text in inputs)
+        self._send({
+            "object": "list",
+            "data": data,
+            "model": model,
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+        })
+
+    def _chat(self, request: dict):
+        with self.lock:
+            self.counters["chat_requests"] += 1
+        prompt = request["messages"][-1]["content"]
+        content = f"Synthetic answer for a {len(prompt.split())}-word prompt. [Source 1]"
+        tokens = len(prompt.split())
+        if request.get("stream"):
+            return self._chat_stream(request, content)
+        self._sleep(self.config["chat_latency"])
+        self._send({
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "gpt-3.5-turbo"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": {"prompt_tokens": tokens, "completion_tokens": 12, "total_tokens": tokens + 12}
+        })
+
+    def _chat_stream(self, request: dict, content: str):
+        # First token after chat_first_token_latency, the rest of chat_latency spread over the words
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        words = [word + " " for word in content.split(" ")]
+        rest = max(0.0, self.config["chat_latency"] - self.config["chat_first_token_latency"])
+        self._sleep(self.config["chat_first_token_latency"])
+        for position, word in enumerate(words):
+            if position:
+                self._sleep(rest / len(words))
+            last = position == len(words) - 1
+            chunk = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": request.get("model", "gpt-3.5-turbo"),
+                "choices": [{
+                    "index": 0,
+                    "delta": {"content": word.rstrip() if last else word},
+                    "finish_reason": "stop" if last else None
+                }]
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+def start_server(host: str = "127.0.0.1", port: int = 0, embedding_latency: float = 0.0,
+                 embedding_latency_per_input: float = 0.0, chat_latency: float = 0.0,
+                 chat_first_token_latency: float = 0.0, jitter: float = 0.0):
+    # Returns the running server; its base URL is http://host:server.server_port/v1
+    handler = type("ConfiguredFakeOpenAIHandler", (FakeOpenAIHandler,), {
+        "config": {
+            "embedding_latency": embedding_latency,
+            "embedding_latency_per_input": embedding_latency_per_input,
+            "chat_latency": chat_latency,
+            "chat_first_token_latency": chat_first_token_latency,
+            "jitter": jitter
+        },
+        "counters": {"embedding_requests": 0, "embedding_inputs": 0, "chat_requests": 0},
+        "lock": threading.Lock()
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the OpenAI API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--embedding-latency-ms", type=float, default=200)
+    parser.add_argument("--embedding-latency-per-input-ms", type=float, default=0.5)
+    parser.add_argument("--chat-latency-ms", type=float, default=1500)
+    parser.add_argument("--chat-first-token-ms", type=float, default=300)
+    parser.add_argument("--jitter", type=float, default=0.1, help="relative latency jitter, e.g. 0.1 = +/-10%%")
+    args = parser.parse_args()
+
+    server = start_server(
+        args.host, args.port,
+        embedding_latency=args.embedding_latency_ms / 1000,
+        embedding_latency_per_input=args.embedding_latency_per_input_ms / 1000,
+        chat_latency=args.chat_latency_ms / 1000,
+        chat_first_token_latency=args.chat_first_token_ms / 1000,
+        jitter=args.jitter
+    )
+    print(f"Fake OpenAI API on http://{args.host}:{server.server_port}/v1 (Ctrl+C to stop)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,434 @@
+# Benchmark scenarios: upload throughput, similarity-search latency and recall at several collection sizes,
+# and summary/compare latency. OpenAI is replaced by benchmarks/fake_openai.py, and all stores
+# live in a temporary directory, so runs are offline and reproducible.
+#
+#   python -m benchmarks.run --sizes 1000,10000 --out benchmarks/results/run.json
+#   python -m benchmarks.run --baseline benchmarks/results/run.json
+#   python -m benchmarks.run --index-dimensions 256 --full-vector-dtype int8   # compact vector storage
+#   python -m benchmarks.run --vector-backend numpy --ivf-lists 64              # numpy backend vs Chroma
+#   python -m benchmarks.run --shard-key journal                                 # one collection per journal
+#   python -m benchmarks.run --scenarios upload,cold_start --cold-start-workers 4  # uvicorn --workers startup
+#   python -m benchmarks.run --scenarios upload,snapshot                            # snapshot export / restore
+
+import argparse
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+from benchmarks.corpus import JOURNALS, generate_chunks, generate_queries
+from benchmarks.fake_openai import DEFAULT_DIMENSIONS, hash_embedding, start_server
+
+UPLOAD_REQUEST_CHUNKS = 1000
+
+def percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+def latency_summary(seconds) -> dict:
+    millis = [value * 1000 for value in seconds]
+    return {
+        "count": len(millis),
+        "mean_ms": round(sum(millis) / len(millis), 3) if millis else None,
+        "p50_ms": round(percentile(millis, 0.50), 3) if millis else None,
+        "p95_ms": round(percentile(millis, 0.95), 3) if millis else None,
+        "p99_ms": round(percentile(millis, 0.99), 3) if millis else None,
+        "max_ms": round(max(millis), 3) if millis else None
+    }
+
+def timed(call):
+    start = time.perf_counter()
+    response = call()
+    elapsed = time.perf_counter() - start
+    response.raise_for_status()
+    return response, elapsed
+
+def wait_for_job(client, job_id: str, poll_seconds: float = 0.05) -> dict:
+    while True:
+        job = client.get(f"/api/jobs/{job_id}").json()
+        if job["status"] not in ("queued", "running"):
+            return job
+        time.sleep(poll_seconds)
+
+def bench_upload(client, chunks) -> dict:
+    # Requests split documents arbitrarily, so uploads must not prune chunks sent in another request
+    start = time.perf_counter()
+    jobs = []
+    for offset in range(0, len(chunks), UPLOAD_REQUEST_CHUNKS):
+        response = client.put("/api/upload", json={
+            "chunks": chunks[offset:offset + UPLOAD_REQUEST_CHUNKS],
+            "schema_version": "1.0",
+            "replace_documents": False
+        })
+        response.raise_for_status()
+        jobs.append(response.json()["job_id"])
+    accepted = time.perf_counter() - start
+    finished = [wait_for_job(client, job_id) for job_id in jobs]
+    elapsed = time.perf_counter() - start
+    return {
+        "chunks": len(chunks),
+        "failed": sum(job["failed"] for job in finished),
+        "unchanged": sum(job["unchanged"] for job in finished),
+        "accept_seconds": round(accepted, 3),
+        "seconds": round(elapsed, 3),
+        "chunks_per_second": round(len(chunks) / elapsed, 1)
+    }
+
+def bench_search(client, queries, k: int) -> dict:
+    cold, warm = [], []
+    for query in queries:
+        cold.append(timed(lambda: client.post("/api/similarity_search", json={"query": query, "k": k}))[1])
+    # Same queries again: embeddings now come from the cache
+    for query in queries:
+        warm.append(timed(lambda: client.post("/api/similarity_search", json={"query": query, "k": k}))[1])
+    return {"k": k, "cold": latency_summary(cold), "warm": latency_summary(warm)}
+
+def bench_recall(client, chunks, queries, k: int) -> dict:
+    # Recall@k of vector search against exact cosine top-k over the full-precision vectors
+    import numpy as np
+
+    dimension = DEFAULT_DIMENSIONS["text-embedding-3-small"]
+    matrix = np.asarray([hash_embedding(chunk["text"], dimension) for chunk in chunks], dtype=np.float32)
+    ids = [chunk["id"] for chunk in chunks]
+    recalls = []
+    for query in queries:
+        scores = matrix @ np.asarray(hash_embedding(query, dimension), dtype=np.float32)
+        exact = {ids[i] for i in np.argsort(-scores)[:k]}
+        response = client.post("/api/similarity_search", json={"query": query, "k": k, "min_score": -1})
+        found = {match["id"] for match in response.json()["matches"]}
+        recalls.append(len(exact & found) / len(exact))
+    return {"recall_at_k": round(sum(recalls) / len(recalls), 4)}
+
+def bench_vector_query(queries, k: int) -> dict:
+    # The vector store on its own (no HTTP, no embedding call), to compare backends and sharding;
+    # the journal-filtered run is the one shard pruning helps
+    from app.vector_db import build_where, query_chunks
+
+    dimension = DEFAULT_DIMENSIONS["text-embedding-3-small"]
+    embeddings = [hash_embedding(query, dimension) for query in queries]
+    results = {}
+    for name, where in (("vector_query", None), ("vector_query_journal", build_where(journal=JOURNALS[0]))):
+        seconds = []
+        for embedding in embeddings:
+            start = time.perf_counter()
+            query_chunks(embedding, k, where=where)
+            seconds.append(time.perf_counter() - start)
+        results[name] = latency_summary(seconds)
+    return results
+
+def bench_search_modes(client, queries, k: int) -> dict:
+    # Lexical needs no embedding call; hybrid runs after bench_search, so its embeddings are cached
+    results = {}
+    for mode in ("lexical", "hybrid"):
+        seconds = [
+            timed(lambda: client.post("/api/similarity_search", json={"query": query, "k": k, "mode": mode}))[1]
+            for query in queries
+        ]
+        results[mode] = latency_summary(seconds)
+    results["lexical_index"] = client.get("/api/debug/lexical_index").json()
+    return results
+
+def bench_summary(client, doc_ids) -> dict:
+    cold = [timed(lambda: client.get(f"/api/summary/{doc_id}"))[1] for doc_id in doc_ids]
+    warm = [timed(lambda: client.get(f"/api/summary/{doc_id}"))[1] for doc_id in doc_ids]
+    return {"cold": latency_summary(cold), "warm": latency_summary(warm)}
+
+def bench_summary_stream(client, doc_ids) -> dict:
+    # Time-to-first-token vs. total time for streamed (uncached) summaries
+    first_token, total = [], []
+    for doc_id in doc_ids:
+        start = time.perf_counter()
+        with client.stream("GET", f"/api/summary/{doc_id}", params={"stream": "true"}) as response:
+            response.raise_for_status()
+            seen_delta = False
+            for line in response.iter_lines():
+                if not seen_delta and line.startswith("event: delta"):
+                    first_token.append(time.perf_counter() - start)
+                    seen_delta = True
+        total.append(time.perf_counter() - start)
+    return {"time_to_first_token": latency_summary(first_token), "total": latency_summary(total)}
+
+def bench_compare(client, pairs) -> dict:
+    def run():
+        return [
+            timed(lambda: client.post("/api/compare", json={"doc1_id": doc1, "doc2_id": doc2}))[1]
+            for doc1, doc2 in pairs
+        ]
+    cold = run()
+    warm = run()
+    return {"cold": latency_summary(cold), "warm": latency_summary(warm)}
+
+def bench_cold_start(chunks, workers: int, timeout: float = 120) -> dict:
+    # Starts `uvicorn --workers N` on the stores built so far and times the health check, the first and
+    # the last worker reporting ready, and how long a chunk uploaded through the writer takes to show up
+    # in vector search on every worker (requests use fresh connections, so they spread over the workers)
+    import httpx
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    base = f"http://127.0.0.1:{port}"
+    os.makedirs("app/static", exist_ok=True)  # app.main mounts it relative to the working directory
+    env = {**os.environ, "PYTHONPATH": str(REPO_ROOT), "WORKER_ROLE": "auto", "WATCH_DIR": ""}
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--workers", str(workers),
+         "--log-level", "warning"], env=env
+    )
+
+    def poll(path: str):
+        while time.perf_counter() - start < timeout:
+            try:
+                response = httpx.get(base + path, timeout=5)
+                if response.status_code == 200:
+                    return response.json()
+            except httpx.TransportError:
+                pass
+            time.sleep(0.02)
+        raise TimeoutError(f"{path} did not answer within {timeout}s")
+
+    try:
+        poll("/health")
+        health = time.perf_counter() - start
+        poll("/ready")
+        first_ready = time.perf_counter() - start
+        ready = {}
+        while len(ready) < workers:
+            stats = poll("/ready")
+            ready[stats["pid"]] = stats
+        all_ready = time.perf_counter() - start
+
+        probe = {**chunks[0], "id": "cold-start-probe", "source_doc_id": "cold-start-probe",
+                 "text": "quokka zyzzogeton probe chunk written through the writer worker"}
+        uploaded = time.perf_counter()
+        job_id = httpx.put(f"{base}/api/upload", json={"chunks": [probe], "schema_version": "1.0"}).json()["job_id"]
+        while httpx.get(f"{base}/api/jobs/{job_id}").json()["status"] in ("queued", "running"):
+            time.sleep(0.02)
+        ingested = time.perf_counter()
+        consecutive = 0
+        while consecutive < 5 * workers and time.perf_counter() - uploaded < timeout:
+            matches = httpx.post(
+                f"{base}/api/similarity_search", json={"query": probe["text"], "k": 1, "min_score": -1}
+            ).json()["matches"]
+            consecutive = consecutive + 1 if matches and matches[0]["id"] == probe["id"] else 0
+        visible = time.perf_counter()
+    finally:
+        process.terminate()
+        process.wait(30)
+
+    return {
+        "workers": workers,
+        "health_seconds": round(health, 3),
+        "first_ready_seconds": round(first_ready, 3),
+        "all_ready_seconds": round(all_ready, 3),
+        "roles": sorted(stats["role"] for stats in ready.values()),
+        "worker_cold_start_seconds": [stats["cold_start_seconds"] for stats in ready.values()],
+        "ingest_seconds": round(ingested - uploaded, 3),
+        "visible_on_all_workers_seconds": round(visible - ingested, 3)
+    }
+
+def bench_snapshot(client, server, upload: dict) -> dict:
+    # Export through the API, then restore into an empty store in a fresh process (as when seeding a new
+    # node) and compare with the upload, which has to embed every chunk
+    created = client.post("/api/snapshots")
+    created.raise_for_status()
+    snapshot = created.json()
+    workdir = tempfile.mkdtemp(prefix="genai-bench-restore-")
+    embedding_requests = server.RequestHandlerClass.counters["embedding_requests"]
+    start = time.perf_counter()
+    output = subprocess.check_output(
+        [sys.executable, "-m", "app.snapshots", "restore", os.path.abspath(snapshot["path"])],
+        cwd=workdir, env={**os.environ, "PYTHONPATH": str(REPO_ROOT)}, text=True
+    )
+    elapsed = time.perf_counter() - start
+    restored = json.loads(output)
+    return {
+        "chunks": snapshot["chunks"],
+        "size_bytes": snapshot["size_bytes"],
+        "bytes_per_chunk": snapshot["bytes_per_chunk"],
+        "export_seconds": snapshot["seconds"],
+        "restore_seconds": restored["seconds"],
+        "restore_process_seconds": round(elapsed, 3),
+        "restore_chunks_per_second": restored["chunks_per_second"],
+        "upload_chunks_per_second": upload["chunks_per_second"],
+        "restore_embedding_requests": server.RequestHandlerClass.counters["embedding_requests"] - embedding_requests
+    }
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, text=True).strip()
+    except Exception:
+        return None
+
+def compare_with_baseline(results: dict, baseline_path: str):
+    # Print current/baseline ratios for every latency and throughput number present in both runs
+    baseline = json.loads(Path(baseline_path).read_text())
+
+    def walk(current, previous, path):
+        if isinstance(current, dict) and isinstance(previous, dict):
+            for key in current:
+                if key in previous:
+                    walk(current[key], previous[key], f"{path}.{key}" if path else key)
+        elif isinstance(current, list) and isinstance(previous, list):
+            for index, (a, b) in enumerate(zip(current, previous)):
+                walk(a, b, f"{path}[{index}]")
+        elif isinstance(current, (int, float)) and isinstance(previous, (int, float)) and previous:
+            if path.endswith(("_ms", "_per_second", "seconds")):
+                print(f"{path}: {previous} -> {current} ({current / previous:.2f}x)")
+
+    walk(results["results"], baseline["results"], "")
+
+def run_scenarios(client, args, sizes, scenarios, server, out: Path, baseline):
+    chunks = list(generate_chunks(docs=max(sizes) // args.chunks_per_doc + 1, chunks_per_doc=args.chunks_per_doc))
+    queries = generate_queries(args.queries)
+    results = {"upload": [], "search": []}
+
+    loaded = 0
+    for size in sizes:
+        batch = chunks[loaded:size]
+        upload = bench_upload(client, batch)
+        upload["collection_size"] = size
+        loaded = size
+        if "upload" in scenarios:
+            results["upload"].append(upload)
+            print(f"upload to {size}: {upload['chunks_per_second']} chunks/s")
+        if "search" in scenarios:
+            search = bench_search(client, queries, args.k)
+            search.update(bench_search_modes(client, queries, args.k))
+            search.update(bench_recall(client, chunks[:size], queries, args.k))
+            search.update(bench_vector_query(queries, args.k))
+            search["vector_storage"] = client.get("/api/debug/vector_storage").json()
+            search["collection_size"] = size
+            results["search"].append(search)
+            print(f"search at {size}: p50 {search['cold']['p50_ms']} ms, p99 {search['cold']['p99_ms']} ms, "
+                  f"lexical p50 {search['lexical']['p50_ms']} ms, hybrid p50 {search['hybrid']['p50_ms']} ms, "
+                  f"index {search['lexical_index']['size_bytes'] // 1024} KiB, recall@{args.k} {search['recall_at_k']}, "
+                  f"{search['vector_storage']['index_bytes_per_chunk']} index bytes/chunk, "
+                  f"{args.vector_backend} query p50 {search['vector_query']['p50_ms']} ms "
+                  f"({search['vector_query_journal']['p50_ms']} ms with a journal filter)")
+
+    if "upload" in scenarios:
+        # Re-uploading unchanged chunks: content hashes match, so nothing is embedded or written
+        results["reupload"] = bench_upload(client, chunks[:loaded])
+        print(f"re-upload of {loaded}: {results['reupload']['chunks_per_second']} chunks/s, "
+              f"{results['reupload']['unchanged']} unchanged")
+
+    if "snapshot" in scenarios:
+        results["snapshot"] = bench_snapshot(client, server, upload)
+        print(f"snapshot of {loaded}: {results['snapshot']['size_bytes'] // 1024} KiB, export "
+              f"{results['snapshot']['export_seconds']}s, restore {results['snapshot']['restore_chunks_per_second']} "
+              f"chunks/s (upload {upload['chunks_per_second']} chunks/s), "
+              f"{results['snapshot']['restore_embedding_requests']} embedding requests")
+
+    if "cold_start" in scenarios:
+        results["cold_start"] = bench_cold_start(chunks, args.cold_start_workers)
+        print(f"cold start with {args.cold_start_workers} workers: health {results['cold_start']['health_seconds']}s, "
+              f"all ready {results['cold_start']['all_ready_seconds']}s, new chunk visible on all workers "
+              f"{results['cold_start']['visible_on_all_workers_seconds']}s after ingestion")
+
+    doc_ids = sorted({chunk["source_doc_id"] for chunk in chunks[:loaded]})
+    if "summary" in scenarios:
+        results["summary"] = bench_summary(client, doc_ids[:args.summary_docs])
+        print(f"summary: cold p50 {results['summary']['cold']['p50_ms']} ms, warm p50 {results['summary']['warm']['p50_ms']} ms")
+        results["summary_stream"] = bench_summary_stream(client, doc_ids[args.summary_docs:2 * args.summary_docs])
+        print(f"summary (stream): first token p50 {results['summary_stream']['time_to_first_token']['p50_ms']} ms")
+    if "compare" in scenarios:
+        pairs = list(zip(doc_ids[0::2], doc_ids[1::2]))[:args.compare_pairs]
+        results["compare"] = bench_compare(client, pairs)
+        print(f"compare: cold p50 {results['compare']['cold']['p50_ms']} ms, warm p50 {results['compare']['warm']['p50_ms']} ms")
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": vars(args),
+        "upstream_calls": dict(server.RequestHandlerClass.counters),
+        "results": results
+    }
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2))
+    print(f"Results written to {out}")
+
+    if baseline:
+        compare_with_baseline(report, baseline)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the GenAI Research Assistant benchmarks offline")
+    parser.add_argument("--sizes", default="1000,10000", help="collection sizes (chunks) to measure search at")
+    parser.add_argument("--chunks-per-doc", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--summary-docs", type=int, default=5)
+    parser.add_argument("--compare-pairs", type=int, default=3)
+    parser.add_argument("--embedding-latency-ms", type=float, default=200)
+    parser.add_argument("--embedding-latency-per-input-ms", type=float, default=0.5)
+    parser.add_argument("--chat-latency-ms", type=float, default=1500)
+    parser.add_argument("--chat-first-token-ms", type=float, default=300)
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--index-dimensions", type=int, default=0, help="VECTOR_INDEX_DIMENSIONS (0 = full vectors)")
+    parser.add_argument("--full-vector-dtype", default="int8", choices=["float32", "float16", "int8"])
+    parser.add_argument("--rerank-multiplier", type=int, default=4, help="0 disables the full-precision re-rank")
+    parser.add_argument("--vector-backend", default="chroma", choices=["chroma", "numpy"])
+    parser.add_argument("--ivf-lists", type=int, default=0, help="NUMPY_IVF_LISTS for the numpy backend (0 = exact)")
+    parser.add_argument("--ivf-probe", type=int, default=8)
+    parser.add_argument("--shard-key", default="", help="VECTOR_SHARD_KEY, e.g. journal or publish_year")
+    parser.add_argument("--cold-start-workers", type=int, default=2, help="uvicorn workers for the cold_start scenario")
+    parser.add_argument("--scenarios", default="upload,search,summary,compare", help="also: cold_start, snapshot")
+    parser.add_argument("--out", default=None, help="results file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--baseline", default=None, help="previous results file to compare against")
+    args = parser.parse_args()
+
+    sizes = sorted(int(size) for size in args.sizes.split(","))
+    scenarios = set(args.scenarios.split(","))
+    out = Path(args.out) if args.out else REPO_ROOT / "benchmarks" / "results" / f"{time.strftime('%Y%m%d-%H%M%S')}.json"
+    out = out.resolve()
+    baseline = Path(args.baseline).resolve() if args.baseline else None
+
+    server = start_server(
+        embedding_latency=args.embedding_latency_ms / 1000,
+        embedding_latency_per_input=args.embedding_latency_per_input_ms / 1000,
+        chat_latency=args.chat_latency_ms / 1000,
+        chat_first_token_latency=args.chat_first_token_ms / 1000,
+        jitter=args.jitter
+    )
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_port}/v1"
+    os.environ["OPENAI_API_KEY"] = "benchmark"
+    os.environ["VECTOR_INDEX_DIMENSIONS"] = str(args.index_dimensions)
+    os.environ["FULL_VECTOR_DTYPE"] = args.full_vector_dtype
+    os.environ["VECTOR_RERANK"] = "true" if args.rerank_multiplier else "false"
+    os.environ["VECTOR_RERANK_MULTIPLIER"] = str(max(1, args.rerank_multiplier))
+    os.environ["VECTOR_BACKEND"] = args.vector_backend
+    os.environ["NUMPY_IVF_LISTS"] = str(args.ivf_lists)
+    os.environ["NUMPY_IVF_PROBE"] = str(args.ivf_probe)
+    os.environ["VECTOR_SHARD_KEY"] = args.shard_key
+
+    # All stores (chromadb_store, caches, catalog, jobs) are created relative to the working directory
+    workdir = tempfile.mkdtemp(prefix="genai-bench-")
+    os.chdir(workdir)
+
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from app.api import router
+
+    app = FastAPI()
+    app.include_router(router)
+    # Entered as a context manager so all requests share one event loop (and its pooled clients)
+    with TestClient(app) as client:
+        run_scenarios(client, args, sizes, scenarios, server, out, baseline)
+
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -198,55 +198,38 @@
 
 import gradio as gr
 import requests
-from openai import OpenAI
 import plotly.express as px
 import os
+import json
 from dotenv import load_dotenv
 
-# Load API key from .env
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 API_BASE = "http://localhost:8000"
 
-def ask_question(question, top_k=5, min_score=0.3):
-    try:
-        response = requests.post(f"{API_BASE}/api/similarity_search", json={
-            "query": question,
-            "k": top_k,
-            "min_score": min_score
-        })
-        response.raise_for_status()
-        results = response.json().get("matches", [])
-    except Exception as e:
-        return f"Error calling similarity search: {e}", "", None
-
-    if not results:
-        return "No relevant information found.", "", None
-
-    context = ""
-    for idx, chunk in enumerate(results, start=1):
-        context += f"[Source {idx}] {chunk['text']}\n\n"
-        chunk["source_number"] = idx
-
-    prompt = f"""Use the context below to answer the user's question. 
-Cite sources inline using [Source X] format.
-
-{context}
-
-Question: {question}
-Answer:"""
-
-    try:
-        chat_response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7
-        )
-        answer = chat_response.choices[0].message.content.strip()
-    except Exception as e:
-        return f"OpenAI API error: {e}", "", results
-
+def iter_sse(response):
+    # Parse a server-sent event stream into (event, data) pairs
+    event = "message"
+    for line in response.iter_lines(decode_unicode=True):
+        if line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            yield event, json.loads(line[len("data:"):].strip())
+            event = "message"
+
+def stream_text(method, url, **kwargs):
+    # Yields the accumulated text of a streamed endpoint, so Gradio renders it as it arrives
+    with requests.request(method, url, params={"stream": "true"}, stream=True, **kwargs) as res:
+        res.raise_for_status()
+        text = ""
+        for event, data in iter_sse(res):
+            if event == "delta":
+                text += data["text"]
+                yield text
+            elif event == "error":
+                raise RuntimeError(data.get("detail", "stream failed"))
+
+def format_citations(results):
     citations = "Citations:\n"
     for chunk in results:
         idx = chunk["source_number"]
@@ -267,8 +250,37 @@ Answer:"""
             f"- Score: {score:.2f}\n"
             f"- [Link]({link})\n"
         )
+    return citations
+
+def ask_question(question, top_k=5, min_score=0.3):
+    # Retrieval, context selection and generation happen server-side; citations arrive before the answer
+    answer, citations, results = "", "", None
+    try:
+        with requests.post(f"{API_BASE}/api/ask", params={"stream": "true"}, stream=True, json={
+            "question": question,
+            "k": top_k,
+            "min_score": min_score
+        }) as res:
+            res.raise_for_status()
+            if not res.headers.get("content-type", "").startswith("text/event-stream"):
+                yield res.json().get("answer", "No relevant information found."), "", None
+                return
+            for event, data in iter_sse(res):
+                if event == "citations":
+                    results = data["citations"]
+                    citations = format_citations(results)
+                    yield answer, citations, results
+                elif event == "delta":
+                    answer += data["text"]
+                    yield answer, citations, results
+                elif event == "error":
+                    raise RuntimeError(data.get("detail", "stream failed"))
+    except Exception as e:
+        yield f"Error calling ask: {e}", citations, results
+        return
+
+    yield answer.strip(), citations, results
 
-    return answer, citations, results
 
 def plot_chart(chunks):
     if not chunks:
@@ -284,10 +296,16 @@ def plot_chart(chunks):
 
 def get_doc_ids():
     try:
-        res = requests.get(f"{API_BASE}/api/debug/list_all_chunks")
-        res.raise_for_status()
-        metadatas = res.json().get("metadatas", [])
-        doc_ids = list(set(md["source_doc_id"] for md in metadatas if "source_doc_id" in md))
+        doc_ids = []
+        offset = 0
+        while True:
+            res = requests.get(f"{API_BASE}/api/documents", params={"offset": offset, "limit": 1000})
+            res.raise_for_status()
+            page = res.json()
+            doc_ids.extend(doc["doc_id"] for doc in page.get("documents", []))
+            offset += len(page.get("documents", []))
+            if not page.get("documents") or offset >= page.get("total", 0):
+                break
         return sorted(doc_ids)
     except Exception as e:
         print(f"Error fetching doc IDs: {e}")
@@ -295,22 +313,18 @@ def get_doc_ids():
 
 def get_summary(doc_id):
     try:
-        res = requests.get(f"{API_BASE}/api/summary/{doc_id}")
-        res.raise_for_status()
-        return res.json().get("summary", "No summary available.")
+        yield from stream_text("GET", f"{API_BASE}/api/summary/{doc_id}")
     except Exception as e:
-        return f"Error generating summary: {e}"
+        yield f"Error generating summary: {e}"
 
 def compare_docs(doc1, doc2):
     try:
-        res = requests.post(f"{API_BASE}/api/compare", json={
+        yield from stream_text("POST", f"{API_BASE}/api/compare", json={
             "doc1_id": doc1,
             "doc2_id": doc2
         })
-        res.raise_for_status()
-        return res.json().get("comparison", "No comparison available.")
     except Exception as e:
-        return f"Error comparing documents: {e}"
+        yield f"Error comparing documents: {e}"
 
 # Gradio UI
 with gr.Blocks() as demo:
@@ -337,8 +351,8 @@ with gr.Blocks() as demo:
         refresh_docs.click(lambda: gr.update(choices=get_doc_ids()), outputs=doc_id)
 
         def format_summary(doc_id):
-            summary = get_summary(doc_id)
-            return f"### Summary\n\n{summary}"
+            for summary in get_summary(doc_id):
+                yield f"### Summary\n\n{summary}"
 
         sum_btn.click(fn=format_summary, inputs=doc_id, outputs=summary_out)
 
@@ -0,0 +1,36 @@
+# Tests run offline against throwaway stores: every store path is relative to the working directory, so the
+# session works in a temporary one, and the hashing embedder stands in for OpenAI
+
+import atexit
+import os
+import shutil
+import tempfile
+
+os.environ.update({
+    "EMBEDDING_PROVIDER": "hashing",
+    "OPENAI_API_KEY": "test",
+    "ANONYMIZED_TELEMETRY": "False",
+    "VECTOR_INDEX_DIMENSIONS": "0",
+    "JOB_POLL_SECONDS": "0.05",
+    "WATCH_DIR": "",
+    "SNAPSHOT_SEED": ""
+})
+_workdir = tempfile.mkdtemp(prefix="genai-tests-")
+os.chdir(_workdir)
+atexit.register(shutil.rmtree, _workdir, True)
+
+import pytest
+from app.models import Chunk
+
+@pytest.fixture
+def make_chunks():
+    def make(doc_id: str, count: int, text: str = "chunk {index} of {doc_id}", journal: str = "Test Journal"):
+        return [
+            Chunk(
+                id=f"{doc_id}-{index}", source_doc_id=doc_id, chunk_index=index, section_heading="Results",
+                journal=journal, publish_year=2024, usage_count=0, attributes=["open access"],
+                text=text.format(index=index, doc_id=doc_id)
+            )
+            for index in range(count)
+        ]
+    return make
@@ -0,0 +1,54 @@
+import time
+import pytest
+from app.jobs import JobManager
+from app.vector_db import get_chunks_by_ids
+from app.workers import worker
+
+@pytest.fixture
+def manager(tmp_path):
+    manager = JobManager(str(tmp_path / "jobs.sqlite3"), workers=2)
+    yield manager
+    manager.stop()
+    manager.executor.shutdown(wait=True)
+
+def wait_for(manager, job_id, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = manager.status(job_id)
+        if status["status"] not in ("queued", "running") and job_id not in manager.running:
+            return status
+        time.sleep(0.05)
+    raise AssertionError(f"Job {job_id} did not finish: {manager.status(job_id)}")
+
+def test_submit_chunks_ingests_every_chunk(manager, make_chunks):
+    chunks = make_chunks("jobs-submit", 5)
+    status = wait_for(manager, manager.submit_chunks(chunks, "1.0"))
+    assert status["status"] == "completed"
+    assert (status["total"], status["done"], status["failed"], status["inserted"]) == (5, 5, 0, 5)
+    assert sorted(get_chunks_by_ids([chunk.id for chunk in chunks])["ids"]) == sorted(chunk.id for chunk in chunks)
+
+def test_resubmitted_document_is_a_delta(manager, make_chunks):
+    wait_for(manager, manager.submit_chunks(make_chunks("jobs-delta", 3), "1.0"))
+    status = wait_for(manager, manager.submit_chunks(make_chunks("jobs-delta", 2), "1.0"))
+    assert (status["inserted"], status["updated"], status["unchanged"], status["deleted"]) == (0, 0, 2, 1)
+
+def test_reader_leaves_job_queued_with_its_chunks(manager, make_chunks, monkeypatch):
+    monkeypatch.setattr(worker, "role", "reader")
+    job_id = manager.submit_chunks(make_chunks("jobs-reader", 4), "1.0")
+    time.sleep(0.2)
+    status = manager.status(job_id)
+    assert (status["status"], status["total"]) == ("queued", 4)
+    assert manager._query("SELECT COUNT(*) FROM job_chunks WHERE job_id = ?", (job_id,))[0][0] == 4
+
+    monkeypatch.setattr(worker, "role", "writer")
+    manager.start()
+    status = wait_for(manager, job_id)
+    assert (status["status"], status["done"], status["inserted"]) == ("completed", 4, 4)
+
+def test_poll_never_dispatches_a_job_before_its_chunks(manager, make_chunks):
+    # Jobs queued by read-only workers are only picked up by the writer's poll thread, which runs meanwhile
+    manager.start()
+    job_ids = [manager._create("1.0", chunks=make_chunks(f"jobs-poll-{n}", 3)) for n in range(10)]
+    for job_id in job_ids:
+        status = wait_for(manager, job_id)
+        assert (status["status"], status["total"], status["done"]) == ("completed", 3, 3)
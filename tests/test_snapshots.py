@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from app import snapshots
+from app.catalog import catalog
+from app.ingestion import ingest_chunks
+from app.lexical import lexical_index
+from app.snapshots import export_snapshot, restore_snapshot, snapshot_info
+from app.vector_db import clear_chunks, count_chunks, get_collection
+
+@pytest.fixture
+def store(make_chunks):
+    # Starts every test from an empty store holding one document (doc-a)
+    clear_chunks()
+    catalog.clear()
+    lexical_index.clear()
+    ingest_chunks(make_chunks("doc-a", 6, text="alpha chunk {index} about soil nitrogen"), "1.0")
+    return get_collection()
+
+def embeddings(collection, ids):
+    data = collection.get(ids=ids, include=["embeddings"])
+    return dict(zip(data["ids"], np.asarray(data["embeddings"])))
+
+def test_export_then_restore_replaces_the_store(store, make_chunks, tmp_path):
+    path = str(tmp_path / "a.snapshot")
+    exported = export_snapshot(path, page_size=4)
+    assert exported["chunks"] == 6 and snapshot_info(path)["chunks"] == 6
+    before = embeddings(store, catalog.chunk_ids("doc-a"))
+    ingest_chunks(make_chunks("doc-b", 3, text="beta chunk {index} about maize yield"), "1.0")
+
+    result = restore_snapshot(path, batch_size=4, replace=True)
+    assert (result["chunks"], result["replaced"], result["removed"]) == (6, True, 9)
+    assert count_chunks() == 6
+    assert catalog.chunk_ids("doc-b") == [] and len(catalog.chunk_ids("doc-a")) == 6
+    assert lexical_index.search("maize", 5) == [] and len(lexical_index.search("nitrogen", 10)) == 6
+    after = embeddings(get_collection(), list(before))
+    assert all(np.allclose(before[chunk_id], after[chunk_id]) for chunk_id in before)
+
+def test_merge_restore_keeps_other_chunks(store, make_chunks, tmp_path):
+    path = str(tmp_path / "a.snapshot")
+    export_snapshot(path)
+    ingest_chunks(make_chunks("doc-b", 3), "1.0")
+    result = restore_snapshot(path, replace=False)
+    assert (result["replaced"], result["removed"]) == (False, 0)
+    assert count_chunks() == 9 and len(catalog.chunk_ids("doc-b")) == 3
+
+def test_corrupt_snapshot_leaves_the_store_alone(store, tmp_path):
+    path = tmp_path / "a.snapshot"
+    export_snapshot(str(path))
+    data = bytearray(path.read_bytes())
+    data[100] ^= 0xFF  # inside the vector block
+    path.write_bytes(bytes(data))
+    with pytest.raises(ValueError, match="corrupt"):
+        restore_snapshot(str(path), replace=True)
+    assert count_chunks() == 6
+
+def test_export_fails_when_the_store_changes_meanwhile(store, tmp_path, monkeypatch):
+    generations = iter([1, 2])
+    monkeypatch.setattr(snapshots.worker, "published_generation", lambda: next(generations))
+    with pytest.raises(RuntimeError, match="changed during the export"):
+        export_snapshot(str(tmp_path / "a.snapshot"))
+    assert not list(tmp_path.iterdir())
@@ -0,0 +1,61 @@
+import gzip
+import json
+import httpx
+import pytest
+from app import streaming
+from app.clients import HTTP_FETCH_CONCURRENCY, http_fetch_slots
+from app.streaming import decode_stream, decompress_stream, iter_json_records, read_records, stream_records
+
+RECORDS = [{"id": f"c{n}", "text": f"café über [{n}], {{}} \"quoted\"\n"} for n in range(5)]
+
+def pieces(data: bytes, size: int):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+def parse(data: bytes, size: int):
+    return list(iter_json_records(decode_stream(decompress_stream(pieces(data, size)))))
+
+@pytest.mark.parametrize("size", [1, 3, 64, 1 << 20])
+def test_json_array_split_anywhere(size):
+    data = json.dumps(RECORDS, indent=2, ensure_ascii=False).encode("utf-8")
+    assert parse(data, size) == RECORDS
+
+@pytest.mark.parametrize("size", [1, 7, 1 << 20])
+def test_ndjson_with_blank_lines_and_no_trailing_newline(size):
+    data = "\n\n".join(json.dumps(record, ensure_ascii=False) for record in RECORDS).encode("utf-8")
+    assert parse(b"\n" + data, size) == RECORDS
+
+@pytest.mark.parametrize("size", [1, 5, 1 << 20])
+def test_gzip_and_byte_order_mark(size):
+    data = gzip.compress(b"\xef\xbb\xbf" + json.dumps(RECORDS).encode("utf-8"))
+    assert parse(data, size) == RECORDS
+
+@pytest.mark.parametrize("data", [b"", b" \n ", b"[]", b"[ ]"])
+def test_empty_input(data):
+    assert parse(data, 1) == []
+
+def test_truncated_array_raises():
+    data = json.dumps(RECORDS).encode("utf-8")[:-20]
+    with pytest.raises(ValueError):
+        parse(data, 8)
+
+def test_read_records_from_gzip_file(tmp_path):
+    path = tmp_path / "dump.jsonl.gz"
+    path.write_bytes(gzip.compress("\n".join(json.dumps(record) for record in RECORDS).encode("utf-8")))
+    assert list(read_records(str(path))) == RECORDS
+
+def test_stream_records_releases_the_fetch_slot(monkeypatch):
+    body = json.dumps(RECORDS).encode("utf-8")
+    client = httpx.Client(transport=httpx.MockTransport(lambda request: httpx.Response(200, content=body)))
+    monkeypatch.setattr(streaming, "http_client", client)
+    assert list(stream_records("http://dumps.test/chunks.json")) == RECORDS
+    # Every slot is free again once the download finished
+    taken = [http_fetch_slots.acquire(timeout=1) for _ in range(HTTP_FETCH_CONCURRENCY)]
+    for _ in range(sum(taken)):
+        http_fetch_slots.release()
+    assert all(taken)
+
+def test_stream_records_raises_on_http_error(monkeypatch):
+    client = httpx.Client(transport=httpx.MockTransport(lambda request: httpx.Response(404)))
+    monkeypatch.setattr(streaming, "http_client", client)
+    with pytest.raises(httpx.HTTPStatusError):
+        list(stream_records("http://dumps.test/missing.json"))
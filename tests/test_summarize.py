@@ -0,0 +1,57 @@
+import asyncio
+import pytest
+from app import summarize
+from app.summarize import group_texts, summarize_document
+
+def texts(prefix: str, count: int, words: int = 300):
+    return [f"{prefix} chunk {index} " + "word " * words for index in range(count)]
+
+@pytest.fixture
+def prompts(monkeypatch):
+    sent = []
+
+    async def complete(prompt, **kwargs):
+        sent.append(prompt)
+        return f"summary {len(sent)}"
+
+    monkeypatch.setattr(summarize, "acomplete", complete)
+    return sent
+
+def summarize_texts(doc_id: str, chunk_texts):
+    return asyncio.run(summarize_document(doc_id, [f"{doc_id}-{i}" for i in range(len(chunk_texts))], chunk_texts))
+
+def test_groups_respect_chunk_and_token_limits():
+    assert [len(group) for group in group_texts(["a"] * 10, max_chunks=4, max_tokens=100)] == [4, 4, 2]
+    # 40-character texts are 10 tokens each
+    assert [len(group) for group in group_texts(["x" * 40] * 5, max_chunks=10, max_tokens=25)] == [2, 2, 1]
+    assert group_texts(["x" * 400], max_chunks=4, max_tokens=10) == [["x" * 400]]
+    assert group_texts([]) == []
+
+def test_edit_keeps_the_groups_before_it():
+    original = texts("edit", 20, words=40)
+    edited = list(original)
+    edited[13] = "edited " + edited[13]
+    before, after = group_texts(original, max_chunks=4), group_texts(edited, max_chunks=4)
+    assert before[:3] == after[:3] and before[4:] == after[4:] and before[3] != after[3]
+
+def test_repeated_request_is_served_from_the_document_cache(prompts):
+    chunk_texts = texts("repeat", 24)
+    first = summarize_texts("sum-repeat", chunk_texts)
+    assert (first["cached"], first["groups"], first["llm_calls"]) == (False, 3, 4)
+    second = summarize_texts("sum-repeat", chunk_texts)
+    assert (second["cached"], second["summary"], len(prompts)) == (True, first["summary"], 4)
+
+def test_appended_groups_reuse_the_cached_ones(prompts):
+    chunk_texts = texts("append", 24)
+    summarize_texts("sum-append", chunk_texts)
+    # Going from 3 to 4 groups: only the new group and the reduce step call the LLM
+    result = summarize_texts("sum-append", chunk_texts + texts("appended", 8))
+    assert (result["cached"], result["groups"], result["cached_calls"], result["llm_calls"]) == (False, 4, 3, 2)
+    assert "Part 4 of 4" in prompts[-1]
+
+def test_edited_chunk_resummarizes_only_its_group(prompts):
+    chunk_texts = texts("change", 24)
+    summarize_texts("sum-change", chunk_texts)
+    chunk_texts[10] = chunk_texts[10].replace("word", "term")
+    result = summarize_texts("sum-change", chunk_texts)
+    assert (result["cached_calls"], result["llm_calls"]) == (2, 2)